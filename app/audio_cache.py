@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+DEFAULT_CACHE_FOLDER = "/app/cache/tts"
+DEFAULT_MAX_SIZE_MB = 2048
+
+# Short lines (scene breaks, "Chapter N" headings, ...) repeat a lot inside a book, keep those in memory as well
+MEMORY_TEXT_LIMIT = 80
+MEMORY_MAX_ENTRIES = 1024
+
+
+def link_or_copy(source: Path, target: Path):
+    # Audio files are never modified in place, so a hard link is as good as a copy
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def payload_cache_key(payload: dict, backend: str, **extra) -> str:
+    key_source = json.dumps(
+        {"backend": backend, "payload": payload, **extra},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    def __init__(self, folder: Path, max_size_bytes: int, enabled: bool = True):
+        self.folder = Path(folder)
+        self.max_size_bytes = max_size_bytes
+        self.enabled = enabled
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self.total_size = 0
+        self.memory = OrderedDict()  # key -> bytes, only for short inputs
+        self.in_flight = {}  # key -> threading.Event of the thread producing it
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+
+        if self.enabled:
+            self.load_index()
+
+    def load_index(self):
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        files = []
+        for path in self.folder.glob("*/*.audio"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+
+        # Oldest access first, so the OrderedDict starts out in LRU order
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_size += size
+
+        print(f"🗄️ TTS cache: {len(self.entries)} entries ({self.total_size / 1024 / 1024:.1f} MB) in {self.folder}")
+
+    def path_for(self, key: str) -> Path:
+        return self.folder / key[:2] / f"{key}.audio"
+
+    def contains(self, key: str) -> bool:
+        # Lookup without touching the LRU order or the hit counters
+        with self.lock:
+            return self.enabled and (key in self.memory or key in self.entries)
+
+    def get(self, key: str) -> bytes | None:
+        if not self.enabled:
+            return None
+
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return data
+
+            if key not in self.entries:
+                return None
+
+        path = self.path_for(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # persist the LRU order across runs
+        except FileNotFoundError:
+            with self.lock:
+                size = self.entries.pop(key, None)
+                if size is not None:
+                    self.total_size -= size
+            return None
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.hits += 1
+
+        return data
+
+    def put(self, key: str, data: bytes, text_length: int = 0):
+        if not self.enabled or not data:
+            return
+
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+
+        self.add_entry(key, len(data), data if text_length <= MEMORY_TEXT_LIMIT else None)
+
+    def get_file(self, key: str, target_path: Path) -> bool:
+        # Streaming counterpart of get(), the cached audio is linked to target_path instead of read into memory
+        if not self.enabled:
+            return False
+
+        with self.lock:
+            if key not in self.entries:
+                return False
+
+        path = self.path_for(key)
+        try:
+            target_path.unlink(missing_ok=True)
+            link_or_copy(path, target_path)
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                size = self.entries.pop(key, None)
+                if size is not None:
+                    self.total_size -= size
+            return False
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.hits += 1
+
+        return True
+
+    def put_file(self, key: str, source_path: Path):
+        if not self.enabled:
+            return
+
+        size = source_path.stat().st_size
+        if size == 0:
+            return
+
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        temp_path.unlink(missing_ok=True)
+        link_or_copy(source_path, temp_path)
+        os.replace(temp_path, path)
+
+        self.add_entry(key, size)
+
+    def add_entry(self, key: str, size: int, data: bytes = None):
+        evicted = []
+        with self.lock:
+            previous_size = self.entries.pop(key, None)
+            if previous_size is not None:
+                self.total_size -= previous_size
+            self.entries[key] = size
+            self.total_size += size
+
+            if data is not None:
+                self.memory[key] = data
+                while len(self.memory) > MEMORY_MAX_ENTRIES:
+                    self.memory.popitem(last=False)
+
+            while self.total_size > self.max_size_bytes and len(self.entries) > 1:
+                evicted_key, evicted_size = self.entries.popitem(last=False)
+                self.total_size -= evicted_size
+                self.memory.pop(evicted_key, None)
+                evicted.append(evicted_key)
+
+        for evicted_key in evicted:
+            self.path_for(evicted_key).unlink(missing_ok=True)
+
+    def get_or_create(self, key: str, create, text_length: int = 0) -> bytes:
+        if not self.enabled:
+            return create()
+
+        def create_and_put():
+            data = create()
+            self.put(key, data, text_length)
+            return data
+
+        return self.get_or_produce(key, lambda: self.get(key), create_and_put)
+
+    def get_or_create_file(self, key: str, create_file, target_path: Path) -> Path:
+        # create_file(target_path) writes the audio to target_path, which the caller owns either way
+        if not self.enabled:
+            return create_file(target_path)
+
+        def create_and_put():
+            create_file(target_path)
+            self.put_file(key, target_path)
+            return target_path
+
+        return self.get_or_produce(key, lambda: target_path if self.get_file(key, target_path) else None,
+                                   create_and_put)
+
+    def get_or_produce(self, key: str, lookup, create):
+        while True:
+            result = lookup()
+            if result is not None:
+                return result
+
+            with self.lock:
+                event = self.in_flight.get(key)
+                is_owner = event is None
+                if is_owner:
+                    event = threading.Event()
+                    self.in_flight[key] = event
+
+            if not is_owner:
+                # Same payload is already being synthesized by another worker, reuse its result
+                event.wait()
+                continue
+
+            try:
+                with self.lock:
+                    self.misses += 1
+                return create()
+            finally:
+                with self.lock:
+                    self.in_flight.pop(key, None)
+                event.set()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "size_bytes": self.total_size
+            }
+
+
+def create_audio_cache(config: dict) -> AudioCache:
+    cache_config = config.get("audio_cache", {})
+    return AudioCache(
+        Path(cache_config.get("folder", DEFAULT_CACHE_FOLDER)),
+        int(cache_config.get("max_size_mb", DEFAULT_MAX_SIZE_MB) * 1024 * 1024),
+        cache_config.get("enabled", True)
+    )
+
+
+def print_cache_report(cache: AudioCache, stats_at_start: dict, label: str):
+    # Lookups between stats_at_start and now, books converted at the same time share the counters
+    if not cache.enabled:
+        return
+
+    stats = cache.stats()
+    hits = stats["hits"] - stats_at_start["hits"]
+    memory_hits = stats["memory_hits"] - stats_at_start["memory_hits"]
+    misses = stats["misses"] - stats_at_start["misses"]
+    lookups = hits + misses
+    hit_rate = round(hits / lookups * 100) if lookups else 0
+
+    print(
+        f"🗄️ TTS cache ({label}): {hits} hits ({memory_hits} from memory), {misses} misses ({hit_rate}% hit rate) | "
+        f"{stats['entries']} entries, {stats['size_bytes'] / 1024 / 1024:.1f} MB")
@@ -0,0 +1,208 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+
+class HostState:
+    def __init__(self, host: str):
+        self.host = host
+        self.in_flight = 0
+        self.ewma_latency = None  # seconds
+        self.consecutive_failures = 0
+        self.circuit = CIRCUIT_CLOSED
+        self.opened_at = 0.0
+        self.open_seconds = 0.0
+        self.probe_in_flight = False
+        self.probe_token = 0  # Only the request holding the current token may close or reopen the circuit
+        self.paused_until = 0.0  # Retry-After from the host
+        self.requests = 0
+        self.failures = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "host": self.host,
+            "in_flight": self.in_flight,
+            "ewma_latency_ms": round(self.ewma_latency * 1000) if self.ewma_latency is not None else None,
+            "circuit": self.circuit,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures
+        }
+
+
+class HostBalancer:
+    # Least-outstanding-requests balancing with power-of-two-choices, EWMA latency and per-host circuit breakers
+    def __init__(self, hosts: list, failure_threshold: int = 3, open_seconds: float = 15.0,
+                 max_open_seconds: float = 300.0, ewma_alpha: float = 0.3):
+        self.hosts = {host: HostState(host) for host in dict.fromkeys(hosts)}
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.ewma_alpha = ewma_alpha
+        self.lock = threading.Condition()
+
+    def is_available(self, state: HostState, now: float) -> bool:
+        if state.circuit == CIRCUIT_CLOSED:
+            return True
+
+        if state.circuit == CIRCUIT_OPEN and now - state.opened_at >= state.open_seconds:
+            state.circuit = CIRCUIT_HALF_OPEN
+            state.probe_in_flight = False
+
+        # Half-open hosts get exactly one trial request at a time
+        return state.circuit == CIRCUIT_HALF_OPEN and not state.probe_in_flight
+
+    def score(self, state: HostState, default_latency: float) -> float:
+        latency = state.ewma_latency if state.ewma_latency is not None else default_latency
+        return (state.in_flight + 1) * latency
+
+    def acquire(self, exclude: set = None, capacity=None) -> list:
+        # Blocks until a host is below its concurrency capacity and not paused by a Retry-After. Returns
+        # [host, probe token], the token is None unless the request is the trial of a host whose circuit is open.
+        with self.lock:
+            while True:
+                selected, wait_time = self.select(exclude, capacity)
+                if selected is not None:
+                    break
+                self.lock.wait(wait_time)
+
+            selected.in_flight += 1
+            selected.requests += 1
+            probe = None
+            if selected.circuit != CIRCUIT_CLOSED:
+                selected.probe_in_flight = True
+                selected.probe_token += 1
+                probe = selected.probe_token
+
+            return [selected.host, probe]
+
+    def select(self, exclude: set, capacity) -> list:
+        now = time.monotonic()
+        states = [state for state in self.hosts.values()
+                  if state.paused_until <= now
+                  and (capacity is None or state.in_flight < capacity(state.host))]
+
+        if not states:
+            paused_until = [state.paused_until for state in self.hosts.values() if state.paused_until > now]
+            return [None, min(paused_until) - now if paused_until else 1.0]
+
+        candidates = [state for state in states if self.is_available(state, now)
+                      and not (exclude and state.host in exclude)]
+
+        if not candidates:
+            candidates = [state for state in states if self.is_available(state, now)]
+
+        if not candidates:
+            # Every circuit is open, fail open on the host that is closest to being retried
+            candidates = [min(states, key=lambda state: state.opened_at + state.open_seconds)]
+
+        known_latencies = [state.ewma_latency for state in self.hosts.values() if state.ewma_latency is not None]
+        default_latency = sum(known_latencies) / len(known_latencies) if known_latencies else 1.0
+
+        if len(candidates) > 2:
+            candidates = random.sample(candidates, 2)
+
+        return [min(candidates, key=lambda state: self.score(state, default_latency)), 0]
+
+    def release(self, host: str, latency: float, ok: bool, probe: int = None):
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None:
+                return
+
+            state.in_flight = max(0, state.in_flight - 1)
+            self.lock.notify_all()
+
+            if ok:
+                if state.ewma_latency is None:
+                    state.ewma_latency = latency
+                else:
+                    state.ewma_latency = self.ewma_alpha * latency + (1 - self.ewma_alpha) * state.ewma_latency
+            else:
+                state.failures += 1
+
+            if state.circuit != CIRCUIT_CLOSED:
+                # Requests sent before the circuit opened finish late, only the current trial decides
+                if probe is None or probe != state.probe_token:
+                    return
+                state.probe_in_flight = False
+
+            if ok:
+                if state.circuit != CIRCUIT_CLOSED:
+                    print(f"💚 Host recovered: {host}")
+                state.circuit = CIRCUIT_CLOSED
+                state.consecutive_failures = 0
+                state.open_seconds = 0.0
+                return
+
+            state.consecutive_failures += 1
+
+            if state.circuit == CIRCUIT_HALF_OPEN or state.consecutive_failures >= self.failure_threshold:
+                self.open_circuit(state)
+
+    def open_circuit(self, state: HostState):
+        # Caller holds the lock, each failed half-open trial doubles the cool down
+        if state.circuit == CIRCUIT_HALF_OPEN and state.open_seconds > 0:
+            state.open_seconds = min(self.max_open_seconds, state.open_seconds * 2)
+        else:
+            state.open_seconds = self.base_open_seconds
+
+        state.circuit = CIRCUIT_OPEN
+        state.opened_at = time.monotonic()
+        state.probe_in_flight = False
+        state.probe_token += 1
+        print(f"🔌 Circuit opened for {state.host} for {state.open_seconds:.0f}s after {state.consecutive_failures} failures")
+
+    def pause(self, host: str, seconds: float):
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is not None:
+                state.paused_until = max(state.paused_until, time.monotonic() + seconds)
+                print(f"⏸️ Host {host} asked to retry after {seconds:.0f}s")
+
+    def mark_down(self, host: str):
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is not None:
+                state.consecutive_failures = max(state.consecutive_failures, self.failure_threshold)
+                self.open_circuit(state)
+
+    def probe_all(self, timeout: float = 3.0, probe_path: str = "/"):
+        def probe(host: str):
+            start = time.monotonic()
+            try:
+                # Any HTTP answer means the host is up, only connection errors and timeouts count as down
+                requests.get(host + probe_path, timeout=timeout)
+                return host, time.monotonic() - start, True
+            except requests.RequestException:
+                return host, time.monotonic() - start, False
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.hosts))) as executor:
+            results = list(executor.map(probe, list(self.hosts)))
+
+        for host, latency, ok in results:
+            if ok:
+                print(f"🩺 Host up: {host} ({round(latency * 1000)} ms)")
+            else:
+                print(f"🩺 Host down: {host}")
+                self.mark_down(host)
+
+        return results
+
+    def stats(self) -> list:
+        with self.lock:
+            return [state.to_dict() for state in self.hosts.values()]
+
+    def print_stats(self):
+        for host_stats in self.stats():
+            print(
+                f"🖥️ {host_stats['host']} | circuit: {host_stats['circuit']} | requests: {host_stats['requests']} | "
+                f"failures: {host_stats['failures']} | in flight: {host_stats['in_flight']} | "
+                f"ewma latency: {host_stats['ewma_latency_ms']} ms")
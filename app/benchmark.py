@@ -0,0 +1,386 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+from ebooklib import epub
+
+from app.mock_tts_server import add_mock_arguments, mock_argv, mock_settings
+
+# End-to-end throughput benchmark: mock TTS servers, synthetic EPUBs and one convert_epub_to_audiobook run per
+# book size, each in a fresh process with its own config. Results are written as JSON, compare two of them with
+# --compare.
+#
+#   python -m app.benchmark --sizes 1000,10000,50000 --servers 4 --output results.json
+#   python -m app.benchmark --sizes 1000 --set concurrency.max=16 --compare results.json
+
+APP_FOLDER = Path(__file__).resolve().parent
+# Helper processes run the modules of the app package from the folder it lives in
+ROOT_FOLDER = APP_FOLDER.parent
+DEFAULT_SIZES = "1000,10000,50000"
+CHAPTER_SIZE = 100
+RESULT_FORMAT = "kokoro-benchmark"
+RESULT_VERSION = 1
+
+WORDS = (
+    "the of and to in a is that for it as was with be by on not he I this are or his from at which but have an they "
+    "you were her she there one all we their been has when who will more no if out so said what up its about into "
+    "than them can only other new some could time these two may then do first any my now such like our over man me "
+    "even most made after also did many before must through back years where much your way well down should because "
+    "each just those people how too little state good very make world still own see men work long get here between "
+    "both life being under never day same another know while last might us great old year off come since against go "
+    "came right used take three house light river window silence morning evening garden letter mountain harbour"
+).split()
+
+# Lower is better for these, higher for everything else in the comparison
+LOWER_IS_BETTER = ["cpu_ms_per_paragraph", "peak_rss_mb", "peak_worker_rss_mb", "latency_p50_ms", "latency_p99_ms",
+                   "wall_seconds"]
+COMPARED = ["paragraphs_per_second", "chars_per_second", "realtime_factor", "cpu_ms_per_paragraph", "peak_rss_mb",
+            "peak_worker_rss_mb", "latency_p50_ms", "latency_p99_ms", "wall_seconds"]
+
+
+# Synthetic books ===============================================================================================
+
+def make_paragraph(rng: random.Random) -> str:
+    # Lognormal lengths around 200 characters, sentences of 6 to 18 words
+    target = min(1500, max(20, int(rng.lognormvariate(math.log(200), 0.6))))
+    sentences = []
+    length = 0
+    while length < target:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 18))]
+        sentence = " ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!"])
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return " ".join(sentences)
+
+
+def create_synthetic_epub(path: Path, paragraphs: int, seed: int):
+    # Chapters of CHAPTER_SIZE paragraphs, the chapter title counts as one of them
+    rng = random.Random(seed)
+    book = epub.EpubBook()
+    book.set_identifier(f"benchmark-{paragraphs}-{seed}")
+    book.set_title(f"Benchmark {paragraphs}")
+    book.add_author("Benchmark")
+    book.set_language("en")
+
+    chapters = []
+    for index in range(math.ceil(paragraphs / CHAPTER_SIZE)):
+        count = min(CHAPTER_SIZE, paragraphs - index * CHAPTER_SIZE)
+        chapter = epub.EpubHtml(title=f"Chapter {index + 1}", file_name=f"chap_{index + 1:05d}.xhtml", lang="en")
+        chapter.content = f"<h1>Chapter {index + 1}</h1>" + "".join(
+            f"<p>{make_paragraph(rng)}</p>" for _ in range(count - 1))
+        book.add_item(chapter)
+        chapters.append(chapter)
+
+    book.spine = ["nav", *chapters]
+    book.toc = chapters
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    epub.write_epub(str(path), book)
+
+
+def get_synthetic_epub(work_dir: Path, paragraphs: int, seed: int) -> Path:
+    path = work_dir / "epubs" / f"Benchmark-{paragraphs}-{seed}.epub"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        print(f"📚 Writing a synthetic EPUB with {paragraphs} paragraphs: {path.name}")
+        create_synthetic_epub(path, paragraphs, seed)
+    return path
+
+
+# One run, in its own process ===================================================================================
+
+def percentile(values: list, fraction: float):
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+def run_one(epub_path: Path, result_path: Path):
+    from app import generate_audiobook
+    from app.manifest import BookManifest
+    from app.metrics import REGISTRY
+
+    # Reads the run's config (KOKORO_CONFIG), then the same setup as the CLI: sessions, host probes and worker
+    # pools, outside of the measured time
+    generate_audiobook.init()
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    failed = []
+    with generate_audiobook.running_pipeline() as scheduler:
+        usage_start = resource.getrusage(resource.RUSAGE_SELF)
+        wall_start = time.perf_counter()
+        try:
+            output_dir = generate_audiobook.convert_epub_to_audiobook(epub_path, scheduler)
+        except generate_audiobook.IncompleteBookError as e:
+            # Failed paragraphs are part of the result
+            output_dir = e.output_dir
+            failed = e.failed
+        wall_seconds = time.perf_counter() - wall_start
+
+    # RUSAGE_CHILDREN covers the children of this process reaped since children_start: the post-processing and
+    # extraction workers (reaped by stop_pipeline, their start-up included) and the ffmpeg processes of pydub
+    # fallbacks. The mock TTS servers are children of the driver and never counted. ru_maxrss is the peak of the
+    # largest of them, not a sum.
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_seconds = usage.ru_utime + usage.ru_stime - usage_start.ru_utime - usage_start.ru_stime
+    worker_cpu_seconds = (children.ru_utime + children.ru_stime - children_start.ru_utime
+                          - children_start.ru_stime)
+
+    manifest = BookManifest(output_dir)
+    done = list(manifest.entries().values())
+    manifest.close()
+
+    latencies = sorted(entry["latency_ms"] for entry in done if entry["latency_ms"] is not None)
+    paragraphs = len(done) + len(failed)
+    audio_seconds = sum(entry["duration"] for entry in done) / 1000
+
+    # TTS requests by outcome, summed over the hosts
+    request_labels = generate_audiobook.TTS_REQUEST_SECONDS.label_names
+    requests = {}
+    chars = 0
+    retries = 0
+    for (name, labels), value in REGISTRY.collect().items():
+        if name == "kokoro_tts_request_seconds":
+            outcome = dict(zip(request_labels, labels))["outcome"]
+            requests[outcome] = requests.get(outcome, 0) + sum(value[:-1])
+        elif name == "kokoro_tts_chars_total":
+            chars += value
+        elif name == "kokoro_tts_retries_total":
+            retries += value
+
+    result = {
+        "paragraphs": paragraphs,
+        "done": len(done),
+        "failed": len(failed),
+        "chars": chars,
+        "wall_seconds": round(wall_seconds, 3),
+        "paragraphs_per_second": round(paragraphs / wall_seconds, 2),
+        "chars_per_second": round(chars / wall_seconds, 1),
+        "audio_seconds": round(audio_seconds, 1),
+        "realtime_factor": round(audio_seconds / wall_seconds, 1),
+        "cpu_seconds": round(cpu_seconds + worker_cpu_seconds, 3),
+        "worker_cpu_seconds": round(worker_cpu_seconds, 3),
+        "cpu_ms_per_paragraph": round((cpu_seconds + worker_cpu_seconds) * 1000 / max(1, paragraphs), 3),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "peak_worker_rss_mb": round(children.ru_maxrss / 1024, 1),
+        "latency_p50_ms": percentile(latencies, 0.5),
+        "latency_p90_ms": percentile(latencies, 0.9),
+        "latency_p99_ms": percentile(latencies, 0.99),
+        "latency_p999_ms": percentile(latencies, 0.999),
+        "latency_max_ms": latencies[-1] if latencies else None,
+        "requests": requests,
+        "retries": retries
+    }
+    result_path.write_text(json.dumps(result, indent=4), encoding="utf-8")
+
+
+# Driver ========================================================================================================
+
+def set_config_value(config: dict, dotted_key: str, value: str):
+    # --set concurrency.max=16, values are JSON where they parse as JSON, strings otherwise
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    keys = dotted_key.split(".")
+    for key in keys[:-1]:
+        config = config.setdefault(key, {})
+    config[keys[-1]] = value
+
+
+def write_run_config(args: argparse.Namespace, work_dir: Path, run_dir: Path, hosts: list) -> Path:
+    config = json.loads(Path(args.base_config).read_text(encoding="utf-8"))
+    config.update({
+        "books_folder": str(run_dir),
+        "singled_books_folder": str(run_dir / "Orator"),
+        "from_scratch": True,
+        "use_edge_tts_service": False,
+        # Every paragraph goes through the TTS hosts and the extractor
+        "audio_cache": {**config.get("audio_cache", {}), "enabled": False},
+        "book_cache": {**config.get("book_cache", {}), "enabled": False},
+        "metrics": {"textfile": ""},
+        "streaming": {**config.get("streaming", {}), "spool_folder": str(work_dir / "spool")}
+    })
+    config["api"] = {**config["api"], "host": hosts[0], "host_round_robin": hosts if len(hosts) > 1 else []}
+    for override in args.set:
+        key, _, value = override.partition("=")
+        set_config_value(config, key, value)
+
+    config_path = run_dir / "config.json"
+    config_path.write_text(json.dumps(config, indent=4, ensure_ascii=False), encoding="utf-8")
+    return config_path
+
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Mock TTS server on port {port} did not start")
+
+
+def get_mock_stats(hosts: list) -> dict:
+    stats = {}
+    for host in hosts:
+        try:
+            with urllib.request.urlopen(f"{host}/stats", timeout=5) as response:
+                stats[host] = json.loads(response.read())
+        except OSError as e:
+            stats[host] = {"error": str(e)}
+    return stats
+
+
+def get_git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=APP_FOLDER, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    hosts = [f"http://127.0.0.1:{args.port + index}" for index in range(args.servers)]
+    epubs = {size: get_synthetic_epub(work_dir, size, args.seed) for size in sizes}
+
+    mock = subprocess.Popen(
+        [sys.executable, "-m", "app.mock_tts_server", "--port", str(args.port), "--count", str(args.servers),
+         "--seed", str(args.seed), *mock_argv(args)],
+        cwd=ROOT_FOLDER
+    )
+    runs = []
+    try:
+        for index in range(args.servers):
+            wait_for_port(args.port + index)
+
+        for size in sizes:
+            run_dir = work_dir / f"run-{size}"
+            shutil.rmtree(run_dir, ignore_errors=True)
+            run_dir.mkdir(parents=True)
+            config_path = write_run_config(args, work_dir, run_dir, hosts)
+            result_path = run_dir / "result.json"
+            log_path = run_dir / "run.log"
+
+            print(f"⏱️ {size} paragraphs, {args.servers} mock servers (log: {log_path})")
+            with open(log_path, "w", encoding="utf-8") as log:
+                subprocess.run(
+                    [sys.executable, "-m", "app.benchmark", "--run-one", str(epubs[size]), "--result",
+                     str(result_path), *(["--chapterize"] if args.single else [])],
+                    cwd=ROOT_FOLDER,
+                    env={**os.environ, "KOKORO_CONFIG": str(config_path)},
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    check=True
+                )
+
+            result = {"size": size, **json.loads(result_path.read_text(encoding="utf-8"))}
+            runs.append(result)
+            print(f"   {result['paragraphs']} paragraphs in {result['wall_seconds']} s | "
+                  f"{result['paragraphs_per_second']} paragraphs/s | {result['chars_per_second']} chars/s | "
+                  f"realtime x{result['realtime_factor']} | cpu {result['cpu_ms_per_paragraph']} ms/paragraph | "
+                  f"peak rss {result['peak_rss_mb']} MB (workers {result['peak_worker_rss_mb']} MB) | "
+                  f"latency p50 {result['latency_p50_ms']} ms p99 {result['latency_p99_ms']} ms | "
+                  f"{result['failed']} failed, {result['retries']} retries")
+
+            if not args.keep_output:
+                for child in run_dir.iterdir():
+                    if child.is_dir():
+                        shutil.rmtree(child)
+        mock_stats = get_mock_stats(hosts)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    return {
+        "format": RESULT_FORMAT,
+        "version": RESULT_VERSION,
+        "label": args.label,
+        "revision": get_git_revision(),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "servers": args.servers,
+        "mock": mock_settings(args),
+        "overrides": args.set,
+        "runs": runs,
+        "mock_stats": mock_stats
+    }
+
+
+def print_comparison(baseline: dict, results: dict):
+    print(f"📊 {results.get('label') or results.get('revision')} vs {baseline.get('label') or baseline.get('revision')}")
+    baseline_runs = {run["size"]: run for run in baseline.get("runs", [])}
+    for run in results["runs"]:
+        before = baseline_runs.get(run["size"])
+        if before is None:
+            print(f"   {run['size']} paragraphs: not in the baseline")
+            continue
+        print(f"   {run['size']} paragraphs:")
+        for metric in COMPARED:
+            old, new = before.get(metric), run.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change < 0 if metric in LOWER_IS_BETTER else change > 0
+            marker = "✅" if better and abs(change) >= 2 else "❌" if abs(change) >= 2 else "  "
+            print(f"     {marker} {metric:<22} {old:>12} -> {new:<12} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark against mock TTS servers")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="paragraph counts of the synthetic books")
+    parser.add_argument("--servers", type=int, default=4, help="mock TTS servers")
+    parser.add_argument("--port", type=int, default=18100, help="port of the first mock server")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--work-dir", default="/tmp/kokoro-benchmark")
+    parser.add_argument("--base-config", default=str(ROOT_FOLDER / "config.json"))
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="config override, e.g. concurrency.max=16 or chunk_planner.enabled=false")
+    parser.add_argument("--no-single", dest="single", action="store_false", help="skip the single book MP3")
+    parser.add_argument("--keep-output", action="store_true", help="keep the generated audio")
+    parser.add_argument("--label", default=None, help="name of this run in comparisons")
+    parser.add_argument("--output", default=None, help="results JSON, printed when not given")
+    parser.add_argument("--compare", default=None, help="results JSON of an earlier run")
+    add_mock_arguments(parser)
+    # Internal: one run in a child process
+    parser.add_argument("--run-one", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--chapterize", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(Path(args.run_one), Path(args.result))
+        return
+
+    results = run_benchmark(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=4), encoding="utf-8")
+        print(f"💾 Results written to {args.output}")
+    else:
+        print(json.dumps(results, indent=4))
+
+    if args.compare:
+        print_comparison(json.loads(Path(args.compare).read_text(encoding="utf-8")), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from ebooklib import epub
+
+from app.manifest import write_bytes_atomic
+from app import text_processor
+from app.text_processor import extract_paragraphs_from_epub_simpler, iter_paragraph_window
+from app.utils import get_config
+
+DEFAULT_CACHE_FOLDER = "/app/cache/books"
+DEFAULT_MAX_SIZE_MB = 512
+
+# Bump when the extractor changes in a way that changes its output
+EXTRACTION_VERSION = 1
+
+EPUB_IMAGE = 1
+EPUB_IMAGE_2 = 10
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def get_file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_cover_image(book: epub.EpubBook) -> bytes | None:
+    cover_image_item = None
+
+    # Look for the item that is the cover
+    for item in book.get_items():
+        print(f"🔍 Checking item: {item.get_id()} ({item.get_type()}) ({item.get_name()})")
+        if item.get_type() == EPUB_IMAGE or item.get_type() == EPUB_IMAGE_2:
+            if cover_image_item == None:
+                print(
+                    "🔍 Found the first image in the book, using that as the cover if no other cover is found")
+                cover_image_item = item
+
+            if 'cover' in item.get_id().lower():
+                print(f"🔍 Found specific cover image: {item.get_id()}")
+                cover_image_item = item
+                break
+
+    return cover_image_item.get_content() if cover_image_item else None
+
+
+class ParsedBook:
+    # One EPUB for the duration of a run: the archive is read at most once and shared by cover and text
+    # extraction, and both results are cached by content hash so re-runs don't open it at all
+    def __init__(self, epub_path: Path, cache_folder: Path = None, enabled: bool = True,
+                 max_size_bytes: int = DEFAULT_MAX_SIZE_MB * 1024 * 1024):
+        self.epub_path = Path(epub_path)
+        self.cache_folder = Path(cache_folder or DEFAULT_CACHE_FOLDER)
+        self.enabled = enabled
+        self.max_size_bytes = max_size_bytes
+        self.book = None
+        self.cached = None
+        self.found_cover = None
+        self.cover_searched = False
+        self.key = self.cache_key() if enabled else None
+
+    def cache_key(self) -> str:
+        config = get_config()
+        key_source = json.dumps({
+            "epub": get_file_hash(self.epub_path),
+            "normalizer": text_processor.NORMALIZER.version,
+            "extraction": EXTRACTION_VERSION,
+            "add_structure": text_processor.ADD_STRUCTURE,
+            "ignore_upto_paragraph": config.get("ignore_upto_paragraph", 0),
+            "take": config.get("take", 0)
+        }, sort_keys=True)
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def get_book(self) -> epub.EpubBook:
+        if self.book is None:
+            self.book = epub.read_epub(str(self.epub_path))
+        return self.book
+
+    def find_cover(self) -> bytes | None:
+        if not self.cover_searched:
+            self.found_cover = find_cover_image(self.get_book())
+            self.cover_searched = True
+        return self.found_cover
+
+    def paths(self) -> list:
+        return [self.cache_folder / f"{self.key}.json", self.cache_folder / f"{self.key}.cover"]
+
+    def load(self) -> dict | None:
+        if not self.enabled:
+            return None
+
+        if self.cached is None:
+            model_path, cover_path = self.paths()
+            try:
+                model = json.loads(model_path.read_text(encoding="utf-8"))
+                model["cover"] = cover_path.read_bytes() if model["has_cover"] else None
+                os.utime(model_path)  # the LRU order prune() goes by
+            except (FileNotFoundError, ValueError, KeyError):
+                return None
+            self.cached = model
+
+        return self.cached
+
+    def save(self, paragraphs: list, cover: bytes | None):
+        if not self.enabled:
+            return
+
+        model_path, cover_path = self.paths()
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+
+        if cover is not None:
+            write_bytes_atomic(cover_path, cover)
+
+        model = {"epub": self.epub_path.name, "has_cover": cover is not None, "paragraphs": paragraphs}
+        write_bytes_atomic(model_path, json.dumps(model, ensure_ascii=False).encode("utf-8"))
+        self.cached = {**model, "cover": cover}
+        self.prune()
+
+    def prune(self):
+        # Least recently used books go first until the folder fits max_size_bytes, a book's model and cover
+        # are one entry. Files another run removes meanwhile are skipped.
+        entries = {}
+        for path in self.cache_folder.iterdir():
+            if path.suffix not in (".json", ".cover"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entry = entries.setdefault(path.stem, [0.0, 0])
+            if path.suffix == ".json":
+                entry[0] = stat.st_mtime
+            entry[1] += stat.st_size
+
+        total_size = sum(size for _, size in entries.values())
+        for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total_size <= self.max_size_bytes:
+                break
+            if key == self.key:
+                continue
+            (self.cache_folder / f"{key}.json").unlink(missing_ok=True)
+            (self.cache_folder / f"{key}.cover").unlink(missing_ok=True)
+            total_size -= size
+            print(f"🧹 Removed {key[:12]} from the book cache")
+
+    def paragraphs(self) -> list:
+        model = self.load()
+        if model is not None:
+            print(f"📦 Loaded {len(model['paragraphs'])} paragraphs of {self.epub_path.name} from the book cache")
+            return [list(paragraph) for paragraph in model["paragraphs"]]
+
+        paragraphs = extract_paragraphs_from_epub_simpler(self.epub_path, self.get_book())
+        # Saved before any of the lists are filled in by the conversion
+        self.save([list(paragraph) for paragraph in paragraphs], self.find_cover())
+        return paragraphs
+
+    def iter_paragraphs(self):
+        # Like paragraphs(), but hands each paragraph over as soon as it is extracted. The cache is written once
+        # the whole book went through.
+        model = self.load()
+        if model is not None:
+            print(f"📦 Loaded {len(model['paragraphs'])} paragraphs of {self.epub_path.name} from the book cache")
+            for paragraph in model["paragraphs"]:
+                yield list(paragraph)
+            return
+
+        extracted = []
+        for paragraph in iter_paragraph_window(self.epub_path, self.get_book()):
+            extracted.append(list(paragraph))
+            yield paragraph
+
+        print("Chapters:", [paragraph[4] for paragraph in extracted if paragraph[2] == 1])
+        self.save(extracted, self.find_cover())
+
+    def cover(self) -> bytes | None:
+        model = self.load()
+        if model is not None:
+            return model["cover"]
+        return self.find_cover()
+
+
+def open_parsed_book(epub_path: Path, config: dict) -> ParsedBook:
+    cache_config = config.get("book_cache", {})
+    return ParsedBook(
+        epub_path,
+        Path(cache_config.get("folder", DEFAULT_CACHE_FOLDER)),
+        cache_config.get("enabled", True),
+        int(cache_config.get("max_size_mb", DEFAULT_MAX_SIZE_MB) * 1024 * 1024)
+    )
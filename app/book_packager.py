@@ -0,0 +1,202 @@
+import queue
+import threading
+from pathlib import Path
+
+from app.mp3_concat import Mp3Appender
+from app.mp3_frames import Mp3FormatError
+from app.tracing import TRACER
+
+
+class BookPackager:
+    # Last stage of a book's pipeline: takes post-processed chunk groups in whatever order they finish, records
+    # them in the manifest and appends the paragraph files to the single book MP3 and the live HLS playlist in
+    # book order as soon as every paragraph before them is there. Runs on its own thread, fed through an
+    # unbounded message queue (the stages in front of it are bounded).
+    def __init__(self, name: str, output_dir: Path, manifest, single_path: Path = None, on_paragraph=None,
+                 fallback=None, playlist=None, content_writer=None):
+        self.name = name
+        self.output_dir = Path(output_dir)
+        self.manifest = manifest
+        self.single_path = single_path
+        self.on_paragraph = on_paragraph
+        self.fallback = fallback
+        self.playlist = playlist
+        self.content_writer = content_writer
+        self.cumulative_duration = 0
+
+        self.messages = queue.Queue()
+        self.thread = None
+        self.order = []
+        self.resolved = {}
+        self.next_index = 0
+        self.closed = False
+
+        self.appender = None
+        self.single_error = None
+        self.offsets = {}
+
+    def start(self):
+        if self.single_path is not None:
+            self.single_path.parent.mkdir(parents=True, exist_ok=True)
+            self.appender = Mp3Appender(self.single_path)
+
+        if self.playlist is not None:
+            self.playlist.start()
+
+        if self.content_writer is not None:
+            self.content_writer.start()
+
+        self.thread = threading.Thread(target=self.run, name=f"package-{self.name}", daemon=True)
+        self.thread.start()
+
+    # Producer side, called from the extraction, synthesis and post-processing threads ========================
+
+    def add_paragraphs(self, paragraphs: list, done_para_ids: set):
+        self.messages.put(["paragraphs", paragraphs, done_para_ids])
+
+    def complete(self, group, future, request_info: list):
+        self.messages.put(["group", group, future, request_info])
+
+    def fail(self, group, error: str):
+        self.messages.put(["failed", group, error])
+
+    def close(self) -> dict:
+        # Returns once every paragraph is packaged, with the single output finished
+        self.messages.put(["close"])
+        self.thread.join()
+        if self.playlist is not None:
+            self.playlist.finish()
+        if self.content_writer is not None:
+            self.content_writer.close()
+        return self.finish_single()
+
+    def abandon(self):
+        # Cancelled book: stops after the paragraphs that are already resolved, groups still being post-processed
+        # are dropped (their files are adopted on the next run) and the single output is thrown away
+        self.messages.put(["abandon"])
+        self.thread.join()
+        if self.playlist is not None:
+            self.playlist.close()
+        if self.content_writer is not None:
+            self.content_writer.close()
+        if self.appender is not None:
+            self.appender.abort()
+            self.appender = None
+
+    # Packaging thread ========================================================================================
+
+    def run(self):
+        with TRACER.book(self.name):
+            while not (self.closed and self.next_index == len(self.order)):
+                message = self.messages.get()
+                try:
+                    with TRACER.span(f"package_{message[0]}", "package"):
+                        self.handle(message)
+                except Exception as e:
+                    print(f"❌ Packaging of {self.name} failed on a {message[0]} message: {e}")
+                    if message[0] in ("group", "failed"):
+                        self.resolve_group(message[1], None)
+                self.advance()
+
+    def handle(self, message: list):
+        kind = message[0]
+
+        if kind == "paragraphs":
+            _, paragraphs, done_para_ids = message
+            self.order += paragraphs
+            durations = self.manifest.durations(list(done_para_ids)) if done_para_ids else {}
+            for paragraph in paragraphs:
+                if paragraph[0] in done_para_ids:
+                    self.resolved[paragraph[0]] = durations.get(paragraph[0])
+
+        elif kind == "group":
+            _, group, future, request_info = message
+            self.finish_group(group, future, request_info)
+
+        elif kind == "failed":
+            _, group, error = message
+            print(f"❌ Max retries reached. Skipping {len(group.jobs)} paragraphs.")
+            for job in group.jobs:
+                if job[0][0] not in self.resolved:
+                    self.manifest.mark_failed(job[0][0], error)
+            self.resolve_group(group, None)
+
+        elif kind == "close":
+            self.closed = True
+
+        elif kind == "abandon":
+            self.closed = True
+            self.order = self.order[:self.next_index]
+
+    def finish_group(self, group, future, request_info: list):
+        host, latency_ms = request_info
+
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"⚠️ Post-processing of {len(group.jobs)} paragraphs failed ({e}), synthesizing them one by one")
+            for job in group.jobs:
+                if job[0][0] not in self.resolved:
+                    duration = self.fallback(job) if self.fallback is not None else 0
+                    self.resolve(job[0], duration or None)
+            return
+
+        for job, (duration, size, checksum) in zip(group.jobs, results):
+            # A group failed by an unexpected error can still finish afterwards, a paragraph's first outcome stands
+            if job[0][0] in self.resolved:
+                continue
+            self.manifest.mark_done(job[0][0], host, latency_ms, duration, size, checksum)
+            self.resolve(job[0], duration, host)
+
+    def resolve_group(self, group, duration):
+        for job in group.jobs:
+            if job[0][0] not in self.resolved:
+                self.resolve(job[0], duration)
+
+    def resolve(self, paragraph: list, duration, host: str = None):
+        # duration None: the paragraph failed
+        self.resolved[paragraph[0]] = duration
+        if self.on_paragraph is not None:
+            self.on_paragraph(paragraph, duration, host)
+
+    def advance(self):
+        # Book order, a paragraph is appended once it and everything before it is resolved
+        while self.next_index < len(self.order) and self.order[self.next_index][0] in self.resolved:
+            paragraph = self.order[self.next_index]
+            self.next_index += 1
+
+            duration = self.resolved[paragraph[0]]
+            if self.playlist is not None and duration:
+                self.playlist.add(paragraph[3], duration)
+
+            if self.content_writer is not None:
+                # Live content.ndjson, the final one is written from the computed durations
+                self.cumulative_duration += duration or 0
+                self.content_writer.append(
+                    [*paragraph[:5], duration or 0, self.cumulative_duration, *paragraph[7:]])
+
+            if self.appender is None:
+                continue
+
+            try:
+                with TRACER.span("append_single", "package", paragraph=paragraph[0]):
+                    _, ms_offset, duration_ms = self.appender.append(self.output_dir / paragraph[3])
+                self.offsets[paragraph[0]] = [ms_offset, duration_ms]
+            except (Mp3FormatError, OSError) as e:
+                print(f"⚠️ Native MP3 concat failed for {self.single_path.name} ({e})")
+                self.single_error = e
+                self.appender.abort()
+                self.appender = None
+
+    def finish_single(self) -> dict | None:
+        if self.appender is None:
+            return None
+
+        try:
+            return self.appender.close()
+        except (Mp3FormatError, OSError) as e:
+            print(f"⚠️ Native MP3 concat failed for {self.single_path.name} ({e})")
+            self.single_error = e
+            return None
+        finally:
+            self.appender = None
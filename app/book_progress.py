@@ -0,0 +1,94 @@
+import threading
+import time
+
+
+class BookProgress:
+    # Counters of one book's conversion, shared by the console progress bar, progress.json and the job API.
+    # Updated from the extraction and packaging threads.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.paused_at = None
+        self.paused_seconds = 0.0
+        self.stopped_at = None
+
+        self.total = 0  # paragraphs extracted so far
+        self.extracting = True
+        self.remaining = 0  # paragraphs queued for synthesis
+        self.remaining_chars = 0
+        self.current = 0  # queued paragraphs packaged since the start
+        self.failed = 0
+        self.chars = 0
+        self.cumulative_duration = 0
+        self.hosts = {}  # host -> [paragraphs, chars]
+
+    def add_batch(self, paragraphs: int, jobs: list):
+        with self.lock:
+            self.total += paragraphs
+            self.remaining += len(jobs)
+            self.remaining_chars += sum(len(job[1]) for job in jobs)
+
+    def extraction_done(self):
+        with self.lock:
+            self.extracting = False
+
+    def on_paragraph(self, paragraph: list, duration: int | None, host: str = None):
+        chars = len(paragraph[1])
+        with self.lock:
+            self.current += 1
+            if duration is None:
+                self.failed += 1
+                return
+
+            self.chars += chars
+            self.cumulative_duration += duration
+            host_stats = self.hosts.setdefault(host or "unknown", [0, 0])
+            host_stats[0] += 1
+            host_stats[1] += chars
+
+    def pause(self):
+        with self.lock:
+            if self.paused_at is None:
+                self.paused_at = time.monotonic()
+
+    def resume(self):
+        with self.lock:
+            if self.paused_at is not None:
+                self.paused_seconds += time.monotonic() - self.paused_at
+                self.paused_at = None
+
+    def stop(self):
+        with self.lock:
+            if self.stopped_at is None:
+                self.stopped_at = self.paused_at or time.monotonic()
+
+    def elapsed(self) -> float:
+        # Seconds spent converting, paused time doesn't count against the rates
+        now = self.stopped_at or self.paused_at or time.monotonic()
+        return max(0.001, now - self.started_at - self.paused_seconds)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            elapsed = self.elapsed()
+            chars_per_second = self.chars / elapsed
+            remaining_chars = max(0, self.remaining_chars - self.chars)
+            return {
+                "total": self.total,
+                "extracting": self.extracting,
+                "already_done": self.total - self.remaining,
+                "queued": self.remaining,
+                "done": self.current,
+                "failed": self.failed,
+                "percent": round((self.total - self.remaining + self.current) / self.total * 100, 1)
+                if self.total else 0.0,
+                "chars": self.chars,
+                "chars_per_second": round(chars_per_second, 1),
+                # Only an estimate of what is extracted so far while the book is still being read
+                "eta_seconds": round(remaining_chars / chars_per_second) if chars_per_second else None,
+                "elapsed_seconds": round(elapsed, 1),
+                "duration_ms": self.cumulative_duration,
+                "hosts": {
+                    host: {"paragraphs": paragraphs, "chars": chars, "chars_per_second": round(chars / elapsed, 1)}
+                    for host, (paragraphs, chars) in self.hosts.items()
+                }
+            }
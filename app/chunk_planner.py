@@ -0,0 +1,187 @@
+import re
+import threading
+
+DEFAULT_TARGET_CHARS = 400
+DEFAULT_MAX_CHARS = 600
+DEFAULT_MIN_CHARS = 80
+
+COALESCE_SEPARATOR = "\n\n"
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…])\s+|(?<=[.!?…]["\'”’)\]])\s+')
+CLAUSE_BOUNDARY = re.compile(r'(?<=[,;:])\s+')
+
+
+class ChunkGroup:
+    # Paragraph jobs that share audio: one paragraph split into several requests, or several short
+    # paragraphs packed into one request. Every segment is read in the group's voice.
+    def __init__(self, jobs: list, segments: list, voice: str = None):
+        self.jobs = jobs
+        self.segments = segments
+        self.voice = voice
+        self.results = [None] * len(segments)
+        self.completed = 0
+        self.error = None
+        self.lock = threading.Lock()
+        # Per segment: failed attempts so far and the hosts they failed on, retries go to other hosts
+        self.attempts = [0] * len(segments)
+        self.failed_hosts = [set() for _ in segments]
+        # Set for the final sweep, a group that fails there is given up on
+        self.last_pass = False
+
+    def weights(self) -> list:
+        return [len(job[1]) for job in self.jobs]
+
+
+def split_at(text: str, boundary: re.Pattern) -> list:
+    return [piece for piece in boundary.split(text) if piece.strip()] or [text]
+
+
+def split_long_text(text: str, target_chars: int, max_chars: int) -> list:
+    # Sentences are packed up to target_chars, a single sentence longer than max_chars is cut at clauses, then words
+    sentences = []
+    for sentence in split_at(text, SENTENCE_BOUNDARY):
+        if len(sentence) <= max_chars:
+            sentences.append(sentence)
+            continue
+
+        for clause in split_at(sentence, CLAUSE_BOUNDARY):
+            if len(clause) <= max_chars:
+                sentences.append(clause)
+            else:
+                sentences.extend(pack(clause.split(" "), target_chars, " "))
+
+    return pack(sentences, target_chars, " ")
+
+
+def pack(pieces: list, target_chars: int, separator: str) -> list:
+    packed = []
+    current = ""
+    for piece in pieces:
+        piece = piece.strip()
+        if current and len(current) + len(separator) + len(piece) > target_chars:
+            packed.append(current)
+            current = piece
+        else:
+            current = f"{current}{separator}{piece}" if current else piece
+
+    if current:
+        packed.append(current)
+
+    return packed
+
+
+def plan_chunks(jobs: list, target_chars: int = DEFAULT_TARGET_CHARS, max_chars: int = DEFAULT_MAX_CHARS,
+                min_chars: int = DEFAULT_MIN_CHARS, voice_of=None, keep_alone=None) -> list:
+    # jobs are (paragraph, text, audio_file_path, ...) tuples in book order, chapter titles keep their own request.
+    # voice_of(job) picks the voice of each source paragraph, only paragraphs of the same voice are packed together.
+    # keep_alone(job) is true for short paragraphs that must keep their own request (e.g. audio in the TTS cache).
+    groups = []
+    packed_jobs = []
+    packed_chars = 0
+    packed_voice = None
+
+    def flush_packed():
+        nonlocal packed_jobs, packed_chars
+        if packed_jobs:
+            segment = COALESCE_SEPARATOR.join(job[1] for job in packed_jobs)
+            groups.append(ChunkGroup(packed_jobs, [segment], packed_voice))
+        packed_jobs = []
+        packed_chars = 0
+
+    for job in jobs:
+        paragraph, text = job[0], job[1]
+        is_chapter = paragraph[2] == 1
+        voice = voice_of(job) if voice_of is not None else None
+
+        if not is_chapter and len(text) < min_chars and not (keep_alone is not None and keep_alone(job)):
+            if packed_jobs and (voice != packed_voice
+                                or packed_chars + len(COALESCE_SEPARATOR) + len(text) > target_chars):
+                flush_packed()
+            packed_jobs.append(job)
+            packed_chars += len(text) + len(COALESCE_SEPARATOR)
+            packed_voice = voice
+            continue
+
+        flush_packed()
+
+        if len(text) > max_chars:
+            groups.append(ChunkGroup([job], split_long_text(text, target_chars, max_chars), voice))
+        else:
+            groups.append(ChunkGroup([job], [text], voice))
+
+    flush_packed()
+    return groups
+
+
+def describe_plan(jobs: list, groups: list) -> str:
+    requests = sum(len(group.segments) for group in groups)
+    split_groups = [group for group in groups if len(group.segments) > 1]
+    packed_groups = [group for group in groups if len(group.jobs) > 1]
+    chars = sum(len(job[1]) for job in jobs)
+
+    return (
+        f"🧩 Chunk planner: {len(jobs)} paragraphs -> {requests} requests | "
+        f"split {len(split_groups)} long paragraphs into {sum(len(group.segments) for group in split_groups)} requests | "
+        f"packed {sum(len(group.jobs) for group in packed_groups)} short paragraphs into {len(packed_groups)} requests | "
+        f"avg request {round(chars / max(1, requests))} chars (was {round(chars / max(1, len(jobs)))})"
+    )
+
+
+class ThroughputStats:
+    # Latency vs. request size of the HTTP requests of each running book, used to estimate what the unplanned
+    # request set would cost. Running sums per book, reset once the book is done.
+    def __init__(self):
+        self.sums = {}  # book -> [count, chars, latency, chars², chars * latency]
+        self.lock = threading.Lock()
+
+    def record(self, book: str, chars: int, latency: float):
+        with self.lock:
+            sums = self.sums.setdefault(book, [0, 0.0, 0.0, 0.0, 0.0])
+            sums[0] += 1
+            sums[1] += chars
+            sums[2] += latency
+            sums[3] += chars * chars
+            sums[4] += chars * latency
+
+    def reset(self, book: str):
+        with self.lock:
+            self.sums.pop(book, None)
+
+    def fit(self, book: str) -> list:
+        # Least squares latency = overhead + per_char * chars
+        with self.lock:
+            count, chars, latency, chars_squared, chars_latency = self.sums.get(book, [0, 0.0, 0.0, 0.0, 0.0])
+
+        if count < 2:
+            return [None, None]
+
+        variance = chars_squared - chars * chars / count
+        if variance <= 0:
+            return [None, None]
+
+        per_char = (chars_latency - chars * latency / count) / variance
+        overhead = (latency - per_char * chars) / count
+        return [max(0.0, overhead), max(0.0, per_char)]
+
+    def describe(self, book: str, jobs: list, groups: list, elapsed_seconds: float) -> str:
+        chars = sum(len(job[1]) for job in jobs)
+        requests = sum(len(group.segments) for group in groups)
+        summary = (
+            f"⏱️ Throughput: {round(chars / max(elapsed_seconds, 0.001))} chars/s | "
+            f"{round(len(jobs) / max(elapsed_seconds, 0.001), 2)} paragraphs/s | "
+            f"{round(requests / max(elapsed_seconds, 0.001), 2)} requests/s"
+        )
+
+        overhead, per_char = self.fit(book)
+        if overhead is None:
+            return summary
+
+        planned = sum(overhead + per_char * len(segment) for group in groups for segment in group.segments)
+        unplanned = sum(overhead + per_char * len(job[1]) for job in jobs)
+        saving = round((1 - planned / unplanned) * 100) if unplanned else 0
+
+        return (
+            f"{summary}\n"
+            f"⏱️ Request time model: {round(overhead * 1000)} ms overhead + {round(per_char * 1000, 2)} ms/char | "
+            f"planned {round(planned)}s vs one request per paragraph {round(unplanned)}s of request time ({saving}% less)"
+        )
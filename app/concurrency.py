@@ -0,0 +1,188 @@
+import email.utils
+import threading
+import time
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_OVERLOAD = "overload"  # timeouts, 429 and 5xx, the backend wants less traffic
+OUTCOME_ERROR = "error"  # failures that say nothing about load (bad request, broken audio, ...)
+
+# Latency is compared per 100 characters, a 3 word line and a 2000 character paragraph are not comparable otherwise
+LATENCY_UNIT_CHARS = 100
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class AimdLimit:
+    # Additive increase while latency stays flat, multiplicative decrease on overload or rising latency
+    def __init__(self, initial: int, minimum: int, maximum: int, backoff: float = 0.7,
+                 latency_tolerance: float = 1.5, decrease_cooldown: float = 2.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.decrease_cooldown = decrease_cooldown
+        self.short_latency = None
+        self.long_latency = None
+        self.last_decrease = 0.0
+
+    @property
+    def value(self) -> int:
+        return int(self.limit)
+
+    def on_success(self, normalized_latency: float):
+        if self.short_latency is None:
+            self.short_latency = normalized_latency
+            self.long_latency = normalized_latency
+        else:
+            self.short_latency = 0.2 * normalized_latency + 0.8 * self.short_latency
+            self.long_latency = 0.02 * normalized_latency + 0.98 * self.long_latency
+
+        if self.short_latency > self.long_latency * self.latency_tolerance:
+            # Requests are queueing up on the backend, more concurrency would only add latency
+            self.decrease()
+            return
+
+        # Roughly +1 per window of successful requests
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_overload(self):
+        self.decrease()
+
+    def decrease(self):
+        # A burst of failures from the same overload only backs off once
+        now = time.monotonic()
+        if now - self.last_decrease < self.decrease_cooldown:
+            return
+
+        self.limit = max(self.minimum, self.limit * self.backoff)
+        self.last_decrease = now
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(0.1, rate)
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            self.refill()
+            self.rate = max(0.1, rate)
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+
+            time.sleep(wait_time)
+
+
+class ConcurrencyController:
+    # Learns one limit for the backend as a whole and one per host, requests are paced by a token bucket
+    def __init__(self, backend: str, hosts: list, initial: int = 4, minimum: int = 1, maximum: int = 64,
+                 host_maximum: int = 16, backoff: float = 0.7, latency_tolerance: float = 1.5,
+                 decrease_cooldown: float = 2.0, min_rate: float = 2.0, burst: float = 4.0):
+        self.backend = backend
+        self.maximum = max(1, maximum)
+        self.backend_limit = AimdLimit(initial, minimum, maximum, backoff, latency_tolerance, decrease_cooldown)
+        self.host_limits = {
+            host: AimdLimit(max(1, initial // max(1, len(hosts))) + 1, minimum, host_maximum, backoff,
+                            latency_tolerance, decrease_cooldown)
+            for host in hosts
+        }
+        self.min_rate = min_rate
+        self.latency = None  # seconds, raw request latency
+        self.bucket = TokenBucket(max(min_rate, initial), burst)
+        self.lock = threading.Lock()
+
+    def limit(self) -> int:
+        with self.lock:
+            host_total = sum(host_limit.value for host_limit in self.host_limits.values())
+            return max(1, min(self.backend_limit.value, host_total or self.backend_limit.value))
+
+    def host_capacity(self, host: str) -> int:
+        with self.lock:
+            host_limit = self.host_limits.get(host)
+            return host_limit.value if host_limit is not None else self.backend_limit.value
+
+    def pace(self):
+        self.bucket.acquire()
+
+    def on_response(self, host: str, latency: float, chars: int, outcome: str):
+        with self.lock:
+            host_limit = self.host_limits.get(host)
+
+            if outcome == OUTCOME_SUCCESS:
+                normalized_latency = latency * LATENCY_UNIT_CHARS / max(chars, LATENCY_UNIT_CHARS)
+                self.backend_limit.on_success(normalized_latency)
+                if host_limit is not None:
+                    host_limit.on_success(normalized_latency)
+
+                self.latency = latency if self.latency is None else 0.2 * latency + 0.8 * self.latency
+            elif outcome == OUTCOME_OVERLOAD:
+                self.backend_limit.on_overload()
+                if host_limit is not None:
+                    host_limit.on_overload()
+
+            # Start requests about as fast as the current window can drain them, never in one burst
+            if self.latency:
+                self.bucket.set_rate(max(self.min_rate, self.backend_limit.limit / self.latency * 2))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "backend": self.backend,
+                "limit": self.backend_limit.value,
+                "rate": round(self.bucket.rate, 2),
+                "hosts": {host: host_limit.value for host, host_limit in self.host_limits.items()}
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        host_limits = ", ".join(f"{host}: {limit}" for host, limit in stats["hosts"].items())
+        print(f"🎚️ Concurrency ({stats['backend']}): limit {stats['limit']} | pacing {stats['rate']} req/s | hosts: {host_limits}")
+
+
+def create_concurrency_controller(config: dict, backend: str, hosts: list) -> ConcurrencyController:
+    concurrency_config = config.get("concurrency", {})
+    maximum = concurrency_config.get("max", config.get("batch_size", 64))
+
+    return ConcurrencyController(
+        backend,
+        hosts,
+        initial=concurrency_config.get("initial", 4),
+        minimum=concurrency_config.get("min", 1),
+        maximum=maximum,
+        host_maximum=concurrency_config.get("host_max", 16),
+        backoff=concurrency_config.get("backoff", 0.7),
+        latency_tolerance=concurrency_config.get("latency_tolerance", 1.5),
+        decrease_cooldown=concurrency_config.get("decrease_cooldown_seconds", 2.0),
+        min_rate=concurrency_config.get("min_requests_per_second", 2.0),
+        burst=concurrency_config.get("burst", 4)
+    )
@@ -0,0 +1,133 @@
+import gzip
+import itertools
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+CONTENT_MANIFEST_FILE = "content.ndjson"
+CONTENT_MANIFEST_FORMAT = "kokoro-content-ndjson"
+CONTENT_MANIFEST_VERSION = 1
+
+
+def dump_line(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def make_header(title: str, created_at: str, complete: bool) -> dict:
+    return {
+        "format": CONTENT_MANIFEST_FORMAT,
+        "version": CONTENT_MANIFEST_VERSION,
+        "title": title,
+        "created_at": created_at,
+        "complete": complete,
+        "fields": ["id", "text", "is_chapter", "audio_file", "display_text", "duration_ms", "cumulative_ms",
+                   "chapter_file", "single_file"]
+    }
+
+
+class ContentManifestWriter:
+    # content.json as NDJSON: a header line, then one compact line per paragraph in book order. Lines are
+    # appended as paragraphs are packaged, a reader can parse whatever prefix is there and stop at any line.
+    def __init__(self, path: Path, title: str, created_at: str):
+        self.path = Path(path)
+        self.title = title
+        self.created_at = created_at
+        self.file = None
+
+    def start(self):
+        self.file = open(self.path, "wb")
+        self.file.write(dump_line(make_header(self.title, self.created_at, False)))
+        self.file.flush()
+
+    def append(self, paragraph: list):
+        # One write per line, a reader never sees half a paragraph
+        self.file.write(dump_line(paragraph))
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def write_content_manifest(path: Path, content_data: dict):
+    # Final version plus its .gz variant, written line by line in one pass, never as one big string
+    temp_path = path.with_name(f"{path.name}.part")
+    gzip_path = path.with_name(f"{path.name}.gz")
+    temp_gzip_path = gzip_path.with_name(f"{gzip_path.name}.part")
+
+    with open(temp_path, "wb") as f, gzip.GzipFile(temp_gzip_path, "wb", compresslevel=9, mtime=0) as gz:
+        for line in itertools.chain(
+                [dump_line(make_header(content_data["title"], content_data["created_at"], True))],
+                (dump_line(paragraph) for paragraph in content_data["paragraphs"])):
+            f.write(line)
+            gz.write(line)
+
+    # The variant must not be older than the file, or the API ignores it
+    os.replace(temp_path, path)
+    os.replace(temp_gzip_path, gzip_path)
+
+
+def iter_content_manifest(path: Path, start: int = 0, count: int = None):
+    # Yields the header, then paragraphs start..start + count without reading the rest of the file
+    with open(path, "rb") as f:
+        yield json.loads(f.readline())
+        for line in itertools.islice(f, start, start + count if count is not None else None):
+            if line.endswith(b"\n"):
+                yield json.loads(line)
+
+
+def read_content_manifest(path: Path, start: int = 0, count: int = None) -> dict:
+    if start == 0 and count is None:
+        return parse_content_manifest(Path(path).read_bytes())
+
+    lines = iter_content_manifest(path, start, count)
+    header = next(lines)
+    return {**header, "paragraphs": list(lines)}
+
+
+def parse_content_manifest(data: bytes) -> dict:
+    # Whole file: the lines are joined into one JSON array, a single json.loads instead of one per line
+    header_line, _, body = data.partition(b"\n")
+    lines = body.split(b"\n")
+    if lines and not lines[-1].endswith(b"]"):
+        lines.pop()  # still being appended to
+    return {**json.loads(header_line), "paragraphs": json.loads(b"[" + b",".join(lines) + b"]")}
+
+
+def compare_formats(content_data: dict, rounds: int = 3) -> list:
+    # [format, bytes, gzip bytes, full parse ms, first 50 paragraphs ms] of content.json and the NDJSON manifest
+    pretty = json.dumps(content_data, indent=4, ensure_ascii=False).encode("utf-8")
+    ndjson = dump_line(make_header(content_data["title"], content_data["created_at"], True)) + b"".join(
+        dump_line(paragraph) for paragraph in content_data["paragraphs"])
+
+    def best_ms(function) -> float:
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+        return min(timings)
+
+    def parse_head(data: bytes, count: int):
+        lines = data.split(b"\n", count + 1)
+        return [json.loads(line) for line in lines[:count + 1]]
+
+    return [
+        ["content.json (indent=4)", len(pretty), len(gzip.compress(pretty)),
+         best_ms(lambda: json.loads(pretty)), best_ms(lambda: json.loads(pretty)["paragraphs"][:50])],
+        ["content.ndjson", len(ndjson), len(gzip.compress(ndjson)),
+         best_ms(lambda: parse_content_manifest(ndjson)), best_ms(lambda: parse_head(ndjson, 50))]
+    ]
+
+
+if __name__ == "__main__":
+    # python -m app.content_manifest content.json [more.json ...] - size and parse time of both formats
+    for content_path in sys.argv[1:]:
+        content_data = json.loads(Path(content_path).read_text(encoding="utf-8"))
+        print(f"📄 {content_path}: {len(content_data['paragraphs'])} paragraphs")
+        for name, size, gzip_size, parse_ms, head_ms in compare_formats(content_data):
+            print(f"   {name:<24} {size / 1024:>9.1f} KB | gzip {gzip_size / 1024:>8.1f} KB | "
+                  f"full parse {parse_ms:>8.2f} ms | first 50 paragraphs {head_ms:>8.2f} ms")
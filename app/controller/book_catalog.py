@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_REFRESH_SECONDS = 5
+
+
+def get_mtime(path: Path) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class BookCatalog:
+    # In-memory index of the books folder. Requests are answered from the index, the folder is only looked at
+    # again once refresh_seconds passed, and then only the books whose folders changed (mtime) are rebuilt.
+    def __init__(self, books_folder: Path, build_book, refresh_seconds: float = DEFAULT_REFRESH_SECONDS):
+        self.books_folder = Path(books_folder)
+        self.build_book = build_book
+        self.refresh_seconds = refresh_seconds
+
+        self.lock = threading.Lock()
+        self.books = {}  # book_id -> book dict
+        self.signatures = {}  # book_id -> mtimes of the folders the book dict depends on
+        self.folder_mtime = None
+        self.ordered = []
+        self.digest = ""
+        self.checked_at = None
+
+    def book_signature(self, book_path: Path) -> tuple:
+        return (
+            get_mtime(book_path),
+            get_mtime(book_path / book_path.name),
+            get_mtime(self.books_folder / "Processing" / book_path.name)
+        )
+
+    def refresh(self, force: bool = False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.checked_at is not None and now - self.checked_at < self.refresh_seconds:
+                return
+            self.checked_at = now
+
+            folder_mtime = get_mtime(self.books_folder)
+            if folder_mtime != self.folder_mtime:
+                # Books added or removed
+                self.folder_mtime = folder_mtime
+                book_ids = sorted(entry.name for entry in os.scandir(self.books_folder) if entry.is_dir()) \
+                    if folder_mtime is not None else []
+            else:
+                book_ids = self.ordered
+
+            changed = set(self.books) != set(book_ids)
+            books = {}
+            signatures = {}
+            for book_id in book_ids:
+                book_path = self.books_folder / book_id
+                signature = self.book_signature(book_path)
+                if self.signatures.get(book_id) == signature:
+                    books[book_id] = self.books[book_id]
+                else:
+                    books[book_id] = self.build_book(book_path)
+                    changed = True
+                signatures[book_id] = signature
+
+            self.books = books
+            self.signatures = signatures
+            self.ordered = book_ids
+            if changed or not self.digest:
+                self.digest = hashlib.sha256(
+                    json.dumps([books[book_id] for book_id in book_ids], sort_keys=True).encode("utf-8")
+                ).hexdigest()
+
+    def page(self, offset: int = 0, limit: int = None, fields: list = None) -> list:
+        # [books, total, etag] of a slice of the catalog in book_id order
+        self.refresh()
+        with self.lock:
+            book_ids = self.ordered[max(0, offset):max(0, offset) + limit if limit is not None else None]
+            books = [select_fields(self.books[book_id], fields) for book_id in book_ids]
+            etag = make_etag(self.digest, offset, limit, fields)
+            return [books, len(self.ordered), etag]
+
+    def get(self, book_id: str, fields: list = None) -> list:
+        # [book or None, etag]
+        self.refresh()
+        with self.lock:
+            book = self.books.get(book_id)
+            if book is None:
+                return [None, None]
+            return [select_fields(book, fields), make_etag(book_id, self.signatures[book_id], fields)]
+
+
+def select_fields(book: dict, fields: list = None) -> dict:
+    if not fields:
+        return book
+    return {field: book[field] for field in fields if field in book}
+
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match or etag is None:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def parse_fields(fields: str | None) -> list | None:
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
@@ -1,24 +1,48 @@
-from starlette.responses import FileResponse
+import json
+import mimetypes
 
+from starlette.responses import FileResponse, JSONResponse, Response
+
+from app.controller.book_catalog import DEFAULT_REFRESH_SECONDS, BookCatalog, etag_matches, parse_fields
+from app.controller.paragraph_index import DEFAULT_MAX_BOOKS, DEFAULT_WINDOW, MAX_WINDOW, ParagraphIndexCache
 from app.utils import get_config
 from pathlib import Path
 
-config = get_config()
-def list_books() -> list:
-    current_folder = Path(config.get("books_folder"))
-    folder_content = list(current_folder.glob("*"))
-    items = []
-    for item in folder_content:
-        if item.is_file():
-            continue
-        items.append(get_book(item))
+PLAYLIST_FILE = "playlist.m3u8"
+PROGRESS_FILE = "progress.json"
+TRACE_FILE = "trace.json"
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+
+# Precompressed variants written next to content.json by the generator, in order of preference
+CONTENT_ENCODINGS = [["br", ".br"], ["gzip", ".gz"]]
+COMPRESSED_FILES = ["content.json", "content.ndjson"]
+
+class ContentFileResponse(FileResponse):
+    # Bigger reads for multi hundred MB books, fewer round trips through the thread pool
+    chunk_size = 1024 * 1024
+
+def list_books(offset: int = 0, limit: int = None, fields: str = None, if_none_match: str = None):
+    # Served from the catalog index, a client polling with If-None-Match gets a 304 without any filesystem access
+    books, total, etag = CATALOG.page(offset, limit, parse_fields(fields))
+    headers = {"ETag": etag, "X-Total-Count": str(total), "Cache-Control": "no-cache"}
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse([books], headers=headers)
 
-    return [items]
+def book_detail(book_id: str, fields: str = None, if_none_match: str = None):
+    book, etag = CATALOG.get(book_id, parse_fields(fields))
+    if book is None:
+        current_folder = Path(config.get("books_folder"))
+        book_path = current_folder / book_id
+        return get_book(book_path)
 
-def book_detail(book_id: str) -> dict:
-    current_folder = Path(config.get("books_folder"))
-    book_path = current_folder / book_id
-    return get_book(book_path)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse(book, headers=headers)
 
 def get_book(book_path: Path) -> dict:
     chapterized_path = book_path / book_path.name
@@ -35,6 +59,23 @@ def get_book(book_path: Path) -> dict:
     response_content_json_path = f"{response_chapterized_path}/content.json"
     response_cover_path = f"{response_chapterized_path}/cover.jpg"
 
+    # Written by the conversion jobs of the API, the job state is more precise than the files of a pending book
+    progress_path = Path(config.get("books_folder")) / "Processing" / book_path.name / PROGRESS_FILE
+    response_progress_path = None
+    if progress_path.is_file():
+        response_progress_path = f"Processing/{book_path.name}/{PROGRESS_FILE}"
+        if status == "pending":
+            try:
+                job_state = json.loads(progress_path.read_text(encoding="utf-8")).get("state")
+            except (OSError, ValueError):
+                job_state = None
+            if job_state in ("queued", "running", "failed", "cancelled"):
+                status = job_state
+
+    # Written by conversions with tracing on
+    trace_path = progress_path.with_name(TRACE_FILE)
+    response_trace_path = f"Processing/{book_path.name}/{TRACE_FILE}" if trace_path.is_file() else None
+
     audio_paths = []
     if status == "completed":
         for item in chapterized_path.glob("*.mp3"):
@@ -44,13 +85,110 @@ def get_book(book_path: Path) -> dict:
         "book_id": book_path.name,
         "path": response_chapterized_path,
         "content_json": response_content_json_path,
-        "progress_json": None,
+        "content_ndjson": f"{response_chapterized_path}/content.ndjson",
+        "progress_json": response_progress_path,
+        "trace_json": response_trace_path,
         "cover": response_cover_path,
         "status": status,
-        "audios": audio_paths
+        "audios": audio_paths,
+        "playlist": f"books/{book_path.name}/{PLAYLIST_FILE}" if get_stream_folder(book_path.name) else None
     }
 
-def get_content(path: str):
+def get_book_index(book_id: str):
+    books_folder = Path(config.get("books_folder")).resolve()
+    book_path = (books_folder / book_id).resolve()
+
+    try:
+        book_path.relative_to(books_folder)
+    except ValueError:
+        return None
+
+    return PARAGRAPH_INDEXES.get(book_path / book_path.name / "content.json")
+
+def get_paragraph_at(book_id: str, position_ms: int, before: int = DEFAULT_WINDOW, after: int = DEFAULT_WINDOW):
+    # The paragraph playing at position_ms of output.mp3 with a few neighbours, instead of the whole content.json
+    index = get_book_index(book_id)
+    if index is None:
+        return {"error": "no-such-book"}
+
+    current = index.index_at(position_ms)
+    if current is None:
+        return {"error": "no-paragraphs"}
+
+    return {
+        "book_id": book_id,
+        "position_ms": position_ms,
+        "duration_ms": index.duration(),
+        "total": len(index.paragraphs),
+        "current": current,
+        "paragraphs": index.window(current, clamp_window(before), clamp_window(after))
+    }
+
+def get_paragraph_range(book_id: str, from_id: str = None, to_id: str = None, limit: int = DEFAULT_WINDOW):
+    # Paragraphs from_id..to_id (inclusive), or limit paragraphs starting at from_id
+    index = get_book_index(book_id)
+    if index is None:
+        return {"error": "no-such-book"}
+
+    start = index.positions.get(from_id) if from_id else 0
+    end = index.positions.get(to_id) if to_id else None
+    if start is None or (to_id and end is None):
+        return {"error": "no-such-paragraph"}
+
+    limit = clamp_window(limit)
+    end = min(end + 1 if end is not None else len(index.paragraphs), start + limit)
+
+    return {
+        "book_id": book_id,
+        "total": len(index.paragraphs),
+        "paragraphs": index.entries(start, max(start, end))
+    }
+
+def clamp_window(size: int) -> int:
+    return max(0, min(MAX_WINDOW, size))
+
+def get_stream_folder(book_id: str) -> Path | None:
+    # Paragraph MP3s and the live playlist are written to the processing folder while the book is generated
+    processing_folder = (Path(config.get("books_folder")) / "Processing").resolve()
+    stream_folder = (processing_folder / book_id).resolve()
+
+    try:
+        stream_folder.relative_to(processing_folder)
+    except ValueError:
+        return None
+
+    if not (stream_folder / PLAYLIST_FILE).is_file():
+        return None
+    return stream_folder
+
+def get_playlist(book_id: str):
+    stream_folder = get_stream_folder(book_id)
+    if stream_folder is None:
+        return {"error": "no-such-playlist"}
+
+    # EVENT playlists grow while the book is generated, players have to re-fetch them
+    playlist = (stream_folder / PLAYLIST_FILE).read_text(encoding="utf-8")
+    is_live = "#EXT-X-ENDLIST" not in playlist
+    return Response(
+        playlist,
+        media_type=PLAYLIST_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache" if is_live else "public, max-age=3600"}
+    )
+
+def get_stream_segment(book_id: str, file_name: str):
+    stream_folder = get_stream_folder(book_id)
+    if stream_folder is None or "/" in file_name or "\\" in file_name or not file_name.endswith(".mp3"):
+        return {"error": "no-such-file"}
+
+    segment_path = stream_folder / file_name
+    if not segment_path.is_file():
+        return {"error": "no-such-file"}
+
+    # Paragraph files are written atomically and never change once listed in the playlist
+    return FileResponse(segment_path, media_type="audio/mpeg", headers={"Cache-Control": "public, max-age=86400"})
+
+def get_content(path: str, request_headers: dict = None):
+    request_headers = request_headers or {}
     books_folder_str = config.get("books_folder")
     books_folder = Path(books_folder_str)
     full_path = books_folder / path
@@ -63,4 +201,68 @@ def get_content(path: str):
     if not full_path.exists() or not full_path.is_file():
         return {"error": "no-such-file"}
 
-    return FileResponse(full_path)
\ No newline at end of file
+    served_path, content_encoding = full_path, None
+    if full_path.name in COMPRESSED_FILES:
+        served_path, content_encoding = find_compressed_variant(full_path, request_headers.get("accept-encoding"))
+
+    stat_result = served_path.stat()
+    etag = get_strong_etag(stat_result)
+    headers = {"ETag": etag, "Cache-Control": get_cache_control(full_path), "Accept-Ranges": "bytes"}
+    if full_path.name in COMPRESSED_FILES:
+        headers["Vary"] = "Accept-Encoding"
+    if content_encoding is not None:
+        headers["Content-Encoding"] = content_encoding
+
+    if etag_matches(request_headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    # Range, If-Range, 206/416 and multipart ranges are handled by FileResponse, full files go out through
+    # the server's http.response.pathsend (zero copy) where it has one
+    media_type = mimetypes.guess_type(full_path.name)[0] or "application/octet-stream"
+    return ContentFileResponse(served_path, headers=headers, media_type=media_type, stat_result=stat_result)
+
+def find_compressed_variant(path: Path, accept_encoding: str | None) -> list:
+    accepted = [encoding.split(";")[0].strip() for encoding in (accept_encoding or "").split(",")]
+    file_mtime = path.stat().st_mtime_ns
+
+    for encoding, suffix in CONTENT_ENCODINGS:
+        if encoding not in accepted:
+            continue
+        variant = path.with_name(f"{path.name}{suffix}")
+        try:
+            if variant.stat().st_mtime_ns >= file_mtime:
+                return [variant, encoding]
+        except OSError:
+            continue
+
+    return [path, None]
+
+def get_strong_etag(stat_result) -> str:
+    # Files are only ever replaced atomically, inode + size + mtime changes with every new version
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+def get_cache_control(path: Path) -> str:
+    if path.suffix == ".mp3":
+        return f"public, max-age={AUDIO_MAX_AGE}"
+    # content.json and the like change while a book is generated, revalidate with the ETag
+    return "no-cache"
+
+# Set by init_books() once the app starts, importing the controller reads no config
+config = None
+AUDIO_MAX_AGE = 86400
+CATALOG = None
+PARAGRAPH_INDEXES = None
+
+def init_books():
+    global config, AUDIO_MAX_AGE, CATALOG, PARAGRAPH_INDEXES
+    config = get_config()
+    AUDIO_MAX_AGE = config.get("content", {}).get("audio_max_age", 86400)
+
+    CATALOG = BookCatalog(
+        Path(config.get("books_folder")),
+        get_book,
+        config.get("catalog", {}).get("refresh_seconds", DEFAULT_REFRESH_SECONDS)
+    )
+    CATALOG.refresh()
+
+    PARAGRAPH_INDEXES = ParagraphIndexCache(config.get("paragraph_index", {}).get("max_books", DEFAULT_MAX_BOOKS))
\ No newline at end of file
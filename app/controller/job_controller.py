@@ -0,0 +1,101 @@
+import asyncio
+import json
+import time
+
+from starlette.responses import StreamingResponse
+
+from app.conversion_jobs import FINISHED_STATES, create_conversion_service
+from app.utils import get_config
+
+KEEP_ALIVE_SECONDS = 15
+
+# Set by start_jobs() once the app starts, importing the controller reads no config
+EVENT_INTERVAL = 0.5
+JOBS = None
+
+def start_jobs():
+    global EVENT_INTERVAL, JOBS
+    config = get_config()
+    jobs_config = config.get("jobs", {})
+    EVENT_INTERVAL = jobs_config.get("event_interval_seconds", 0.5)
+
+    JOBS = create_conversion_service(config)
+    if jobs_config.get("enabled", True):
+        JOBS.start()
+
+def stop_jobs():
+    if JOBS is not None:
+        JOBS.stop()
+
+def is_valid_epub_name(epub: str) -> bool:
+    return bool(epub) and "/" not in epub and "\\" not in epub and epub.endswith(".epub") \
+        and (JOBS.books_folder / epub).is_file()
+
+def create_job(epub: str, priority: int = None, weight: float = None, chapterize: bool = True):
+    if JOBS.scheduler is None:
+        return {"error": "jobs-disabled"}
+    if not is_valid_epub_name(epub):
+        return {"error": "no-such-file"}
+
+    job, created = JOBS.submit(epub, priority, weight, chapterize)
+    return {"created": created, "job": job.snapshot()}
+
+def create_jobs_for_all(chapterize: bool = True):
+    if JOBS.scheduler is None:
+        return {"error": "jobs-disabled"}
+    return {"jobs": [job.snapshot() for job in JOBS.submit_all(chapterize)]}
+
+def list_jobs():
+    return {"jobs": [job.snapshot() for job in JOBS.list_jobs()]}
+
+def get_job(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return {"error": "no-such-job"}
+    return job.snapshot()
+
+def control_job(job_id: str, action: str, priority: int = None, weight: float = None):
+    if JOBS.get(job_id) is None:
+        return {"error": "no-such-job"}
+
+    if action == "pause":
+        applied = JOBS.pause(job_id)
+    elif action == "resume":
+        applied = JOBS.resume(job_id)
+    elif action == "cancel":
+        applied = JOBS.cancel(job_id)
+    else:
+        applied = JOBS.reprioritize(job_id, priority, weight)
+
+    if not applied:
+        return {"error": "job-finished", "job": JOBS.get(job_id).snapshot()}
+    return JOBS.get(job_id).snapshot()
+
+def job_events(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return {"error": "no-such-job"}
+
+    async def events():
+        # Snapshots are sampled every EVENT_INTERVAL, a burst of paragraphs goes out as one event
+        version = None
+        sent_at = time.monotonic()
+        while True:
+            if job.version != version:
+                snapshot = job.snapshot()
+                version = snapshot["version"]
+                sent_at = time.monotonic()
+                yield f"id: {version}\nevent: progress\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+                if snapshot["state"] in FINISHED_STATES:
+                    yield "event: end\ndata: {}\n\n"
+                    return
+            elif time.monotonic() - sent_at >= KEEP_ALIVE_SECONDS:
+                sent_at = time.monotonic()
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(EVENT_INTERVAL)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,6 @@
+from starlette.responses import Response
+
+from app.metrics import CONTENT_TYPE, REGISTRY
+
+def get_metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE, headers={"Cache-Control": "no-cache"})
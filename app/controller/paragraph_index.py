@@ -0,0 +1,80 @@
+import bisect
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+DEFAULT_MAX_BOOKS = 16
+DEFAULT_WINDOW = 5
+MAX_WINDOW = 200
+
+
+class ParagraphIndex:
+    # content.json paragraphs ([id, text, is_chapter, mp3, display, duration, cumulative, chapter mp3, single mp3])
+    # with their end times in one sorted array, a playback position is found by binary search
+    def __init__(self, content: dict):
+        self.title = content.get("title")
+        self.paragraphs = content.get("paragraphs", [])
+        self.ends = []
+        self.positions = {}
+
+        end = 0
+        for index, paragraph in enumerate(self.paragraphs):
+            # cumulative durations never go backwards, even around paragraphs that failed to generate
+            end = max(end, paragraph[6] or 0)
+            self.ends.append(end)
+            self.positions[paragraph[0]] = index
+
+    def duration(self) -> int:
+        return self.ends[-1] if self.ends else 0
+
+    def index_at(self, position_ms: int) -> int | None:
+        if not self.paragraphs:
+            return None
+        return min(bisect.bisect_right(self.ends, max(0, position_ms)), len(self.paragraphs) - 1)
+
+    def start_of(self, index: int) -> int:
+        return self.ends[index] - (self.paragraphs[index][5] or 0)
+
+    def window(self, index: int, before: int, after: int) -> list:
+        start = max(0, index - before)
+        return self.entries(start, min(len(self.paragraphs), index + after + 1))
+
+    def entries(self, start: int, end: int) -> list:
+        return [
+            {"index": index, "start_ms": self.start_of(index), "paragraph": self.paragraphs[index]}
+            for index in range(start, end)
+        ]
+
+
+class ParagraphIndexCache:
+    # Indexes of the most recently used books, rebuilt when their content.json changes
+    def __init__(self, max_books: int = DEFAULT_MAX_BOOKS):
+        self.max_books = max(1, max_books)
+        self.lock = threading.Lock()
+        self.indexes = OrderedDict()  # content.json path -> [mtime_ns, ParagraphIndex]
+
+    def get(self, content_json: Path) -> ParagraphIndex | None:
+        try:
+            mtime = os.stat(content_json).st_mtime_ns
+        except OSError:
+            return None
+
+        key = str(content_json)
+        with self.lock:
+            cached = self.indexes.get(key)
+            if cached is not None and cached[0] == mtime:
+                self.indexes.move_to_end(key)
+                return cached[1]
+
+        # Parsed outside the lock, other books stay available meanwhile
+        index = ParagraphIndex(json.loads(Path(content_json).read_text(encoding="utf-8")))
+
+        with self.lock:
+            self.indexes[key] = [mtime, index]
+            self.indexes.move_to_end(key)
+            while len(self.indexes) > self.max_books:
+                self.indexes.popitem(last=False)
+
+        return index
@@ -0,0 +1,373 @@
+import datetime
+import itertools
+import json
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from app.generate_audiobook import IncompleteBookError, convert_epub_to_audiobook, get_book_settings, init, \
+    start_pipeline, stop_pipeline
+from app.manifest import write_bytes_atomic
+from app.metrics import REGISTRY
+from app.text_processor import convert_text_to_epub
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = [JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED]
+
+PROGRESS_FILE = "progress.json"
+DEFAULT_PROGRESS_INTERVAL = 1.0
+DEFAULT_MAX_FINISHED = 100
+
+
+def now_iso() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class ConversionJob:
+    # One book submitted through the API. Controls act on the book's synthesis queue once it runs, before that
+    # they only change how the job waits in the service's queue.
+    def __init__(self, job_id: str, epub_file: Path, sequence: int, priority: int, weight: float, chapterize: bool,
+                 progress_interval: float = DEFAULT_PROGRESS_INTERVAL):
+        self.id = job_id
+        self.epub_file = epub_file
+        self.sequence = sequence
+        self.priority = priority
+        self.weight = weight
+        self.chapterize = chapterize
+        self.progress_interval = progress_interval
+
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.cancel_requested = threading.Event()
+        self.state = JOB_QUEUED
+        self.paused = False
+        self.error = None
+        self.created_at = now_iso()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self.saved_at = 0.0
+
+        # Set by convert_epub_to_audiobook once the book is opened
+        self.output_dir = None
+        self.progress = None
+        self.scheduler = None
+        self.queue = None
+        self.backlog = None
+
+    # Called from the conversion ===============================================================================
+
+    def attach(self, output_dir: Path, progress, scheduler, queue, backlog):
+        with self.lock:
+            self.output_dir = output_dir
+            self.progress = progress
+            self.scheduler = scheduler
+            self.queue = queue
+            self.backlog = backlog
+
+            # Controls that arrived while the book was being opened
+            scheduler.update(queue, priority=self.priority, weight=self.weight, paused=self.paused)
+            if self.paused:
+                progress.pause()
+            if self.cancel_requested.is_set():
+                self.cancel_queue()
+        self.changed(True)
+
+    def cancelled(self) -> bool:
+        return self.cancel_requested.is_set()
+
+    def changed(self, save: bool = False):
+        # Event streams poll the version, progress.json is rewritten at most every progress_interval seconds
+        with self.lock:
+            self.version += 1
+            save = save or time.monotonic() - self.saved_at >= self.progress_interval
+            if save:
+                self.saved_at = time.monotonic()
+        if save:
+            self.save()
+
+    def save(self):
+        if self.output_dir is None:
+            return
+        with self.save_lock:
+            try:
+                write_bytes_atomic(self.output_dir / PROGRESS_FILE,
+                                   json.dumps(self.snapshot(), indent=4, ensure_ascii=False).encode("utf-8"))
+            except OSError as e:
+                print(f"⚠️ Could not write {PROGRESS_FILE} of {self.epub_file.name}: {e}")
+
+    # Controls =================================================================================================
+
+    def start(self):
+        with self.lock:
+            self.state = JOB_RUNNING
+            self.started_at = now_iso()
+        self.changed(True)
+
+    def finish(self, state: str, error: str = None):
+        with self.lock:
+            self.state = state
+            self.error = error
+            self.finished_at = now_iso()
+            if self.progress is not None:
+                self.progress.stop()
+        self.changed(True)
+
+    def set_paused(self, paused: bool) -> bool:
+        with self.lock:
+            if self.state in FINISHED_STATES:
+                return False
+            self.paused = paused
+            if self.queue is not None:
+                self.scheduler.update(self.queue, paused=paused)
+                if paused:
+                    self.progress.pause()
+                else:
+                    self.progress.resume()
+        self.changed(True)
+        return True
+
+    def set_priority(self, priority: int = None, weight: float = None) -> bool:
+        with self.lock:
+            if self.state in FINISHED_STATES:
+                return False
+            if priority is not None:
+                self.priority = priority
+            if weight is not None:
+                self.weight = weight
+            if self.queue is not None:
+                self.scheduler.update(self.queue, priority=priority, weight=weight)
+        self.changed(True)
+        return True
+
+    def cancel(self) -> bool:
+        with self.lock:
+            if self.state in FINISHED_STATES:
+                return False
+            self.cancel_requested.set()
+            if self.queue is not None:
+                self.cancel_queue()
+        self.changed(True)
+        return True
+
+    def cancel_queue(self):
+        # Pending requests are dropped, the ones in flight finish. The extractor may be waiting for the
+        # backlog, one slot is enough for it to notice the cancellation.
+        self.scheduler.update(self.queue, paused=False, cancelled=True)
+        self.backlog.release()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "job_id": self.id,
+                "epub": self.epub_file.name,
+                "book_id": self.output_dir.name if self.output_dir is not None else None,
+                "state": self.state,
+                "paused": self.paused,
+                "cancel_requested": self.cancel_requested.is_set(),
+                "priority": self.priority,
+                "weight": self.weight,
+                "chapterize": self.chapterize,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "version": self.version,
+                "progress": self.progress.to_dict() if self.progress is not None else None
+            }
+
+
+class ConversionService:
+    # Conversion jobs of the API, run by a fixed number of worker threads inside the service. The workers share
+    # one synthesis scheduler, so running books split the TTS hosts by priority and weight. Queued jobs start
+    # in priority order, then in submission order.
+    def __init__(self, books_folder: Path, workers: int, max_finished: int = DEFAULT_MAX_FINISHED,
+                 progress_interval: float = DEFAULT_PROGRESS_INTERVAL, config: dict = None):
+        self.books_folder = Path(books_folder)
+        self.config = config
+        self.workers = max(1, workers)
+        self.max_finished = max(0, max_finished)
+        self.progress_interval = progress_interval
+
+        self.condition = threading.Condition()
+        self.jobs = OrderedDict()  # job_id -> ConversionJob, in submission order
+        self.queued = []
+        self.sequence = itertools.count()
+        self.threads = []
+        self.scheduler = None
+        self.stopping = False
+        REGISTRY.add_collector(self.collect_metrics)
+
+    def start(self):
+        if self.scheduler is not None:
+            return
+        # The generator is set up here rather than when it is imported, a service that never starts leaves the
+        # caches and worker pools alone
+        init(self.config)
+        self.scheduler = start_pipeline()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.run_worker, name=f"job-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        print(f"🧵 Conversion service started with {self.workers} workers")
+
+    def stop(self):
+        if self.scheduler is None:
+            return
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+            running = [job for job in self.jobs.values() if job.state not in FINISHED_STATES and job not in self.queued]
+
+        for job in running:
+            job.cancel()
+        for thread in self.threads:
+            thread.join()
+
+        stop_pipeline(self.scheduler)
+        self.scheduler = None
+        self.threads = []
+
+    # Jobs =====================================================================================================
+
+    def submit(self, epub_name: str, priority: int = None, weight: float = None, chapterize: bool = True) -> list:
+        # [job, created], a book that is already queued or running is not submitted twice
+        epub_file = self.books_folder / epub_name
+        settings = get_book_settings(epub_file)
+
+        with self.condition:
+            for job in self.jobs.values():
+                if job.epub_file == epub_file and job.state not in FINISHED_STATES:
+                    return [job, False]
+
+            job = ConversionJob(
+                uuid.uuid4().hex[:12],
+                epub_file,
+                next(self.sequence),
+                settings["priority"] if priority is None else priority,
+                settings["weight"] if weight is None else weight,
+                chapterize,
+                self.progress_interval
+            )
+            self.jobs[job.id] = job
+            self.queued.append(job)
+            self.prune()
+            self.condition.notify()
+
+        print(f"📥 Queued job {job.id}: {epub_file.name}")
+        return [job, True]
+
+    def submit_all(self, chapterize: bool = True) -> list:
+        # Every EPUB of the books folder, like a CLI run
+        convert_text_to_epub()
+        return [self.submit(epub_file.name, chapterize=chapterize)[0]
+                for epub_file in sorted(self.books_folder.glob("*.epub"))]
+
+    def get(self, job_id: str) -> ConversionJob | None:
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> list:
+        with self.condition:
+            return list(self.jobs.values())
+
+    def pause(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        return job is not None and job.set_paused(True)
+
+    def resume(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or not job.set_paused(False):
+            return False
+        with self.condition:
+            self.condition.notify_all()
+        return True
+
+    def reprioritize(self, job_id: str, priority: int = None, weight: float = None) -> bool:
+        job = self.get(job_id)
+        return job is not None and job.set_priority(priority, weight)
+
+    def cancel(self, job_id: str) -> bool:
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            if job in self.queued:
+                self.queued.remove(job)
+                job.cancel_requested.set()
+                job.finish(JOB_CANCELLED)
+                return True
+        return job.cancel()
+
+    def collect_metrics(self) -> list:
+        with self.condition:
+            jobs = list(self.jobs.values())
+        states = {state: 0 for state in [JOB_QUEUED, JOB_RUNNING, *FINISHED_STATES]}
+        for job in jobs:
+            states[job.state] += 1
+        return [["kokoro_jobs", "gauge", "Conversion jobs by state",
+                 [[{"state": state}, count] for state, count in states.items()]]]
+
+    def prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    # Workers ==================================================================================================
+
+    def next_job(self) -> ConversionJob | None:
+        with self.condition:
+            while not self.stopping:
+                candidates = [job for job in self.queued if not job.paused]
+                if candidates:
+                    job = max(candidates, key=lambda job: (job.priority, -job.sequence))
+                    self.queued.remove(job)
+                    return job
+                self.condition.wait()
+            return None
+
+    def run_worker(self):
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+            self.run_job(job)
+
+    def run_job(self, job: ConversionJob):
+        if job.cancelled():
+            job.finish(JOB_CANCELLED)
+            return
+
+        job.start()
+        try:
+            convert_epub_to_audiobook(job.epub_file, self.scheduler, job)
+            job.finish(JOB_CANCELLED if job.cancelled() else JOB_COMPLETED)
+        except IncompleteBookError as e:
+            # Submitting the book again retries the failed paragraphs only
+            print(f"❌ Job {job.id} ({job.epub_file.name}) is incomplete: {e}")
+            job.finish(JOB_FAILED, str(e))
+        except Exception as e:
+            print(f"❌ Job {job.id} ({job.epub_file.name}) failed: {e}")
+            traceback.print_exc()
+            job.finish(JOB_FAILED, str(e))
+
+        with self.condition:
+            self.prune()
+
+
+def create_conversion_service(config: dict) -> ConversionService:
+    jobs_config = config.get("jobs", {})
+    return ConversionService(
+        Path(config.get("books_folder")),
+        jobs_config.get("workers", config.get("scheduler", {}).get("max_active_books", 3)),
+        jobs_config.get("max_finished", DEFAULT_MAX_FINISHED),
+        jobs_config.get("progress_interval_seconds", DEFAULT_PROGRESS_INTERVAL),
+        config
+    )
@@ -1,26 +1,69 @@
 import json
-import numbers
+import threading
 
-def get_endpoint_from_round_robin(config: json, index_ref: json) -> str:
+from app.balancer import HostBalancer
+from app.metrics import REGISTRY
+
+BALANCERS = {}
+BALANCERS_LOCK = threading.Lock()
+
+ENDPOINT_SELECTIONS = REGISTRY.counter("kokoro_endpoint_selections_total", "TTS endpoints handed out, by host",
+                                       ["host"])
+ENDPOINT_WAIT_SECONDS = REGISTRY.histogram("kokoro_endpoint_wait_seconds",
+                                           "Time spent waiting for a TTS host with spare capacity")
+
+
+def get_api_from(config: json) -> str:
     use_edge_tts = config.get('use_edge_tts_service', False)
-    api_from = "api" if not use_edge_tts else "edge_tts_api"
+    return "api" if not use_edge_tts else "edge_tts_api"
+
+
+def get_hosts(config: json) -> list:
+    api_from = get_api_from(config)
 
     default_host = config[api_from]["host"]
     round_robin_hosts = config[api_from]["host_round_robin"]
 
-    speech_endpoint = config[api_from]["endpoints"]["speech"]
+    return round_robin_hosts if len(round_robin_hosts) > 1 else [default_host]
+
+
+def get_balancer(config: json) -> HostBalancer:
+    api_from = get_api_from(config)
+
+    with BALANCERS_LOCK:
+        balancer = BALANCERS.get(api_from)
+        if balancer is None:
+            balancer_config = config.get("balancer", {})
+            balancer = HostBalancer(
+                get_hosts(config),
+                failure_threshold=balancer_config.get("failure_threshold", 3),
+                open_seconds=balancer_config.get("open_seconds", 15),
+                max_open_seconds=balancer_config.get("max_open_seconds", 300),
+                ewma_alpha=balancer_config.get("ewma_alpha", 0.3)
+            )
+            BALANCERS[api_from] = balancer
+
+    return balancer
+
+
+def acquire_endpoint(config: json, exclude: set = None, capacity=None) -> list:
+    with ENDPOINT_WAIT_SECONDS.time():
+        host, probe = get_balancer(config).acquire(exclude, capacity)
+    ENDPOINT_SELECTIONS.inc(host)
+    return [host, host + config[get_api_from(config)]["endpoints"]["speech"], probe]
 
-    round_robin_host_count = len(round_robin_hosts)
 
-    selected_host = default_host
+def release_endpoint(config: json, host: str, latency: float, ok: bool, probe: int = None):
+    get_balancer(config).release(host, latency, ok, probe)
 
-    if round_robin_host_count > 1:
-        index = index_ref.get('current')
-        selected_host = round_robin_hosts[index]
-        index += 1
-        index = 0 if round_robin_host_count <= index else index
-        index_ref.update({"current": index})
 
-    return selected_host + speech_endpoint
+def pause_endpoint(config: json, host: str, seconds: float):
+    get_balancer(config).pause(host, seconds)
 
 
+def probe_endpoints(config: json):
+    balancer_config = config.get("balancer", {})
+    get_balancer(config).probe_all(
+        balancer_config.get("probe_timeout", 3),
+        balancer_config.get("probe_path", "/")
+    )
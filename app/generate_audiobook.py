@@ -1,58 +1,138 @@
 import io
 import sys
 import urllib.parse
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from io import BytesIO
 
-from mutagen.mp3 import MP3
-
-from text_processor import extract_paragraphs_from_epub_simpler
-from text_processor import convert_text_to_epub
-from endpoint import get_endpoint_from_round_robin
-from utils import get_config
-from text_processor import extract_paragraphs_from_epub
+from app.audio_cache import create_audio_cache, payload_cache_key, print_cache_report
+from app.http_pool import create_sessions, get_session
+from app.synthesis_engine import ResponseBufferLimit, RetryLater, SynthesisScheduler
+from app.manifest import BookManifest, write_bytes_atomic, write_with_compressed_variants
+from app.chunk_planner import ChunkGroup, ThroughputStats, describe_plan, plan_chunks
+from app.postprocess import create_post_processor, finish_paragraph_audio, finish_paragraph_file, postprocess_group
+from app.book_packager import BookPackager
+from app.book_progress import BookProgress
+from app.hls_playlist import create_hls_playlist
+from app.content_manifest import CONTENT_MANIFEST_FILE, ContentManifestWriter, write_content_manifest
+from app.text_processor import convert_text_to_epub, start_extraction_pool, stop_extraction_pool
+from app.text_processor import init as init_text_processor
+from app.book_cache import ParsedBook, open_parsed_book
+from app.endpoint import acquire_endpoint, get_api_from, get_balancer, get_hosts, pause_endpoint, probe_endpoints, \
+    release_endpoint
+from app.concurrency import OUTCOME_ERROR, OUTCOME_OVERLOAD, OUTCOME_SUCCESS, create_concurrency_controller, \
+    parse_retry_after
+from app.metrics import REGISTRY, STAGE_SECONDS
+from app.retry_policy import create_retry_policy, is_retryable
+from app.tracing import TRACE_FILE, TRACER, configure_tracing
+from app.utils import get_config
 
 sys.stdout.reconfigure(line_buffering=True)
 
 import os
+import fnmatch
+import threading
+import traceback
 import time
 import json
 import datetime
 import requests
 import re
 import shutil
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pydub import AudioSegment
 from pathlib import Path
 from ebooklib import epub
 
-config = get_config()
-
-KOKORO_ENDPOINT = config["api"]["host"] + config["api"]["endpoints"]["speech"]
-TTS_SETTINGS = config.get("tts_settings", {})
-MAX_RETRIES = config.get("max_retries", 5)
+FAILED_REPORT = "failed_paragraphs.json"
 EPUB_DOCUMENT = 9
-EPUB_IMAGE = 1
-EPUB_IMAGE_2 = 10
+SINGLE_AUDIO_NAME = 'output.mp3'
+
+THROUGHPUT = ThroughputStats()
+
+# Set by init(), importing the module reads no config and touches no files
+config = None
 
-EDGE_TTS_ENDPOINT = config["edge_tts_api"]["host"] + config["edge_tts_api"]["endpoints"]["speech"]
-EDGE_TTS_PROSODY_MODS = config["edge_tts_api"]["prosody_mods"]
-EDGE_TTS_HOST_ROUND_ROBIN = config['edge_tts_api']['host_round_robin']
-EDGE_TTS_SETTINGS = config.get("edge_tts_settings", {})
-USE_EDGE_TTS = config.get("use_edge_tts_service", False)
-EDGE_TTS_VOICE = EDGE_TTS_SETTINGS.get("voice")
-EDGE_TTS_VOICE2 = EDGE_TTS_SETTINGS.get("voice2", EDGE_TTS_VOICE)
 
-USE_WAV_TO_MP3 = config.get("use_wav_to_mp3", False)
-USE_GET_REQUEST = config.get("use_get_request", False)
+def init(loaded_config: dict = None):
+    # Reads the config and sets up the TTS cache, concurrency and post-processing of the process. Called once by
+    # main() and by the API's job service before the pipeline starts, later calls change nothing.
+    global config, KOKORO_ENDPOINT, TTS_SETTINGS, MAX_RETRIES, RETRY_POLICY, ALLOW_INCOMPLETE_BOOKS, \
+        EDGE_TTS_ENDPOINT, EDGE_TTS_PROSODY_MODS, EDGE_TTS_HOST_ROUND_ROBIN, EDGE_TTS_SETTINGS, USE_EDGE_TTS, \
+        EDGE_TTS_VOICE, EDGE_TTS_VOICE2, TTS_SETTINGS_IN_USE, USE_WAV_TO_MP3, USE_GET_REQUEST, \
+        MAX_BUFFERED_RESPONSES, STREAM_RESPONSES, STREAMING_CONFIG, SPOOL_FOLDER, STREAM_CHUNK_SIZE, API_TIMEOUT, \
+        AUDIO_CACHE, RESPONSE_BUFFERS, CONCURRENCY, MAX_CONCURRENCY, CHUNK_PLANNER, SCHEDULER_CONFIG, \
+        PIPELINE_CONFIG, POSTPROCESSOR
+    if config is not None:
+        return
 
-BATCH_SIZE = config.get("batch_size", 5) if USE_EDGE_TTS else 5
-BATCH_STAGGER = config.get("batch_stagger", 250) if USE_EDGE_TTS else 200
+    config = loaded_config or get_config()
+    configure_tracing(config, sys.argv)
+    init_text_processor(config)
+
+    KOKORO_ENDPOINT = config["api"]["host"] + config["api"]["endpoints"]["speech"]
+    TTS_SETTINGS = config.get("tts_settings", {})
+    MAX_RETRIES = config.get("max_retries", 5)
+    RETRY_POLICY = create_retry_policy(config)
+    # A book with paragraphs that failed even in the final sweep gets no single MP3 unless this is set
+    ALLOW_INCOMPLETE_BOOKS = config.get("retry", {}).get("allow_incomplete_books", False)
+
+    EDGE_TTS_ENDPOINT = config["edge_tts_api"]["host"] + config["edge_tts_api"]["endpoints"]["speech"]
+    EDGE_TTS_PROSODY_MODS = config["edge_tts_api"]["prosody_mods"]
+    EDGE_TTS_HOST_ROUND_ROBIN = config['edge_tts_api']['host_round_robin']
+    EDGE_TTS_SETTINGS = config.get("edge_tts_settings", {})
+    USE_EDGE_TTS = config.get("use_edge_tts_service", False)
+    EDGE_TTS_VOICE = EDGE_TTS_SETTINGS.get("voice")
+    EDGE_TTS_VOICE2 = EDGE_TTS_SETTINGS.get("voice2", EDGE_TTS_VOICE)
+    TTS_SETTINGS_IN_USE = EDGE_TTS_SETTINGS if USE_EDGE_TTS else TTS_SETTINGS
+
+    USE_WAV_TO_MP3 = config.get("use_wav_to_mp3", False)
+    USE_GET_REQUEST = config.get("use_get_request", False)
+
+    MAX_BUFFERED_RESPONSES = config.get("max_buffered_responses", 16)
+
+    # "stream": true in the TTS settings streams every response body into a spool file instead of memory
+    STREAM_RESPONSES = TTS_SETTINGS_IN_USE.get("stream", False)
+    STREAMING_CONFIG = config.get("streaming", {})
+    SPOOL_FOLDER = Path(STREAMING_CONFIG.get("spool_folder", "/app/cache/spool"))
+    STREAM_CHUNK_SIZE = STREAMING_CONFIG.get("chunk_size", 64 * 1024)
+    API_TIMEOUT = config[get_api_from(config)].get("timeout", 300)
+
+    AUDIO_CACHE = create_audio_cache(config)
+    RESPONSE_BUFFERS = ResponseBufferLimit(MAX_BUFFERED_RESPONSES)
+    CONCURRENCY = create_concurrency_controller(config, get_api_from(config), get_hosts(config))
+    MAX_CONCURRENCY = CONCURRENCY.maximum
+
+    CHUNK_PLANNER = config.get("chunk_planner", {})
+    SCHEDULER_CONFIG = config.get("scheduler", {})
+    PIPELINE_CONFIG = config.get("pipeline", {})
+    POSTPROCESSOR = create_post_processor(config, MAX_CONCURRENCY)
+
+    REGISTRY.add_collector(collect_host_metrics)
+
+
+# Host and latency of the last TTS attempt of the current worker thread, a cache hit leaves host "cache" and no latency
+REQUEST_INFO = threading.local()
+
+TTS_REQUEST_SECONDS = REGISTRY.histogram("kokoro_tts_request_seconds", "Latency of TTS requests by host and outcome",
+                                         ["host", "outcome"])
+TTS_CHARS = REGISTRY.counter("kokoro_tts_chars_total", "Characters synthesized by TTS host", ["host"])
+TTS_RESPONSE_BYTES = REGISTRY.counter("kokoro_tts_response_bytes_total", "Audio bytes received by TTS host", ["host"])
+TTS_RETRIES = REGISTRY.counter("kokoro_tts_retries_total", "TTS requests retried after a failed attempt")
+PARAGRAPHS = REGISTRY.counter("kokoro_paragraphs_total", "Paragraphs packaged by result", ["result"])
+# rate() of it is the realtime factor, seconds of audio produced per second of wall time
+AUDIO_PRODUCED_SECONDS = REGISTRY.counter("kokoro_audio_produced_seconds_total", "Seconds of paragraph audio produced")
+
+class IncompleteBookError(Exception):
+    # Raised once the book's files are written, output_dir is complete apart from the failed paragraphs
+    def __init__(self, output_dir: Path, failed: list):
+        super().__init__(f"{len(failed)} paragraphs failed, see {output_dir / FAILED_REPORT}")
+        self.output_dir = output_dir
+        self.failed = failed
 
-ROUND_ROBIN_INDEX_REF = {
-    "current": 0
-}
 
 def main():
+    init()
     convert_text_to_epub()
     convert_epubs_to_audiobooks()
 
@@ -65,11 +145,130 @@ def convert_epubs_to_audiobooks():
         print("📁 No EPUB file found.")
         return
 
-    for epub_file in epub_files:
-        convert_epub_to_audiobook(epub_file)
+    # Several books are converted at once, their synthesis jobs share one scheduler and concurrency budget so
+    # the TTS hosts stay busy while a book is being extracted or packaged
+    epub_files.sort(key=lambda epub_file: -get_book_settings(epub_file)["priority"])
+    max_active_books = max(1, SCHEDULER_CONFIG.get("max_active_books", 3))
+    cache_stats_at_start = AUDIO_CACHE.stats()
+
+    with running_pipeline() as scheduler:
+        with ThreadPoolExecutor(max_workers=max_active_books, thread_name_prefix="book") as executor:
+            futures = {
+                executor.submit(convert_epub_to_audiobook, epub_file, scheduler): epub_file
+                for epub_file in epub_files
+            }
+            for future, epub_file in futures.items():
+                try:
+                    future.result()
+                except IncompleteBookError as e:
+                    print(f"❌ {epub_file.name} is incomplete: {e}")
+                except Exception as e:
+                    print(f"❌ Conversion of {epub_file.name} failed: {e}")
+                    traceback.print_exc()
+
+    print_cache_report(AUDIO_CACHE, cache_stats_at_start, "all books")
+    get_balancer(config).print_stats()
+    CONCURRENCY.print_stats()
+    write_metrics_textfile()
+    print("🎉 All books done!")
+
+
+def write_metrics_textfile():
+    # A CLI run has no /metrics endpoint, node_exporter's textfile collector can pick this file up instead
+    textfile = config.get("metrics", {}).get("textfile")
+    if textfile:
+        write_bytes_atomic(Path(textfile), REGISTRY.render().encode("utf-8"))
+        print(f"📈 Metrics written to {textfile}")
+
+
+def start_pipeline() -> SynthesisScheduler:
+    # Shared by every book of the process, the CLI run or the API's job workers
+    if STREAM_RESPONSES:
+        prepare_spool_folder()
+
+    POSTPROCESSOR.start()
+    start_extraction_pool()
+
+    # Sessions first, the probe goes through them. Every host is probed before the first request is scheduled.
+    create_sessions(config, MAX_CONCURRENCY)
+    probe_endpoints(config)
+    scheduler = SynthesisScheduler(MAX_CONCURRENCY, CONCURRENCY.limit)
+    scheduler.start()
+    return scheduler
+
+
+def stop_pipeline(scheduler: SynthesisScheduler):
+    scheduler.stop()
+    POSTPROCESSOR.shutdown()
+    stop_extraction_pool()
+
+
+@contextmanager
+def running_pipeline():
+    # The pipeline of a run that converts a fixed set of books (the CLI, the benchmark), stopped afterwards
+    scheduler = start_pipeline()
+    try:
+        yield scheduler
+    finally:
+        stop_pipeline(scheduler)
+
+
+def collect_host_metrics() -> list:
+    # Read at scrape time from the balancer and the concurrency controller
+    hosts = get_balancer(config).stats()
+    concurrency = CONCURRENCY.stats()
+    cache = AUDIO_CACHE.stats()
+    return [
+        ["kokoro_host_in_flight", "gauge", "TTS requests in flight by host",
+         [[{"host": host["host"]}, host["in_flight"]] for host in hosts]],
+        ["kokoro_host_circuit_open", "gauge", "1 while the circuit breaker of the host is not closed",
+         [[{"host": host["host"]}, int(host["circuit"] != "closed")] for host in hosts]],
+        ["kokoro_host_concurrency_limit", "gauge", "Learned concurrency limit by host",
+         [[{"host": host}, limit] for host, limit in concurrency["hosts"].items()]],
+        ["kokoro_concurrency_limit", "gauge", "Learned concurrency limit of the backend", [[{}, concurrency["limit"]]]],
+        ["kokoro_tts_cache_lookups_total", "counter", "TTS cache lookups by result",
+         [[{"result": "hit"}, cache["hits"]], [{"result": "miss"}, cache["misses"]]]]
+    ]
+
+
+def get_book_settings(epub_file: Path) -> dict:
+    # "scheduler": {"books": {"<file name pattern>": {"priority": 1, "weight": 2}}}, first match wins
+    for pattern, settings in SCHEDULER_CONFIG.get("books", {}).items():
+        if fnmatch.fnmatch(epub_file.name, pattern):
+            return {"priority": settings.get("priority", 0), "weight": settings.get("weight", 1)}
+    return {"priority": 0, "weight": 1}
+
+
+def convert_epub_to_audiobook(epub_file: epub, scheduler: SynthesisScheduler, job=None) -> Path:
+    # job: a ConversionJob of the API, which can pause, cancel and reprioritize the book while it runs
+    cache_stats_at_start = AUDIO_CACHE.stats()
+    try:
+        if not TRACER.enabled:
+            return convert_book(epub_file, scheduler, job)
 
+        # Every span recorded for the book goes into its trace.json, a failed conversion's spans are dropped
+        try:
+            with TRACER.book(epub_file.stem), TRACER.span("convert_epub_to_audiobook", "book", epub=epub_file.name):
+                output_dir = convert_book(epub_file, scheduler, job)
+        except IncompleteBookError as e:
+            write_trace(e.output_dir, epub_file.stem)
+            raise
+        except BaseException:
+            TRACER.take(epub_file.stem)
+            raise
+
+        write_trace(output_dir, epub_file.stem)
+        return output_dir
+    finally:
+        print_cache_report(AUDIO_CACHE, cache_stats_at_start, epub_file.name)
+
+
+def write_trace(output_dir: Path, book: str):
+    count = TRACER.write(output_dir / TRACE_FILE, book)
+    print(f"🧭 Trace of {count} spans written to {output_dir / TRACE_FILE}")
 
-def convert_epub_to_audiobook(epub_file: epub):
+
+def convert_book(epub_file: epub, scheduler: SynthesisScheduler, job=None) -> Path:
     start_time = datetime.datetime.now()
     current_folder = Path(config.get("books_folder")) / "Processing"
 
@@ -78,82 +277,138 @@ def convert_epub_to_audiobook(epub_file: epub):
     print(f"📖 Processing: {epub_file.name}")
     print(f"📂 Output folder: {output_dir}")
 
-    extract_cover_image(epub_file, output_dir)
+    with TRACER.span("open_book", "extract"):
+        parsed_book = open_parsed_book(epub_file, config)
+        extract_cover_image(parsed_book, output_dir)
 
-    paragraphs = extract_paragraphs_from_epub_simpler(epub_file)
     content_json = output_dir / "content.json"
+    singled_dir = Path(get_config().get('singled_books_folder', '')) / output_dir.name
+    single_output = job.chapterize if job is not None else "--chapterize" in sys.argv
+
+    # Only pending, failed and corrupt paragraphs are queued again, finished ones are trusted from the manifest
+    manifest = BookManifest(output_dir)
+    paragraphs = []
+    jobs = []
+    groups = []
+    progress = BookProgress()
+
+    def on_paragraph_packaged(paragraph, duration, host):
+        progress.on_paragraph(paragraph, duration, host)
+        PARAGRAPHS.inc("failed" if duration is None else "done")
+        if duration:
+            AUDIO_PRODUCED_SECONDS.inc(amount=duration / 1000)
+        print_progress(epub_file.stem, paragraph[3], start_time, progress.current, progress.remaining,
+                       progress.total, progress.cumulative_duration)
+        if job is not None:
+            job.changed()
+
+    if single_output and singled_dir.exists():
+        print(f"🧹 Removing existing folder: {singled_dir}")
+        shutil.rmtree(singled_dir)
 
-    print("📝 Paragraphs extracted:")
-    for para in paragraphs:
-        para_id, text, is_chapter = para[:3]
-        tag = "[CHAPTER]" if is_chapter else "[PARA]"
-        print(f"{tag} {para_id}: {text[:80]}{'...' if len(text) > 80 else ''}")
-
-    print(f"✏️ Converting {len(paragraphs)} paragraphs to audio parts...")
-
-    total = len(paragraphs)
-    remaining = total
-    current = 0
-    cumulative_duration = 0
-    batch = []
-
-    for paragraph in paragraphs:
-        para_id = paragraph[0]
-        text_content = paragraph[1]
-        audio_file_prefix = f"adbk-{para_id}"
-
-        is_chapter = paragraph[2] == 1
-        chapter_title = paragraph[1] if is_chapter else ""
-
-        if chapter_title:
-            chapter_title = ' '.join(chapter_title.split()[:5])
-            chapter_title = re.sub(r'[^A-Za-z0-9 ]+', '', chapter_title)
-            chapter_title = chapter_title.replace(' ', '-')
-            chapter_title = f"-{chapter_title}"
-        else:
-            None
-
-        audio_file = f"{audio_file_prefix}{chapter_title}.mp3"
-        paragraph[3] = audio_file
-
-        audio_file_path = output_dir / audio_file
+    packager = BookPackager(
+        epub_file.stem,
+        output_dir,
+        manifest,
+        singled_dir / SINGLE_AUDIO_NAME if single_output else None,
+        on_paragraph_packaged,
+        lambda job: generate_audio_from_text(job[1], job[2], job[3], job[0][0]),
+        create_hls_playlist(config, output_dir),
+        ContentManifestWriter(output_dir / CONTENT_MANIFEST_FILE, epub_file.stem, timestamp)
+    )
+    packager.start()
+
+    # Extraction -> synthesis: at most max_queued_chunks requests wait in the scheduler, the extractor blocks
+    # until the TTS hosts catch up
+    backlog = threading.Semaphore(PIPELINE_CONFIG.get("max_queued_chunks", 4 * MAX_CONCURRENCY))
+    book_settings = get_book_settings(epub_file)
+    THROUGHPUT.reset(epub_file.stem)
+    synthesis_start = time.monotonic()
+    synthesis_queue = scheduler.open_queue(
+        epub_file.name,
+        synthesize_chunk,
+        lambda chunk, result: backlog.release(),
+        book_settings["priority"],
+        book_settings["weight"],
+        lambda chunk: len(chunk[0].segments[chunk[1]])
+    )
+    if job is not None:
+        job.attach(output_dir, progress, scheduler, synthesis_queue, backlog)
 
-        if audio_file_path.exists() and audio_file_path.stat().st_size > 0:
-            print(f"✅ Audio file already exists: {audio_file}")
-            remaining -= 1
-            continue
+    try:
+        batches = iter_batches(parsed_book.iter_paragraphs(), PIPELINE_CONFIG.get("extraction_batch", 200))
+        for batch in TRACER.iter_spans(batches, "extract_batch", "extract"):
+            print("📝 Paragraphs extracted:")
+            for para in batch:
+                para_id, text, is_chapter = para[:3]
+                tag = "[CHAPTER]" if is_chapter else "[PARA]"
+                print(f"{tag} {para_id}: {text[:80]}{'...' if len(text) > 80 else ''}")
+                para[3] = get_audio_file_name(para)
+
+            batch_ids = [paragraph[0] for paragraph in batch]
+            with TRACER.span("sync_manifest", "extract", paragraphs=len(batch)):
+                manifest.sync_paragraphs(batch, len(paragraphs))
+                manifest.adopt_existing_files(batch_ids)
+                pending_para_ids = manifest.pending_para_ids(batch_ids)
+
+            paragraphs += batch
+            batch_jobs = [
+                (paragraph, paragraph[1], output_dir / paragraph[3], manifest, packager)
+                for paragraph in batch if paragraph[0] in pending_para_ids
+            ]
+            jobs += batch_jobs
+            progress.add_batch(len(batch), batch_jobs)
+            packager.add_paragraphs(batch, set(batch_ids) - pending_para_ids)
+
+            batch_groups = plan_synthesis(batch_jobs)
+            groups += batch_groups
+            for group in batch_groups:
+                for segment_index in range(len(group.segments)):
+                    with TRACER.span("backlog_wait", "extract"):
+                        backlog.acquire()
+                    if job is not None and job.cancelled():
+                        # The job released the backlog, nothing more is queued
+                        break
+                    scheduler.add_jobs(synthesis_queue, [(group, segment_index)])
+                if job is not None and job.cancelled():
+                    break
+
+            if job is not None:
+                if job.cancelled():
+                    break
+                job.changed()
+    finally:
+        scheduler.close_queue(synthesis_queue)
+        progress.extraction_done()
 
-        batch.append((paragraph, text_content, audio_file_path, (BATCH_STAGGER * len(batch))))
-        batch_size = len(batch)
+    print(f"✏️ Converting {len(paragraphs)} paragraphs to audio parts...")
+    print(f"✅ {len(paragraphs) - len(jobs)} paragraphs already done, {len(jobs)} to synthesize")
 
-        if batch_size < BATCH_SIZE:
-            continue
+    with TRACER.span("synthesis_wait", "synthesis", paragraphs=len(jobs)):
+        synthesis_queue.wait()
+    print(THROUGHPUT.describe(epub_file.stem, jobs, groups, time.monotonic() - synthesis_start))
+    THROUGHPUT.reset(epub_file.stem)
 
-        process_audio_batch(batch)
-        batch = []
+    failed_groups = [group for group in groups if group.error is not None]
+    if failed_groups and RETRY_POLICY.final_sweep and not (job is not None and job.cancelled()):
+        with TRACER.span("final_sweep", "synthesis", groups=len(failed_groups)):
+            sweep_failed_groups(failed_groups, scheduler, synthesis_queue, job)
 
-        current += batch_size
-        elapsed_time = datetime.datetime.now() - start_time
-        time_left = (elapsed_time / current) * (remaining - current)
-        completed = total - remaining + current
-        percent = round((completed / total) * 100)
+    if job is not None and job.cancelled():
+        # Whatever finished stays in the manifest, submitting the book again resumes from there
+        packager.abandon()
+        manifest.close()
+        print(f"🛑 Cancelled: {epub_file.name}")
+        return output_dir
 
-        print(
-            f"🔊 {audio_file} ({completed}/{total}) (batch size:{batch_size}) ({percent}%) duration: {seconds_to_hms(cumulative_duration / 1000)} - Elapsed: {elapsed_time} | Estimated time left: {time_left} | {remaining} at start")
-        print("=" * os.get_terminal_size().columns)
-        term_width = os.get_terminal_size().columns
-        bar_length = term_width - 8  # Reserve space for " 100%" and brackets
-        bar_length = max(10, bar_length)  # Ensure minimum bar length
-        filled_length = int(bar_length * percent // 100)
-        bar = '█' * filled_length + '-' * (bar_length - filled_length)
-        print(f"<{bar}> {percent}%")
-        print("=" * os.get_terminal_size().columns)
+    with TRACER.span("package_close", "package"):
+        single_result = packager.close()
 
-    batch_size = len(batch)
-    if batch_size > 0:
-        process_audio_batch(batch)
+    failed = manifest.failed([paragraph[0] for paragraph in paragraphs])
+    write_failed_report(output_dir, failed, paragraphs)
 
-    paragraphs = compute_durations(output_dir, paragraphs)
+    paragraphs = compute_durations(output_dir, paragraphs, manifest)
+    manifest.close()
 
     content_data = {
         "title": epub_file.stem,
@@ -161,40 +416,239 @@ def convert_epub_to_audiobook(epub_file: epub):
         "paragraphs": paragraphs
     }
 
-    content_json.write_text(json.dumps(content_data, indent=4, ensure_ascii=False))
+    write_content_manifest(output_dir / CONTENT_MANIFEST_FILE, content_data)
+    # content.json for older clients
+    write_with_compressed_variants(content_json,
+                                   json.dumps(content_data, indent=4, ensure_ascii=False).encode("utf-8"))
 
-    if "--chapterize" in sys.argv:
-        #print("📚 Chapterizing MP3 files...")
-        #chapterize_mp3s(content_data, output_dir)
+    if single_output and (not failed or ALLOW_INCOMPLETE_BOOKS):
         print("📚 Singling MP3 files...")
-        single_mp3(content_data, output_dir)
+        finish_single_mp3(content_data, output_dir, singled_dir, packager, single_result)
+    elif single_output and singled_dir.exists():
+        # The single MP3 was appended while the book was synthesized, it has holes where the failed paragraphs are
+        print(f"🧹 Not publishing {epub_file.stem} with {len(failed)} paragraphs missing")
+        shutil.rmtree(singled_dir)
+
+    if failed and not ALLOW_INCOMPLETE_BOOKS:
+        raise IncompleteBookError(output_dir, failed)
+
+    print(f"🎉 Done: {epub_file.name}")
+    return output_dir
+
+
+def sweep_failed_groups(failed_groups: list, scheduler: SynthesisScheduler, synthesis_queue, job=None):
+    # Every paragraph that ran out of retries gets one more round once the rest of the book is done, the hosts
+    # had the whole pass to recover. One paragraph per request: a packed request may have failed for one of them.
+    sweep_jobs = [paragraph_job for group in failed_groups for paragraph_job in group.jobs]
+    sweep_groups = plan_synthesis(sweep_jobs, pack=False)
+    for group in sweep_groups:
+        group.last_pass = True
+
+    print(f"🧹 Final sweep: retrying {len(sweep_jobs)} failed paragraphs in {len(sweep_groups)} groups")
+    sweep_queue = scheduler.submit(
+        f"{synthesis_queue.name} (sweep)",
+        [(group, segment_index) for group in sweep_groups for segment_index in range(len(group.segments))],
+        synthesize_chunk,
+        None,
+        synthesis_queue.priority,
+        synthesis_queue.weight,
+        synthesis_queue.cost
+    )
+    if job is not None:
+        # Pause, cancel and priority changes apply to the sweep from now on
+        job.attach(job.output_dir, job.progress, scheduler, sweep_queue, job.backlog)
+    sweep_queue.wait()
 
-    print("🎉 Done!")
 
+def write_failed_report(output_dir: Path, failed: list, paragraphs: list):
+    report_path = output_dir / FAILED_REPORT
+    if not failed:
+        report_path.unlink(missing_ok=True)
+        return
 
-def process_audio_batch(batch) -> int:
-    with ThreadPoolExecutor(max_workers=len(batch)) as executor:
-        future_to_para = {
-            executor.submit(generate_audio_from_text, text, path, stagger):
-                (para, path) for para, text, path, stagger in batch
+    texts = {paragraph[0]: paragraph[1] for paragraph in paragraphs}
+    print(f"❌ {len(failed)} paragraphs failed permanently, they will be retried on the next run:")
+    for row in failed:
+        print(f"   {row['para_id']} ({row['attempts']} attempts): {row['error']}")
+
+    report = [
+        {
+            "para_id": row["para_id"],
+            "audio_file": row["audio_file"],
+            "attempts": row["attempts"],
+            "error": row["error"],
+            "text": texts.get(row["para_id"], "")
         }
+        for row in failed
+    ]
+    write_bytes_atomic(report_path, json.dumps(report, indent=4, ensure_ascii=False).encode("utf-8"))
+
 
-        for future in as_completed(future_to_para):
-            para, path = future_to_para[future]
+def iter_batches(items, batch_size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_audio_file_name(paragraph: list) -> str:
+    audio_file_prefix = f"adbk-{paragraph[0]}"
+
+    is_chapter = paragraph[2] == 1
+    chapter_title = paragraph[1] if is_chapter else ""
+
+    if chapter_title:
+        chapter_title = ' '.join(chapter_title.split()[:5])
+        chapter_title = re.sub(r'[^A-Za-z0-9 ]+', '', chapter_title)
+        chapter_title = chapter_title.replace(' ', '-')
+        chapter_title = f"-{chapter_title}"
+
+    return f"{audio_file_prefix}{chapter_title}.mp3"
+
+
+def plan_synthesis(jobs: list, pack: bool = True) -> list:
+    # Frame level splitting only works on MP3, other formats keep one request per paragraph
+    if not CHUNK_PLANNER.get("enabled", True) or not is_mp3_response(TTS_SETTINGS_IN_USE):
+        return [ChunkGroup([job], [job[1]], select_voice(job[1])) for job in jobs]
+
+    # Packing is opt-in: a packed response is only split where a long enough pause confirms the cut, and falls
+    # back to one request per paragraph otherwise. Short lines that repeat or are cached keep their own request,
+    # a packed copy of them would never hit the TTS cache.
+    pack = pack and CHUNK_PLANNER.get("pack_short_paragraphs", False)
+    repeated = Counter(job[1] for job in jobs)
+
+    def keep_alone(job) -> bool:
+        return repeated[job[1]] > 1 or AUDIO_CACHE.contains(build_tts_request(job[1])[1])
+
+    groups = plan_chunks(
+        jobs,
+        CHUNK_PLANNER.get("target_chars", 400),
+        CHUNK_PLANNER.get("max_chars", 600),
+        CHUNK_PLANNER.get("min_chars", 80) if pack else 0,
+        lambda job: select_voice(job[1]),
+        keep_alone
+    )
+    print(describe_plan(jobs, groups))
+    return groups
 
-    return len(batch)
 
+@STAGE_SECONDS.timed("synthesize_chunk")
+def synthesize_chunk(chunk):
+    # Fetches one segment of a chunk group. The last segment to arrive hands the group's audio to the
+    # post-processing pool, which hands the paragraph files to the book's packager.
+    group, segment_index = chunk
+    packager = group.jobs[0][4]
+    try:
+        if not TRACER.enabled:
+            return synthesize_segment(group, segment_index, packager)
+
+        with TRACER.book(packager.name), TRACER.span(
+                "synthesize_chunk", "paragraph", paragraphs=[job[0][0] for job in group.jobs], segment=segment_index,
+                segments=len(group.segments), chars=len(group.segments[segment_index])):
+            return synthesize_segment(group, segment_index, packager)
+    except Exception as e:
+        # The packager waits for every paragraph of the book, a group that is never resolved would hang it
+        print(f"❌ Synthesis of {len(group.jobs)} paragraphs failed: {e}")
+        RESPONSE_BUFFERS.release_held()
+        packager.fail(group, str(e))
+
+
+def synthesize_segment(group: ChunkGroup, segment_index: int, packager: BookPackager):
+    audio = None
+    try:
+        group.jobs[0][3].mark_attempt([job[0][0] for job in group.jobs])
+        audio = fetch_tts_attempt(group.segments[segment_index], group.attempts[segment_index] + 1,
+                                  group.failed_hosts[segment_index], group.voice)
+        if REQUEST_INFO.latency_ms is not None:
+            THROUGHPUT.record(packager.name, len(group.segments[segment_index]), REQUEST_INFO.latency_ms / 1000)
+    except Exception as e:
+        group.attempts[segment_index] += 1
+        if RETRY_POLICY.should_retry(e, group.attempts[segment_index]):
+            # Back into the book's queue, the worker and its concurrency slot move on to other requests
+            TTS_RETRIES.inc()
+            delay = RETRY_POLICY.delay(group.attempts[segment_index])
+            print(f"⏳ Retrying in {delay:.1f} seconds, away from {', '.join(sorted(group.failed_hosts[segment_index]))}")
+            return RetryLater(delay)
+        group.error = str(e)
+    request_info = [getattr(REQUEST_INFO, "host", None), getattr(REQUEST_INFO, "latency_ms", None)]
+
+    try:
+        with group.lock:
+            group.results[segment_index] = audio
+            group.completed += 1
+            if group.completed < len(group.segments):
+                return
+
+        results, group.results = group.results, []
+        if group.error is not None:
+            discard_audio(results)
+            if group.last_pass or not RETRY_POLICY.final_sweep:
+                packager.fail(group, group.error)
+            # Otherwise the book's final sweep tries its paragraphs again
+            return
+
+        def on_postprocessed(future):
+            discard_audio(results)
+            packager.complete(group, future, request_info)
+
+        POSTPROCESSOR.submit(
+            postprocess_group,
+            [results, group.weights(), [job[2] for job in group.jobs], is_mp3_response(TTS_SETTINGS_IN_USE),
+             CHUNK_PLANNER.get("split_search_ms", 600), CHUNK_PLANNER.get("min_pause_ms", 250)],
+            on_postprocessed
+        )
+    except Exception as e:
+        packager.fail(group, str(e))
+    finally:
+        # Held until the audio is queued for post-processing, which is bounded by max_queued_postprocess
+        RESPONSE_BUFFERS.release_held()
+
+
+def print_progress(book_name: str, audio_file: str, start_time: datetime.datetime, current: int, remaining: int, total: int,
+                   cumulative_duration: int):
+    elapsed_time = datetime.datetime.now() - start_time
+    time_left = (elapsed_time / current) * (remaining - current)
+    completed = total - remaining + current
+    percent = round((completed / total) * 100)
+    term_width = shutil.get_terminal_size().columns
+
+    print(
+        f"🔊 {book_name} | {audio_file} ({completed}/{total}) (concurrency:{CONCURRENCY.limit()}) ({percent}%) duration: {seconds_to_hms(cumulative_duration / 1000)} - Elapsed: {elapsed_time} | Estimated time left: {time_left} | {remaining} at start")
+    print("=" * term_width)
+    bar_length = term_width - 8  # Reserve space for " 100%" and brackets
+    bar_length = max(10, bar_length)  # Ensure minimum bar length
+    filled_length = int(bar_length * percent // 100)
+    bar = '█' * filled_length + '-' * (bar_length - filled_length)
+    print(f"<{bar}> {percent}%")
+    print("=" * term_width)
+
+
+@STAGE_SECONDS.timed("compute_durations")
+@TRACER.traced("compute_durations", "package")
+def compute_durations(output_dir: Path, paragraphs: list, book_manifest: BookManifest = None) -> list:
+    # Durations come from the manifest written during synthesis, files from older runs are validated once
+    manifest = book_manifest or BookManifest(output_dir)
+    if book_manifest is None:
+        manifest.sync_paragraphs(paragraphs)
+        manifest.adopt_existing_files()
+
+    entries = manifest.entries()
+    if book_manifest is None:
+        manifest.close()
 
-def compute_durations(output_dir: Path, paragraphs: list) -> list:
     cumulative_duration = 0
     chapter_duration = 0
 
     prev_paragraph = None
 
     for paragraph in paragraphs:
-        audio_file_path = Path(output_dir / paragraph[3])
+        entry = entries.get(paragraph[3])
 
-        if audio_file_path.exists() and audio_file_path.stat().st_size > 0:
+        if entry is not None and entry["bytes"] > 0:
             if paragraph[2] == 1 or (chapter_duration/1000) >= config.get("chapter_paragraph_limit_seconds"):
                 paragraph[2] = 1
                 chapter_duration = 0
@@ -203,18 +657,17 @@ def compute_durations(output_dir: Path, paragraphs: list) -> list:
                 paragraph[2] = 1
                 chapter_duration = 0
 
-            duration = get_mp3_duration(audio_file_path)
+            duration = entry["duration"]
             cumulative_duration = cumulative_duration + duration
             chapter_duration = chapter_duration + duration
 
-            print(
-                f"✅ Computing cumulative duration: {audio_file_path} Duration: {seconds_to_hms(duration / 1000)} Chapter Duration: {seconds_to_hms(chapter_duration / 1000)} Total Duration: {seconds_to_hms(cumulative_duration / 1000)}")
-
             paragraph[5] = duration
             paragraph[6] = cumulative_duration
 
             prev_paragraph = paragraph
 
+    print(f"✅ Computed durations for {len(paragraphs)} paragraphs. Total Duration: {seconds_to_hms(cumulative_duration / 1000)}")
+
     return paragraphs
 
 
@@ -249,104 +702,263 @@ def prepare_output_dir(current_folder: Path, epub_file: epub.EpubBook) -> list:
     return [output_dir, timestamp]
 
 
-def generate_audio_from_text(text: str, output_path: Path, stagger: int):
-    global ROUND_ROBIN_INDEX_REF
+@STAGE_SECONDS.timed("generate_audio_from_text")
+@TRACER.traced("generate_audio_from_text", "paragraph")
+def generate_audio_from_text(text: str, output_path: Path, manifest: BookManifest = None, para_id: str = None):
+    def on_attempt():
+        if manifest is not None:
+            manifest.mark_attempt([para_id])
+
+    audio = None
+    try:
+        audio = fetch_tts_audio(text, on_attempt)
+        return write_paragraph_audio(audio, output_path, manifest, para_id)
+    except Exception as e:
+        print(f"❌ Skipping this paragraph: {e}")
+        if manifest is not None:
+            manifest.mark_failed(para_id, str(e))
+        return 0
+    finally:
+        discard_audio([audio])
+        RESPONSE_BUFFERS.release_held()
+
 
-    time.sleep(stagger/1000)
+def write_paragraph_audio(audio: bytes | Path, output_path: Path, manifest: BookManifest = None,
+                          para_id: str = None) -> int:
+    if isinstance(audio, Path):
+        final_duration, size, checksum = finish_paragraph_file([audio], output_path,
+                                                               is_mp3_response(TTS_SETTINGS_IN_USE))
+    else:
+        final_duration, size, checksum = finish_paragraph_audio(audio, output_path,
+                                                                is_mp3_response(TTS_SETTINGS_IN_USE))
+
+    if manifest is not None:
+        manifest.mark_done(para_id, REQUEST_INFO.host, REQUEST_INFO.latency_ms, final_duration, size, checksum)
+
+    return final_duration
+
+
+def fetch_tts_audio(text: str, on_attempt=None) -> bytes | Path:
+    # Blocking retries, for the one by one fallback of the packager. The pipeline retries through the
+    # synthesis queue instead, see synthesize_segment.
+    failed_hosts = set()
     for attempt in range(1, MAX_RETRIES + 1):
+        if on_attempt is not None:
+            on_attempt()
         try:
-            params = TTS_SETTINGS
-            edge_tts_params = EDGE_TTS_SETTINGS
+            return fetch_tts_attempt(text, attempt, failed_hosts)
+        except Exception as e:
+            if not RETRY_POLICY.should_retry(e, attempt):
+                print("❌ Max retries reached." if is_retryable(e) else "❌ Not retrying, the request was rejected.")
+                raise
+            TTS_RETRIES.inc()
+            wait_time = RETRY_POLICY.delay(attempt)
+            print(f"⏳ Retrying in {wait_time:.1f} seconds...")
+            with TRACER.span("retry_wait", "paragraph", seconds=wait_time):
+                time.sleep(wait_time)
 
-            params = edge_tts_params if USE_EDGE_TTS else params
 
-            text = convert_all_caps_to_sentence_case(text)
+def select_voice(text: str) -> str | None:
+    # Edge TTS reads paragraphs with quotes in the second voice. Picked per source paragraph: a packed or
+    # split request keeps the voice of its paragraphs, not of whatever text ends up in one segment.
+    if not USE_EDGE_TTS:
+        return None
+    text = EDGE_TTS_PROSODY_MODS.replace("____TEXT____", convert_all_caps_to_sentence_case(text))
+    return EDGE_TTS_VOICE2 if "'" in text or '"' in text else EDGE_TTS_VOICE
 
-            if (USE_EDGE_TTS):
-                text = EDGE_TTS_PROSODY_MODS.replace("____TEXT____", text)
-                params.update({"voice": EDGE_TTS_VOICE})
 
-                if "'" in text or '"' in text:
-                    params.update({"voice": EDGE_TTS_VOICE2})
+def build_tts_request(text: str, voice: str = None) -> list:
+    # [payload, cache key] of the request for text
+    # Copy the settings, the shared dicts must not be mutated from the worker threads
+    params = dict(TTS_SETTINGS_IN_USE)
+    voice = voice or select_voice(text)
 
-            params.update({"input": text})
-            params.update({"text": text})
+    text = convert_all_caps_to_sentence_case(text)
 
-            headers = {
-                "accept": "application/json",
-                "Content-Type": "application/json"
-            }
+    if USE_EDGE_TTS:
+        text = EDGE_TTS_PROSODY_MODS.replace("____TEXT____", text)
+        params.update({"voice": voice})
 
-            endpoint = get_endpoint_from_round_robin(config, ROUND_ROBIN_INDEX_REF)
+    params.update({"input": text})
+    params.update({"text": text})
 
-            print(
-                f"🔊 Sending request: {endpoint} | RR Index: {ROUND_ROBIN_INDEX_REF.get('current')} | voice: {params.get('voice', '')[:15]} | speed: {params.get('speed', '')} | input: {params.get('input', '')[:60]}")
+    cache_key = payload_cache_key(
+        params,
+        "edge_tts_api" if USE_EDGE_TTS else "api",
+        prosody_mods=EDGE_TTS_PROSODY_MODS if USE_EDGE_TTS else None,
+        wav_to_mp3=USE_WAV_TO_MP3
+    )
+    return [params, cache_key]
 
-            if USE_GET_REQUEST:
-                query_string = urllib.parse.urlencode(params)
-                full_url = f"{endpoint}?{query_string}"
-                response = requests.get(full_url, timeout=300)
-            else:
-                response = requests.post(endpoint, json=params, headers=headers, timeout=300)
 
-            response.raise_for_status()
-            response_bytes = response.content
+def fetch_tts_attempt(text: str, attempt: int = 1, failed_hosts: set = None, voice: str = None) -> bytes | Path:
+    # One attempt, on a host that did not fail this text before when there is one. Hosts that fail it are
+    # added to failed_hosts, the caller decides whether and when to try again. voice: the voice of the text's
+    # paragraphs, picked from the text itself when not given.
+    params, cache_key = build_tts_request(text, voice)
+    text = params["input"]
 
-            if USE_WAV_TO_MP3:
-                wav_data = io.BytesIO(response_bytes)
-                audio = AudioSegment.from_wav(wav_data)
-                mp3_io = io.BytesIO()
-                audio.export(mp3_io, format="mp3", bitrate="320k")
-                response_bytes = mp3_io.getvalue()
+    # The caller releases the held response buffer once the audio is written
+    attempt_start = time.monotonic()
+    try:
+        REQUEST_INFO.host = "cache"
+        REQUEST_INFO.latency_ms = None
 
-            audio = MP3(io.BytesIO(response_bytes))
-            duration = int(audio.info.length * 1000)
+        if STREAM_RESPONSES:
+            # A spool file per response, removed by whoever finishes with it
+            audio = AUDIO_CACHE.get_or_create_file(
+                cache_key, lambda path: request_tts_audio(params, path, failed_hosts), new_spool_path())
+        else:
+            audio = AUDIO_CACHE.get_or_create(cache_key, lambda: request_tts_audio(params, None, failed_hosts),
+                                              len(text))
+            RESPONSE_BUFFERS.hold()
 
-            silence_ms = 200
-            if duration > 5000: silence_ms = 300
-            if duration > 10000: silence_ms = 500
-            if duration > 15000: silence_ms = 700
+        TRACER.add_span("tts_attempt", "paragraph", attempt_start, attempt=attempt, chars=len(text),
+                        host=REQUEST_INFO.host)
+        return audio
 
-            final_mp3 = add_silence_with_pydub(response_bytes, silence_ms)
+    except Exception as e:
+        RESPONSE_BUFFERS.release_held()
+        TRACER.add_span("tts_attempt", "paragraph", attempt_start, attempt=attempt, chars=len(text),
+                        host=REQUEST_INFO.host, error=str(e))
+        print(f"⚠️ Attempt {attempt} failed on {REQUEST_INFO.host}: {e}")
+        if failed_hosts is not None and REQUEST_INFO.host != "cache":
+            failed_hosts.add(REQUEST_INFO.host)
+        raise
 
-            with open(output_path, 'wb') as f:
-                f.write(final_mp3)
 
-            final_audio = MP3(io.BytesIO(final_mp3))
-            final_duration = int(final_audio.info.length * 1000)
+def new_spool_path() -> Path:
+    return SPOOL_FOLDER / f"{uuid.uuid4().hex}.audio"
 
-            print(
-                f"     📥 Response received: length={len(response.content)} bytes, type={response.headers.get('Content-Type', 'unknown')}")
-            return final_duration
 
-        except Exception as e:
-            print(f"⚠️ Attempt {attempt} failed: {e}")
-            if attempt == MAX_RETRIES:
-                print("❌ Max retries reached. Skipping this paragraph.")
-                # exit(1)  # Exit with error code
-            wait_time = 5 * 2 ** (attempt - 1)
-            print(f"⏳ Retrying in {wait_time} seconds...")
-            time.sleep(wait_time)
+def prepare_spool_folder():
+    # Spool files left behind by a killed run
+    SPOOL_FOLDER.mkdir(parents=True, exist_ok=True)
+    for path in SPOOL_FOLDER.glob("*.audio*"):
+        path.unlink(missing_ok=True)
 
-    return 0
 
+def discard_audio(results: list):
+    for audio in results:
+        if isinstance(audio, Path):
+            audio.unlink(missing_ok=True)
 
-def add_silence_with_pydub(mp3_data: bytes, silence_duration_ms: int) -> bytes:
-    original_audio = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3")
-    silence = AudioSegment.silent(duration=silence_duration_ms)
-    combined = original_audio + silence
-    out_buf = BytesIO()
-    combined.export(out_buf, format="mp3", bitrate="320k")
-    return out_buf.getvalue()
 
+def request_tts_audio(params: dict, output_path: Path = None, exclude: set = None) -> bytes | Path:
+    headers = {
+        "accept": "application/json",
+        "Content-Type": "application/json"
+    }
+
+    # Token bucket pacing instead of a fixed stagger, then wait for a host with spare capacity
+    with TRACER.span("pace", "http"):
+        CONCURRENCY.pace()
+    with TRACER.span("acquire_endpoint", "http") as span:
+        host, endpoint, probe = acquire_endpoint(config, exclude, CONCURRENCY.host_capacity)
+        span.set(host=host)
+
+    print(
+        f"🔊 Sending request: {endpoint} | voice: {params.get('voice', '')[:15]} | speed: {params.get('speed', '')} | input: {params.get('input', '')[:60]}")
+
+    session = get_session(endpoint, MAX_CONCURRENCY)
+    request_start = time.monotonic()
+    host_ok = False
+    outcome = OUTCOME_ERROR
+    status = None
+    response_size = 0
+    buffer_wait = 0.0
 
-def get_mp3_duration(path):
     try:
-        audio = MP3(path)
-        return int(audio.info.length * 1000)
-    except Exception as e:
-        print(f"Error getting duration for {path}: {e}")
-        return 0
+        # Bodies are streamed so that only MAX_BUFFERED_RESPONSES of them are read into memory at once
+        if USE_GET_REQUEST:
+            query_string = urllib.parse.urlencode(params)
+            full_url = f"{endpoint}?{query_string}"
+            response = session.get(full_url, timeout=API_TIMEOUT, stream=True)
+        else:
+            response = session.post(endpoint, json=params, headers=headers, timeout=API_TIMEOUT, stream=True)
+        status = response.status_code
+
+        with response:
+            if response.status_code >= 400:
+                # Client errors are caused by the request, not by the host, so they don't count against its health
+                host_ok = response.status_code < 500 and response.status_code != 429
+                if not host_ok:
+                    outcome = OUTCOME_OVERLOAD
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    if retry_after:
+                        pause_endpoint(config, host, retry_after)
+                response.raise_for_status()
+
+            if output_path is not None:
+                response_size = stream_response_to_file(response, output_path)
+            else:
+                # Waiting for a local buffer slot is memory back-pressure, not host latency
+                wait_start = time.monotonic()
+                RESPONSE_BUFFERS.hold()
+                buffer_wait = time.monotonic() - wait_start
+                response_bytes = response.content
+                response_size = len(response_bytes)
+            host_ok = True
+            outcome = OUTCOME_SUCCESS
+    except (requests.Timeout, requests.ConnectionError):
+        outcome = OUTCOME_OVERLOAD
+        raise
+    finally:
+        latency = time.monotonic() - request_start - buffer_wait
+        REQUEST_INFO.host = host
+        REQUEST_INFO.latency_ms = round(latency * 1000)
+        release_endpoint(config, host, latency, host_ok, probe)
+        CONCURRENCY.on_response(host, latency, len(params.get("input", "")), outcome)
+        TTS_REQUEST_SECONDS.observe(latency, host, outcome)
+        TRACER.add_span("http_request", "http", request_start, host=host, status=status, outcome=outcome,
+                        chars=len(params.get("input", "")), bytes=response_size,
+                        buffer_wait_ms=round(buffer_wait * 1000))
+
+    TTS_CHARS.inc(host, amount=len(params.get("input", "")))
+    TTS_RESPONSE_BYTES.inc(host, amount=response_size)
+
+    print(
+        f"     📥 Response received: length={response_size} bytes, type={response.headers.get('Content-Type', 'unknown')}")
+
+    if output_path is not None:
+        if USE_WAV_TO_MP3:
+            wav_path = output_path.with_name(f"{output_path.name}.wav")
+            os.replace(output_path, wav_path)
+            try:
+                AudioSegment.from_wav(wav_path).export(output_path, format="mp3", bitrate="320k")
+            finally:
+                wav_path.unlink(missing_ok=True)
+        return output_path
+
+    if USE_WAV_TO_MP3:
+        wav_data = io.BytesIO(response_bytes)
+        audio = AudioSegment.from_wav(wav_data)
+        mp3_io = io.BytesIO()
+        audio.export(mp3_io, format="mp3", bitrate="320k")
+        response_bytes = mp3_io.getvalue()
+
+    return response_bytes
+
+
+def stream_response_to_file(response: requests.Response, output_path: Path) -> int:
+    size = 0
+    try:
+        with open(output_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        output_path.unlink(missing_ok=True)
+        raise
+
+    if size == 0:
+        output_path.unlink(missing_ok=True)
+        raise ValueError("Empty audio stream")
+    return size
+
+
+def is_mp3_response(params: dict) -> bool:
+    return USE_WAV_TO_MP3 or params.get("response_format", "mp3") == "mp3"
 
 
 def convert_all_caps_to_sentence_case(text: str) -> str:
@@ -358,66 +970,45 @@ def convert_all_caps_to_sentence_case(text: str) -> str:
     return re.sub(r'\b[A-Z]{2,}\b', replacer, text)
 
 
-def extract_cover_image(epub_path: Path, output_dir: Path) -> Path | None:
-    book = epub.read_epub(str(epub_path))
+def extract_cover_image(parsed_book: ParsedBook, output_dir: Path) -> Path | None:
     cover_image_path = output_dir / "cover.jpg"
+    cover_image = parsed_book.cover()
 
-    cover_image_item = None
-
-    # Look for the item that is the cover
-    for item in book.get_items():
-        print(f"🔍 Checking item: {item.get_id()} ({item.get_type()}) ({item.get_name()})")
-        if item.get_type() == EPUB_IMAGE or item.get_type() == EPUB_IMAGE_2:
-            if cover_image_item == None:
-                print(
-                    "🔍 Found the first image in the book, using that as the cover if no other cover is found")
-                cover_image_item = item
-
-            if 'cover' in item.get_id().lower():
-                print(f"🔍 Found specific cover image: {item.get_id()}")
-                cover_image_item = item
-                break
-
-    if cover_image_item:
-        with open(cover_image_path, 'wb') as f:
-            f.write(cover_image_item.get_content())
-            print(f"🖼️ Saved cover image: {cover_image_path.name}")
-            return cover_image_path
+    if cover_image:
+        write_bytes_atomic(cover_image_path, cover_image)
+        print(f"🖼️ Saved cover image: {cover_image_path.name}")
+        return cover_image_path
 
     print("❌ No cover image found in EPUB.")
     shutil.copyfile(Path('/app/app/assets/cover.jpg'), cover_image_path)
 
     return None
 
-def single_mp3(content_data: dict, output_dir: Path):
-    print("🔍 Scanning MP3 files to merge into single...")
-
-    singled_dir = Path(get_config().get('singled_books_folder')) / output_dir.name
-    content_json = singled_dir / "content.json"
-    single_audio_name = 'output.mp3'
-
-    # 🔥 Delete existing chapterized folder
-    if singled_dir.exists():
-        print(f"🧹 Removing existing folder: {singled_dir}")
-        shutil.rmtree(singled_dir)
-
+@STAGE_SECONDS.timed("finish_single_mp3")
+@TRACER.traced("finish_single_mp3", "package")
+def finish_single_mp3(content_data: dict, output_dir: Path, singled_dir: Path, packager: BookPackager,
+                      single_result: dict | None):
+    # output.mp3 was appended paragraph by paragraph while the book was synthesized, only content.json and the
+    # cover are left. Timings come from the appended frames so content.json lines up with output.mp3 exactly.
     singled_dir.mkdir(parents=True, exist_ok=True)
-
-    paragraphs = content_data['paragraphs']
+    paragraphs = [list(paragraph) for paragraph in content_data['paragraphs']]
     if not paragraphs:
         print("❌ No paragraphs found to merge. Nothing to do.")
         return
 
-    mp3s_to_merge = []
+    if single_result is not None:
+        print(f"🎵 Saved: {SINGLE_AUDIO_NAME} ({single_result['frames']} frames, "
+              f"{seconds_to_hms(single_result['duration_ms'] / 1000)})")
+        for paragraph in paragraphs:
+            ms_offset, duration_ms = packager.offsets.get(paragraph[0], [paragraph[6] - paragraph[5], paragraph[5]])
+            paragraph[5] = duration_ms
+            paragraph[6] = ms_offset + duration_ms
+    else:
+        print(f"⚠️ Falling back to ffmpeg for {SINGLE_AUDIO_NAME}")
+        ffmpeg_concat_mp3s([output_dir / paragraph[3] for paragraph in paragraphs], singled_dir / SINGLE_AUDIO_NAME)
 
     for paragraph in paragraphs:
-        para_id = paragraph[0]
-        mp3_file_name = paragraph[3]
-        mp3_file_path = output_dir / mp3_file_name
-        mp3s_to_merge.append(mp3_file_path)
-        paragraph[8] = single_audio_name
-
-    ffmpeg_concat_mp3s(mp3s_to_merge, singled_dir/single_audio_name)
+        paragraph[8] = SINGLE_AUDIO_NAME
 
     # 🖼️ Copy cover image if available
     cover_file = output_dir / "cover.jpg"
@@ -425,94 +1016,16 @@ def single_mp3(content_data: dict, output_dir: Path):
         shutil.copy(cover_file, singled_dir / "cover.jpg")
         print("🖼️ Copied cover.jpg to singled/")
 
-    content_data['paragraphs'] = paragraphs
-    content_json.write_text(json.dumps(content_data, indent=4, ensure_ascii=False))
+    content_json = singled_dir / "content.json"
+    write_content_manifest(singled_dir / CONTENT_MANIFEST_FILE, {**content_data, 'paragraphs': paragraphs})
+    write_with_compressed_variants(
+        content_json,
+        json.dumps({**content_data, 'paragraphs': paragraphs}, indent=4, ensure_ascii=False).encode("utf-8")
+    )
     print("🖼️ Saved content.json to singled/")
 
-def chapterize_mp3s(content_data: dict, output_dir: Path):
-    print("🔍 Scanning MP3 files to merge into chapters...")
-
-    chapterized_dir = Path(get_config().get('chapterized_books_folder')) / output_dir.name
-    content_json = chapterized_dir / "content.json"
-
-    # 🔥 Delete existing chapterized folder
-    if chapterized_dir.exists():
-        print(f"🧹 Removing existing folder: {chapterized_dir}")
-        shutil.rmtree(chapterized_dir)
-
-    chapterized_dir.mkdir(parents=True, exist_ok=True)
-
-    paragraphs = content_data['paragraphs']
-    chapters = []
-    current_group = []
-    current_chapter_name = None
-    chapter_names = set()
-
-    for paragraph in paragraphs:
-        para_id = paragraph[0]
-        mp3_file_name = paragraph[3]
-        mp3_file_path = output_dir / mp3_file_name
-        is_chapter_title = paragraph[2] == 1
-
-        print(f"🔍 Processing file: {mp3_file_name}")
-
-        if is_chapter_title:
-            # New chapter start
-            if current_group:
-                chapters.append((current_chapter_name, current_group))
-                chapter_names.add(current_chapter_name)
-            current_chapter_name = para_id
-            current_group = [mp3_file_path]
-        else:
-            current_group.append(mp3_file_path)
-
-        paragraph[7] = get_chapter_file_name_from_index(len(chapters))
-
-    if current_group and current_chapter_name and current_chapter_name not in chapter_names:
-        chapters.append((current_chapter_name, current_group))
-        chapter_names.add(current_chapter_name)
-
-    print(f"📚 Found {len(chapters)} chapters to merge.")
-    print("Chapter names to merge:")
-    for chapter_name, _ in chapters:
-        print(f" - {chapter_name}")
-
-    if not chapters:
-        print("❌ No chapters found to merge. Nothing to do.")
-        return
-
-    print("🔗 About to merge chapters into single audio files...")
-
-    merged_chapter_files = []
-
-    for idx, (chapter_name, group) in enumerate(chapters):
-        out_filename = get_chapter_file_name_from_index(idx)
-        out_path = chapterized_dir / out_filename
-
-        print(f"🔗 Merging {len(group)} files into: {out_filename}")
-        ffmpeg_concat_mp3s(group, out_path)
-        print(f"🎵 Saved: {out_filename} at {chapterized_dir}")
-
-        merged_chapter_files.append(out_path)
-
-    # 🖼️ Copy cover image if available
-    cover_file = output_dir / "cover.jpg"
-    if cover_file.exists():
-        shutil.copy(cover_file, chapterized_dir / "cover.jpg")
-        print("🖼️ Copied cover.jpg to chapterized/")
-
-    content_data['paragraphs'] = paragraphs
-    content_json.write_text(json.dumps(content_data, indent=4, ensure_ascii=False))
-    print("🖼️ Saved content.json to chapterized/")
-
-
-def get_chapter_file_name_from_index(idx: int):
-    chapter_id = f"{idx + 1:03d}"
-    out_filename = (f"Part-{chapter_id}").upper()
-    out_filename = f"{out_filename}.mp3"
-    return out_filename
-
-
+@STAGE_SECONDS.timed("ffmpeg_concat_mp3s")
+@TRACER.traced("ffmpeg_concat_mp3s", "package")
 def ffmpeg_concat_mp3s(mp3_files, output_path):
     list_file = output_path.with_suffix(".txt")
     with open(list_file, "w") as f:
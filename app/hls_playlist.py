@@ -0,0 +1,113 @@
+import math
+import os
+from pathlib import Path
+
+from app.mp3_frames import Mp3FormatError, iter_frames, scan_frames
+
+PLAYLIST_FILE = "playlist.m3u8"
+DEFAULT_TARGET_DURATION = 60
+
+
+class HlsPlaylist:
+    # Live HLS playlist over the paragraph MP3s of a book. It is an EVENT playlist while the book is being
+    # generated, segments are only ever appended in paragraph order, and becomes VOD when the book is done.
+    # The segments are the paragraph files themselves, nothing is concatenated or copied. A paragraph longer than
+    # the target duration is listed as several byte ranges of its file, cut at frame boundaries.
+    # Not supported: players that insist on the ID3 PRIV com.apple.streaming.transportStreamTimestamp tag the HLS
+    # spec asks of raw audio segments. The paragraph files are shared with the single MP3 and carry no such tag.
+    def __init__(self, output_dir: Path, target_duration: int = DEFAULT_TARGET_DURATION):
+        self.path = Path(output_dir) / PLAYLIST_FILE
+        self.target_duration = target_duration
+        self.segments = []
+        self.file = None
+
+    def start(self):
+        self.file = self.write_atomic(self.header("EVENT"), keep_open=True)
+
+    def header(self, playlist_type: str) -> str:
+        return (
+            "#EXTM3U\n"
+            "#EXT-X-VERSION:4\n"
+            f"#EXT-X-TARGETDURATION:{self.target_duration}\n"
+            "#EXT-X-MEDIA-SEQUENCE:0\n"
+            f"#EXT-X-PLAYLIST-TYPE:{playlist_type}\n"
+        )
+
+    def add(self, audio_file: str, duration_ms: int):
+        segments = [[audio_file, duration_ms, None]]
+        if duration_ms > self.target_duration * 1000:
+            segments = self.split_segment(audio_file, duration_ms)
+
+        self.segments += segments
+        if self.file is not None:
+            # One write per paragraph, a reader never sees half an entry
+            self.file.write("".join(segment_entry(*segment) for segment in segments))
+            self.file.flush()
+
+    def split_segment(self, audio_file: str, duration_ms: int) -> list:
+        try:
+            ranges = frame_ranges((self.path.parent / audio_file).read_bytes(), self.target_duration * 1000)
+        except (Mp3FormatError, OSError) as e:
+            print(f"⚠️ {audio_file} stays one segment of {duration_ms / 1000:.1f}s in the playlist ({e})")
+            return [[audio_file, duration_ms, None]]
+        return [[audio_file, range_ms, [offset, length]] for offset, length, range_ms in ranges]
+
+    def finish(self):
+        # VOD: the real target duration and an end tag, players can seek anywhere from now on
+        self.close()
+        longest = max((segment[1] for segment in self.segments), default=0)
+        self.target_duration = max(1, math.ceil(longest / 1000))
+        self.write_atomic(
+            self.header("VOD")
+            + "".join(segment_entry(*segment) for segment in self.segments)
+            + "#EXT-X-ENDLIST\n"
+        )
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def write_atomic(self, text: str, keep_open: bool = False):
+        temp_path = self.path.with_name(f"{self.path.name}.part")
+        file = open(temp_path, "w", encoding="utf-8")
+        file.write(text)
+        file.flush()
+        os.replace(temp_path, self.path)
+
+        if keep_open:
+            return file
+        file.close()
+        return None
+
+
+def frame_ranges(data: bytes, max_ms: int) -> list:
+    # [offset, length, duration ms] of consecutive runs of whole frames, none longer than max_ms. The first run
+    # starts with the file (tags, Info frame), the last one ends with it.
+    scan = scan_frames(data)
+    max_samples = max_ms * scan.first_header.sample_rate // 1000
+
+    ranges = []
+    start = 0
+    samples = 0
+    for offset, header in iter_frames(data, scan.start_of_audio, scan.end_of_audio):
+        if samples and samples + header.samples > max_samples:
+            ranges.append([start, offset - start, samples])
+            start, samples = offset, 0
+        samples += header.samples
+    ranges.append([start, len(data) - start, samples])
+
+    return [[offset, length, samples * 1000 // scan.first_header.sample_rate] for offset, length, samples in ranges]
+
+
+def segment_entry(audio_file: str, duration_ms: int, byte_range: list = None) -> str:
+    if byte_range is None:
+        return f"#EXTINF:{duration_ms / 1000:.3f},\n{audio_file}\n"
+    return f"#EXTINF:{duration_ms / 1000:.3f},\n#EXT-X-BYTERANGE:{byte_range[1]}@{byte_range[0]}\n{audio_file}\n"
+
+
+def create_hls_playlist(config: dict, output_dir: Path) -> HlsPlaylist | None:
+    hls_config = config.get("hls", {})
+    if not hls_config.get("enabled", True):
+        return None
+    return HlsPlaylist(output_dir, hls_config.get("target_duration", DEFAULT_TARGET_DURATION))
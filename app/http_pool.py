@@ -0,0 +1,44 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+
+def get_host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(url: str, pool_size: int = 10) -> requests.Session:
+    # One keep-alive session per host, shared by every worker thread
+    host_key = get_host_key(url)
+
+    with SESSIONS_LOCK:
+        session = SESSIONS.get(host_key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), max_retries=0)
+            session.mount(host_key, adapter)
+            SESSIONS[host_key] = session
+
+    return session
+
+
+def create_sessions(config: dict, pool_size: int):
+    use_edge_tts = config.get('use_edge_tts_service', False)
+    api_from = "api" if not use_edge_tts else "edge_tts_api"
+
+    hosts = [config[api_from]["host"]] + list(config[api_from].get("host_round_robin", []))
+    for host in dict.fromkeys(hosts):
+        get_session(host, pool_size)
+
+
+def close_sessions():
+    with SESSIONS_LOCK:
+        for session in SESSIONS.values():
+            session.close()
+        SESSIONS.clear()
@@ -0,0 +1,247 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.mp3_frames import Mp3FormatError, audio_range, scan_duration_ms, scan_frames
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_FILE = "manifest.sqlite3"
+SCAN_WORKERS = 16
+SQL_BATCH_SIZE = 500
+
+STATE_PENDING = "pending"
+STATE_IN_PROGRESS = "in_progress"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS paragraphs (
+    para_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    audio_file TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    host TEXT,
+    latency_ms INTEGER,
+    duration INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    checksum TEXT,
+    error TEXT,
+    updated_at REAL
+)
+"""
+
+
+def get_checksum(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_file_checksum(path: Path, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def write_bytes_atomic(path: Path, data: bytes):
+    # A killed process leaves a .part file behind, never a half written audio file
+    temp_path = path.with_name(f"{path.name}.part")
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def write_with_compressed_variants(path: Path, data: bytes):
+    # path.gz and path.br next to the file, the API serves them as is instead of compressing per request.
+    # A variant older than the file is ignored by the API, so the file goes first.
+    write_bytes_atomic(path, data)
+    write_bytes_atomic(path.with_name(f"{path.name}.gz"), gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_bytes_atomic(path.with_name(f"{path.name}.br"), brotli.compress(data, quality=11))
+
+
+class BookManifest:
+    # Per-book SQLite (WAL) manifest with one row per paragraph, shared by all worker threads
+    def __init__(self, output_dir: Path):
+        self.output_dir = Path(output_dir)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.output_dir / MANIFEST_FILE, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+    def execute(self, sql: str, parameters=()):
+        with self.lock:
+            self.connection.execute(sql, parameters)
+            self.connection.commit()
+
+    def query(self, sql: str, parameters=()) -> list:
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def select_rows(self, sql: str, para_ids: list = None, parameters: tuple = ()) -> list:
+        # sql without a WHERE clause, or ending in one, restricted to para_ids when given
+        if para_ids is None:
+            return self.connection.execute(sql, parameters).fetchall()
+
+        rows = []
+        joiner = " AND " if " WHERE " in sql else " WHERE "
+        for start in range(0, len(para_ids), SQL_BATCH_SIZE):
+            batch = para_ids[start:start + SQL_BATCH_SIZE]
+            rows += self.connection.execute(
+                f"{sql}{joiner}para_id IN ({', '.join('?' * len(batch))})", (*parameters, *batch)).fetchall()
+        return rows
+
+    def sync_paragraphs(self, paragraphs: list, start_seq: int = 0):
+        # New paragraphs are added as pending, a paragraph whose text changed (e.g. a new replacement) is reset.
+        # Can be called batch by batch while the book is still being extracted.
+        with self.lock:
+            existing = {
+                row["para_id"]: row
+                for row in self.select_rows(
+                    "SELECT para_id, audio_file, text_hash FROM paragraphs", [paragraph[0] for paragraph in paragraphs])
+            }
+
+            for seq, paragraph in enumerate(paragraphs, start_seq):
+                para_id, text, audio_file = paragraph[0], paragraph[1], paragraph[3]
+                text_hash = get_text_hash(text)
+                row = existing.get(para_id)
+
+                if row is None:
+                    self.connection.execute(
+                        "INSERT INTO paragraphs (para_id, seq, audio_file, text_hash, updated_at) VALUES (?, ?, ?, ?, ?)",
+                        (para_id, seq, audio_file, text_hash, time.time()))
+                elif row["text_hash"] != text_hash or row["audio_file"] != audio_file:
+                    # The audio on disk is of the old text, adopt_existing_files must not take it back
+                    (self.output_dir / row["audio_file"]).unlink(missing_ok=True)
+                    (self.output_dir / audio_file).unlink(missing_ok=True)
+                    self.connection.execute(
+                        "UPDATE paragraphs SET seq = ?, audio_file = ?, text_hash = ?, state = ?, attempts = 0, "
+                        "error = NULL, updated_at = ? WHERE para_id = ?",
+                        (seq, audio_file, text_hash, STATE_PENDING, time.time(), para_id))
+                else:
+                    self.connection.execute("UPDATE paragraphs SET seq = ? WHERE para_id = ?", (seq, para_id))
+
+            self.connection.commit()
+
+    def mark_attempt(self, para_ids: list):
+        # Once per TTS request, a packed or split request counts for each of its paragraphs
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE paragraphs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE para_id = ?",
+                [(STATE_IN_PROGRESS, now, para_id) for para_id in para_ids])
+            self.connection.commit()
+
+    def mark_done(self, para_id: str, host: str | None, latency_ms: int | None, duration: int, size: int,
+                  checksum: str | None):
+        self.execute(
+            "UPDATE paragraphs SET state = ?, host = ?, latency_ms = ?, duration = ?, bytes = ?, checksum = ?, "
+            "error = NULL, updated_at = ? WHERE para_id = ?",
+            (STATE_DONE, host, latency_ms, duration, size, checksum, time.time(), para_id))
+
+    def mark_failed(self, para_id: str, error: str):
+        self.execute(
+            "UPDATE paragraphs SET state = ?, error = ?, updated_at = ? WHERE para_id = ?",
+            (STATE_FAILED, error[:500], time.time(), para_id))
+
+    def adopt_existing_files(self, para_ids: list = None):
+        # Audio files from before the manifest existed are validated from their frame headers once and then
+        # trusted like any other finished paragraph. Only rows that were never attempted qualify, the file of a
+        # failed or interrupted paragraph is whatever the last attempt left behind.
+        with self.lock:
+            rows = self.select_rows("SELECT para_id, audio_file FROM paragraphs WHERE state = ? AND attempts = 0",
+                                    para_ids, (STATE_PENDING,))
+        candidates = [row for row in rows if (self.output_dir / row["audio_file"]).exists()]
+        if not candidates:
+            return
+
+        print(f"🔍 Validating {len(candidates)} audio files without a finished manifest entry...")
+
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+            results = executor.map(scan_audio_file, [self.output_dir / row["audio_file"] for row in candidates])
+
+        for row, entry in zip(candidates, results):
+            if entry is not None and entry["duration"] > 0:
+                self.mark_done(row["para_id"], None, None, entry["duration"], entry["bytes"], None)
+
+    def pending_para_ids(self, para_ids: list = None) -> set:
+        # Everything not done, plus done rows whose file disappeared or doesn't match the recorded size
+        pending = set()
+        with self.lock:
+            rows = self.select_rows("SELECT para_id, audio_file, state, bytes FROM paragraphs", para_ids)
+
+        for row in rows:
+            if row["state"] != STATE_DONE:
+                pending.add(row["para_id"])
+                continue
+
+            try:
+                size = (self.output_dir / row["audio_file"]).stat().st_size
+            except FileNotFoundError:
+                size = -1
+
+            if size != row["bytes"]:
+                pending.add(row["para_id"])
+
+        return pending
+
+    def entries(self) -> dict:
+        return {
+            row["audio_file"]: dict(row)
+            for row in self.query("SELECT * FROM paragraphs WHERE state = ?", (STATE_DONE,))
+        }
+
+    def durations(self, para_ids: list) -> dict:
+        with self.lock:
+            rows = self.select_rows("SELECT para_id, duration FROM paragraphs WHERE state = ?", para_ids,
+                                    (STATE_DONE,))
+        return {row["para_id"]: row["duration"] for row in rows}
+
+    def failed(self, para_ids: list = None) -> list:
+        # Paragraphs that gave up in this run, rows of paragraphs outside para_ids (a book that got shorter, a
+        # partial run) are left out
+        with self.lock:
+            rows = self.select_rows("SELECT * FROM paragraphs WHERE state = ?", para_ids, (STATE_FAILED,))
+        return sorted((dict(row) for row in rows), key=lambda row: row["seq"])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def scan_audio_file(audio_file_path: Path) -> dict | None:
+    # None unless the file is MPEG audio frames through to its end (or its trailing tags). A file cut off by a
+    # crash of the old non-atomic writer ends in a partial frame, which the frame iterators skip silently.
+    try:
+        data = audio_file_path.read_bytes()
+        scan = scan_frames(data)
+    except (FileNotFoundError, Mp3FormatError):
+        return None
+
+    if scan.end_of_audio != audio_range(data)[1]:
+        return None
+
+    return {
+        "audio_file": audio_file_path.name,
+        "duration": scan_duration_ms(scan),
+        "bytes": len(data),
+        "checksum": None
+    }
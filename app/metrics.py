@@ -0,0 +1,221 @@
+import bisect
+import functools
+import math
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a cached paragraph to a TTS request that runs into the timeout
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300]
+
+
+class MetricsRegistry:
+    # Counters and fixed-bucket histograms without locks on the hot path: every thread only ever writes its own
+    # shard (a plain dict), a scrape sums the shards. The registry lock is taken once per thread, when its
+    # shard is created, and by scrapes.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.metrics = {}  # name -> Counter / Histogram, in registration order
+        self.shards = []
+        self.collectors = []
+
+    def shard(self) -> dict:
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self.lock:
+                self.shards.append(shard)
+            self.local.shard = shard
+        return shard
+
+    def counter(self, name: str, help_text: str, label_names: list = None) -> "Counter":
+        return self.register(Counter(self, name, help_text, label_names or []))
+
+    def histogram(self, name: str, help_text: str, label_names: list = None,
+                  buckets: list = None) -> "Histogram":
+        return self.register(Histogram(self, name, help_text, label_names or [], buckets or LATENCY_BUCKETS))
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def add_collector(self, collector):
+        # collector() -> [[name, type, help, [[labels dict, value], ...]], ...], for values read at scrape time
+        self.collectors.append(collector)
+
+    def collect(self) -> dict:
+        # (name, labels) -> value or histogram row, summed over every thread
+        with self.lock:
+            shards = list(self.shards)
+
+        totals = {}
+        for shard in shards:
+            # list() copies the dict in one step under the GIL, the owner may keep writing meanwhile
+            for key, value in list(shard.items()):
+                add_sample(totals, key, value)
+        return totals
+
+    def drain(self) -> dict:
+        # Samples recorded by this thread since the last drain, a worker process hands them to the parent
+        shard = self.shard()
+        samples = dict(shard)
+        shard.clear()
+        return samples
+
+    def merge(self, samples: dict):
+        shard = self.shard()
+        for key, value in samples.items():
+            add_sample(shard, key, value)
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        totals = self.collect()
+        by_name = {}
+        for (name, labels), value in totals.items():
+            by_name.setdefault(name, []).append([labels, value])
+
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in sorted(by_name.get(metric.name, []), key=lambda sample: sample[0]):
+                lines += metric.render_sample(labels, value)
+
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"⚠️ Metrics collector failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry: MetricsRegistry, name: str, help_text: str, label_names: list):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self.registry.shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def render_sample(self, labels: tuple, value) -> list:
+        return [f"{self.name}{format_labels(dict(zip(self.label_names, labels)))} {format_value(value)}"]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, registry: MetricsRegistry, name: str, help_text: str, label_names: list, buckets: list):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = sorted(buckets)
+
+    def observe(self, value: float, *labels):
+        # Row: a count per bucket plus +Inf, then the sum, not cumulative until rendered
+        shard = self.registry.shard()
+        key = (self.name, labels)
+        row = shard.get(key)
+        if row is None:
+            row = shard[key] = [0] * (len(self.buckets) + 2)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def time(self, *labels) -> "Timer":
+        return Timer(self, labels)
+
+    def timed(self, *labels):
+        # Decorator form of time()
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with Timer(self, labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def render_sample(self, labels: tuple, row: list) -> list:
+        label_values = dict(zip(self.label_names, labels))
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + [math.inf], row):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else format_value(bound)
+            lines.append(f"{self.name}_bucket{format_labels({**label_values, 'le': le})} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(label_values)} {format_value(row[-1])}")
+        lines.append(f"{self.name}_count{format_labels(label_values)} {cumulative}")
+        return lines
+
+
+class Timer:
+    # with HISTOGRAM.time("label"): ... observes the seconds the block took, also when it raises
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+def add_sample(totals: dict, key: tuple, value):
+    current = totals.get(key)
+    if isinstance(value, list):
+        if current is None:
+            totals[key] = list(value)
+        else:
+            for index, item in enumerate(value):
+                current[index] += item
+    else:
+        totals[key] = (current or 0) + value
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels.items()) + "}"
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def run_with_metrics(function, args: list) -> list:
+    # Runs in a worker process: [result, samples the call recorded], merged into the parent's registry
+    REGISTRY.drain()
+    result = function(*args)
+    return [result, REGISTRY.drain()]
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("kokoro_stage_seconds", "Time spent in each stage of the pipeline", ["stage"])
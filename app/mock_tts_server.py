@@ -0,0 +1,182 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.mp3_frames import BITRATES, LAYER_3, MPEG_2, parse_frame_header, silent_frames
+
+# Stand-in for a Kokoro / Edge TTS host on the /v1/audio/speech contract, for benchmarks. Answers with valid
+# MP3 audio (digital silence, MPEG-2 layer III 24 kHz mono like Kokoro) whose duration follows the text length.
+#
+#   python -m app.mock_tts_server --port 18100 --count 4 --latency lognormal --latency-ms 300 --throttle-rate 0.01
+
+SPEECH_PATH = "/v1/audio/speech"
+LATENCY_DISTRIBUTIONS = ["fixed", "uniform", "exponential", "lognormal"]
+
+
+def frame_header(kbps: int) -> bytes:
+    # MPEG-2 layer III, 24 kHz, mono, no CRC
+    bitrate_index = BITRATES[(MPEG_2, LAYER_3)].index(kbps)
+    return bytes([0xFF, 0xF3, (bitrate_index << 4) | (1 << 2), 0xC4])
+
+
+class MockTtsState:
+    def __init__(self, args: argparse.Namespace, seed: int):
+        self.args = args
+        self.random = random.Random(seed)
+        self.header = frame_header(args.kbps)
+        header = parse_frame_header(self.header)
+        self.frame_ms = header.samples / header.sample_rate * 1000
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.responses = {}  # status -> count
+        self.chars = 0
+
+    def latency(self, chars: int) -> float:
+        # Seconds: a base latency drawn from the distribution plus a per character cost
+        args = self.args
+        base = args.latency_ms
+        with self.lock:
+            if args.latency == "uniform":
+                base = self.random.uniform(base * (1 - args.latency_spread), base * (1 + args.latency_spread))
+            elif args.latency == "exponential":
+                base = self.random.expovariate(1 / base) if base > 0 else 0
+            elif args.latency == "lognormal":
+                base = base * math.exp(self.random.gauss(0, args.latency_spread))
+        return max(0.0, base + args.per_char_ms * chars) / 1000
+
+    def roll(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+    def count(self, status: int, chars: int = 0):
+        with self.lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+            self.chars += chars
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"in_flight": self.in_flight, "responses": dict(self.responses), "chars": self.chars}
+
+
+class MockTtsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == SPEECH_PATH:
+            params = dict(urllib.parse.parse_qsl(url.query))
+            return self.synthesize(params.get("input", ""))
+        if url.path == "/stats":
+            return self.send_body(200, json.dumps(self.server.state.stats()).encode("utf-8"), "application/json")
+        # Health probes
+        self.send_body(200, b"ok", "text/plain")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urllib.parse.urlsplit(self.path).path != SPEECH_PATH:
+            return self.send_body(404, b"", "text/plain")
+        try:
+            params = json.loads(body)
+        except ValueError:
+            return self.send_body(400, b"invalid json", "text/plain")
+        self.synthesize(params.get("input", ""))
+
+    def synthesize(self, text: str):
+        state = self.server.state
+        args = state.args
+
+        with state.lock:
+            state.in_flight += 1
+            overloaded = 0 < args.max_concurrent < state.in_flight
+        try:
+            # 429 right away, like a host that sheds load before doing any work
+            roll = state.roll()
+            if overloaded or roll < args.throttle_rate:
+                state.count(429)
+                return self.send_body(429, b"", "text/plain", {"Retry-After": str(args.retry_after)})
+
+            time.sleep(state.latency(len(text)))
+            if roll < args.throttle_rate + args.error_rate:
+                state.count(500)
+                return self.send_body(500, b"", "text/plain")
+
+            frames = max(1, round(len(text) * args.ms_per_char / state.frame_ms))
+            state.count(200, len(text))
+            self.send_body(200, silent_frames(state.header, frames), "audio/mpeg")
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    # Shared with benchmark.py, which passes them through
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=150, help="base latency (median / mean)")
+    parser.add_argument("--latency-spread", type=float, default=0.5,
+                        help="sigma of lognormal, +- fraction of uniform")
+    parser.add_argument("--per-char-ms", type=float, default=1.0, help="latency added per input character")
+    parser.add_argument("--ms-per-char", type=float, default=65, help="audio produced per input character")
+    parser.add_argument("--kbps", type=int, default=8, choices=BITRATES[(MPEG_2, LAYER_3)][1:])
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="429 above this many requests in flight")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds of a 429")
+
+
+def mock_settings(args: argparse.Namespace) -> dict:
+    # The options of add_mock_arguments out of a namespace with more options
+    parser = argparse.ArgumentParser(add_help=False)
+    add_mock_arguments(parser)
+    return {name: getattr(args, name) for name in vars(parser.parse_args([]))}
+
+
+def mock_argv(args: argparse.Namespace) -> list:
+    # The options of add_mock_arguments back to command line arguments
+    return [item for name, value in mock_settings(args).items() for item in [f"--{name.replace('_', '-')}", str(value)]]
+
+
+def serve(args: argparse.Namespace) -> list:
+    servers = []
+    for index in range(args.count):
+        server = ThreadingHTTPServer((args.bind, args.port + index), MockTtsHandler)
+        server.daemon_threads = True
+        server.state = MockTtsState(args, args.seed + index)
+        threading.Thread(target=server.serve_forever, name=f"mock-tts-{index}", daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock TTS servers for benchmarks")
+    parser.add_argument("--bind", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18100)
+    parser.add_argument("--count", type=int, default=1, help="servers on consecutive ports")
+    parser.add_argument("--seed", type=int, default=1)
+    add_mock_arguments(parser)
+    arguments = parser.parse_args()
+
+    mock_servers = serve(arguments)
+    print(f"🎭 {len(mock_servers)} mock TTS servers on {arguments.bind}:{arguments.port}-"
+          f"{arguments.port + len(mock_servers) - 1}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
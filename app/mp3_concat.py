@@ -0,0 +1,242 @@
+import os
+import struct
+from pathlib import Path
+
+from app.mp3_frames import BITRATES, CHANNEL_MODE_MONO, LAYER_3, MPEG_1, MPEG_2, XING_FLAG_BYTES, XING_FLAG_FRAMES, \
+    XING_FLAG_TOC, Mp3FormatError, build_toc, find_sync, id3v2_size, is_info_frame, parse_frame_header, \
+    silence_frame_count, silent_frames, trailing_tags_size, xing_offset
+
+# Largest possible frame, MPEG 2 layer II at 160 kbps / 8 kHz with padding
+MAX_FRAME_SIZE = 2881
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+TAIL_SCAN_SIZE = 4096
+
+# One seek point per this many frames is enough for a 100 entry TOC and keeps memory flat
+SEEK_POINT_FRAMES = 256
+
+
+def stream_format(header) -> tuple:
+    return header.version, header.layer, header.sample_rate, header.channel_mode == CHANNEL_MODE_MONO
+
+
+def iter_file_frames(path: Path, buffer_size: int = DEFAULT_BUFFER_SIZE):
+    # Yields [header, frame bytes] for every audio frame of a file, reading it through a fixed size buffer
+    size = path.stat().st_size
+
+    with open(path, "rb") as f:
+        start = id3v2_size(f.read(10))
+
+        tail_length = min(size, TAIL_SCAN_SIZE)
+        f.seek(size - tail_length)
+        end = size - trailing_tags_size(f.read(tail_length), tail_length)
+
+        f.seek(start)
+        remaining = max(0, end - start)
+        buffer = b""
+        position = 0
+        is_first_frame = True
+
+        while True:
+            if remaining > 0 and len(buffer) - position < 2 * MAX_FRAME_SIZE + 4:
+                chunk = f.read(min(max(buffer_size, 4 * MAX_FRAME_SIZE), remaining))
+                remaining -= len(chunk)
+                if not chunk:
+                    remaining = 0
+                buffer = buffer[position:] + chunk
+                position = 0
+
+            at_eof = remaining <= 0
+            if len(buffer) - position < 4:
+                return
+
+            header = parse_frame_header(buffer[position:position + 4])
+
+            if header is None or position + header.frame_size > len(buffer):
+                if at_eof and header is not None:
+                    return  # truncated last frame
+
+                # Only search where the following frame can still be verified, unless the file is fully read
+                search_end = len(buffer) if at_eof else len(buffer) - MAX_FRAME_SIZE - 4
+                sync = find_sync(buffer, position + 1, len(buffer), search_end) if search_end > position + 1 else -1
+                if sync < 0:
+                    if at_eof:
+                        return
+                    position = max(position + 1, search_end)
+                else:
+                    position = sync
+                continue
+
+            if is_first_frame:
+                is_first_frame = False
+                if is_info_frame(buffer, position, header):
+                    position += header.frame_size
+                    continue
+
+            yield header, buffer[position:position + header.frame_size]
+            position += header.frame_size
+
+
+def build_xing_frame(template, frame_count: int, byte_count: int, toc: list, is_vbr: bool) -> bytes:
+    # Smallest bitrate of the stream's MPEG version that fits a full Xing header with TOC
+    table_version = MPEG_1 if template.version == MPEG_1 else MPEG_2
+    tag_offset = xing_offset(template._replace(protected=False))
+    needed_size = tag_offset + 4 + 4 + 4 + 4 + 100
+
+    for bitrate_index in range(1, len(BITRATES[(table_version, LAYER_3)])):
+        raw = bytes([
+            0xFF,
+            template.raw[1] | 0x1,
+            (bitrate_index << 4) | (template.raw[2] & 0x0D),
+            template.raw[3]
+        ])
+        header = parse_frame_header(raw)
+        if header is not None and header.frame_size >= needed_size:
+            break
+    else:
+        raise Mp3FormatError("No bitrate is large enough for a Xing frame")
+
+    frame = bytearray(header.frame_size)
+    frame[:4] = raw
+    frame[tag_offset:tag_offset + 4] = b"Xing" if is_vbr else b"Info"
+    struct.pack_into(">III", frame, tag_offset + 4, XING_FLAG_FRAMES | XING_FLAG_BYTES | XING_FLAG_TOC,
+                     frame_count, byte_count)
+    frame[tag_offset + 16:tag_offset + 116] = bytes(toc)
+    return bytes(frame)
+
+
+class Mp3Appender:
+    # Builds one MP3 file from others appended one at a time, without their ID3/Xing headers. The Xing/Info
+    # header with a seek table is written in front when the file is closed, until then it lives in a temp file.
+    def __init__(self, output_path: Path, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.output_path = Path(output_path)
+        self.temp_path = self.output_path.with_name(f"{self.output_path.name}.tmp")
+        self.buffer_size = buffer_size
+        self.out = open(self.temp_path, "wb")
+        self.out_buffer = bytearray()
+        self.written = 0
+
+        self.stream = None
+        self.xing_size = 0
+        self.file_count = 0
+        self.frame_count = 0
+        self.total_samples = 0
+        self.bitrates = set()
+        self.seek_samples = []
+        self.seek_offsets = []
+
+    def position(self) -> int:
+        return self.written + len(self.out_buffer)
+
+    def samples_to_ms(self, samples: int) -> int:
+        sample_rate = self.stream.sample_rate if self.stream is not None else 1000
+        return int(samples * 1000 / sample_rate)
+
+    def append(self, mp3_file: Path) -> list:
+        # Returns [byte offset, ms offset, duration ms] of the file inside the output
+        mp3_file = Path(mp3_file)
+        file_offset = self.position()
+        file_samples_start = self.total_samples
+        self.file_count += 1
+
+        if not mp3_file.exists() or mp3_file.stat().st_size == 0:
+            print(f"⚠️ Missing audio, skipped in concat: {mp3_file.name}")
+        else:
+            for header, frame in iter_file_frames(mp3_file, self.buffer_size):
+                if self.stream is None:
+                    self.stream = header
+                    self.xing_size = len(build_xing_frame(header, 0, 0, [0] * 100, False)) \
+                        if header.layer == LAYER_3 else 0
+                    self.out_buffer += bytes(self.xing_size)
+                    file_offset = self.xing_size
+                elif stream_format(header) != stream_format(self.stream):
+                    raise Mp3FormatError(f"Mixed stream formats, {mp3_file.name} differs from the first file")
+
+                if self.frame_count % SEEK_POINT_FRAMES == 0:
+                    self.seek_samples.append(self.total_samples)
+                    self.seek_offsets.append(self.position())
+
+                self.out_buffer += frame
+                self.frame_count += 1
+                self.total_samples += header.samples
+                self.bitrates.add(header.bitrate)
+
+                if len(self.out_buffer) >= self.buffer_size:
+                    self.flush()
+
+        return [
+            file_offset,
+            self.samples_to_ms(file_samples_start),
+            self.samples_to_ms(self.total_samples - file_samples_start)
+        ]
+
+    def append_silence(self, silence_ms: int) -> int:
+        # Silent frames in the format of the stream so far, returns their duration in milliseconds
+        if self.stream is None:
+            raise Mp3FormatError("No MPEG audio frames to match the silence to")
+
+        count = silence_frame_count(self.stream, silence_ms)
+        frame = silent_frames(self.stream.raw, 1)
+        samples_start = self.total_samples
+
+        for _ in range(count):
+            if self.frame_count % SEEK_POINT_FRAMES == 0:
+                self.seek_samples.append(self.total_samples)
+                self.seek_offsets.append(self.position())
+            self.out_buffer += frame
+            self.frame_count += 1
+            self.total_samples += self.stream.samples
+
+        self.bitrates.add(self.stream.bitrate)
+        return self.samples_to_ms(self.total_samples - samples_start)
+
+    def flush(self):
+        self.out.write(self.out_buffer)
+        self.written += len(self.out_buffer)
+        self.out_buffer = bytearray()
+
+    def close(self) -> dict:
+        try:
+            self.flush()
+
+            if self.stream is None:
+                raise Mp3FormatError("No MPEG audio frames found in any input file")
+
+            if self.xing_size:
+                toc = build_toc(self.seek_samples, self.seek_offsets, self.total_samples, self.written)
+                self.out.seek(0)
+                self.out.write(build_xing_frame(self.stream, self.frame_count, self.written, toc,
+                                                len(self.bitrates) > 1))
+
+            self.out.close()
+            os.replace(self.temp_path, self.output_path)
+        finally:
+            self.abort()
+
+        return {
+            "files": self.file_count,
+            "frames": self.frame_count,
+            "bytes": self.written,
+            "duration_ms": self.samples_to_ms(self.total_samples)
+        }
+
+    def abort(self):
+        self.out.close()
+        self.temp_path.unlink(missing_ok=True)
+
+
+def concat_mp3s(mp3_files: list, output_path: Path, on_file=None, buffer_size: int = DEFAULT_BUFFER_SIZE) -> dict:
+    # Streams the frames of every file into output_path without per-file ID3/Xing headers and writes one
+    # Xing/Info header with a seek table in front. on_file(index, path, byte_offset, ms_offset, duration_ms)
+    # is called as each file is appended.
+    appender = Mp3Appender(output_path, buffer_size)
+
+    try:
+        for index, mp3_file in enumerate(mp3_files):
+            byte_offset, ms_offset, duration_ms = appender.append(mp3_file)
+            if on_file is not None:
+                on_file(index, Path(mp3_file), byte_offset, ms_offset, duration_ms)
+    except BaseException:
+        appender.abort()
+        raise
+
+    return appender.close()
@@ -0,0 +1,433 @@
+import bisect
+import math
+import struct
+from collections import namedtuple
+from functools import lru_cache
+
+MPEG_1 = 3
+MPEG_2 = 2
+MPEG_2_5 = 0
+
+LAYER_1 = 3
+LAYER_2 = 2
+LAYER_3 = 1
+
+CHANNEL_MODE_MONO = 3
+
+BITRATES = {
+    (MPEG_1, LAYER_1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (MPEG_1, LAYER_2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (MPEG_1, LAYER_3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (MPEG_2, LAYER_1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (MPEG_2, LAYER_2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (MPEG_2, LAYER_3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+SAMPLE_RATES = {
+    MPEG_1: [44100, 48000, 32000],
+    MPEG_2: [22050, 24000, 16000],
+    MPEG_2_5: [11025, 12000, 8000],
+}
+
+XING_FLAG_FRAMES = 0x1
+XING_FLAG_BYTES = 0x2
+XING_FLAG_TOC = 0x4
+XING_FLAG_QUALITY = 0x8
+
+# A frame using at most this fraction of the bits of the response's median frame counts as part of a pause
+QUIET_FRACTION = 0.2
+
+FrameHeader = namedtuple("FrameHeader", [
+    "version",
+    "layer",
+    "bitrate",  # kbps
+    "sample_rate",
+    "padding",
+    "channel_mode",
+    "protected",  # a 16 bit CRC follows the header
+    "frame_size",  # bytes, header included
+    "samples",
+    "raw"  # the 4 header bytes
+])
+
+
+class Mp3FormatError(ValueError):
+    pass
+
+
+@lru_cache(maxsize=4096)
+def parse_frame_header(raw: bytes) -> FrameHeader | None:
+    if len(raw) < 4 or raw[0] != 0xFF or (raw[1] & 0xE0) != 0xE0:
+        return None
+
+    version = (raw[1] >> 3) & 0x3
+    layer = (raw[1] >> 1) & 0x3
+    bitrate_index = (raw[2] >> 4) & 0xF
+    sample_rate_index = (raw[2] >> 2) & 0x3
+
+    # Reserved values, free format bitrate and the "bad" bitrate index are not supported
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    table_version = MPEG_1 if version == MPEG_1 else MPEG_2
+    bitrate = BITRATES[(table_version, layer)][bitrate_index]
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (raw[2] >> 1) & 0x1
+
+    if layer == LAYER_1:
+        samples = 384
+        frame_size = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    elif layer == LAYER_2 or version == MPEG_1:
+        samples = 1152
+        frame_size = 144 * bitrate * 1000 // sample_rate + padding
+    else:
+        samples = 576
+        frame_size = 72 * bitrate * 1000 // sample_rate + padding
+
+    return FrameHeader(
+        version,
+        layer,
+        bitrate,
+        sample_rate,
+        padding,
+        (raw[3] >> 6) & 0x3,
+        (raw[1] & 0x1) == 0,
+        frame_size,
+        samples,
+        bytes(raw[:4])
+    )
+
+
+def id3v2_size(data: bytes) -> int:
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def trailing_tags_size(data: bytes, end: int) -> int:
+    # ID3v1 and APEv2 tags sit after the last frame, in either order
+    total = 0
+    while True:
+        if end - total >= 128 and data[end - total - 128:end - total - 125] == b"TAG":
+            total += 128
+            continue
+
+        if end - total >= 32 and data[end - total - 32:end - total - 24] == b"APETAGEX":
+            tag_size = struct.unpack("<I", data[end - total - 20:end - total - 16])[0]
+            has_header = data[end - total - 9] & 0x80
+            total += tag_size + (32 if has_header else 0)
+            continue
+
+        return total
+
+
+def audio_range(data: bytes) -> list:
+    start = id3v2_size(data)
+    end = len(data)
+    end -= trailing_tags_size(data, end)
+    return [start, max(start, end)]
+
+
+def find_sync(data: bytes, offset: int, end: int, search_end: int = None) -> int:
+    # Next offset holding a valid header that is followed by another valid header (or the end of the data),
+    # candidates are looked for before search_end and verified against everything up to end
+    search_end = end - 3 if search_end is None else min(search_end, end - 3)
+    while True:
+        offset = data.find(b"\xFF", offset, search_end)
+        if offset < 0:
+            return -1
+
+        header = parse_frame_header(bytes(data[offset:offset + 4]))
+        if header is not None:
+            next_offset = offset + header.frame_size
+            if next_offset == end or (next_offset + 4 <= end and
+                                      parse_frame_header(bytes(data[next_offset:next_offset + 4])) is not None):
+                return offset
+
+        offset += 1
+
+
+def iter_frames(data: bytes, start: int = 0, end: int = None):
+    end = len(data) if end is None else end
+    offset = start
+
+    while offset + 4 <= end:
+        header = parse_frame_header(bytes(data[offset:offset + 4]))
+
+        if header is None or offset + header.frame_size > end:
+            offset = find_sync(data, offset + 1, end)
+            if offset < 0:
+                return
+            continue
+
+        yield offset, header
+        offset += header.frame_size
+
+
+def xing_offset(header: FrameHeader) -> int:
+    side_info_size = (17 if header.channel_mode == CHANNEL_MODE_MONO else 32) if header.version == MPEG_1 \
+        else (9 if header.channel_mode == CHANNEL_MODE_MONO else 17)
+    return 4 + (2 if header.protected else 0) + side_info_size
+
+
+def is_info_frame(data: bytes, offset: int, header: FrameHeader) -> bool:
+    # Xing/Info (LAME) or VBRI (Fraunhofer) frames carry no audio, only stream metadata
+    tag_offset = offset + xing_offset(header)
+    if data[tag_offset:tag_offset + 4] in (b"Xing", b"Info"):
+        return True
+    return data[offset + 36:offset + 40] == b"VBRI"
+
+
+@lru_cache(maxsize=256)
+def silent_frames(header_raw: bytes, frame_count: int) -> bytes:
+    # A frame whose side info and main data are all zero decodes to digital silence, no encoder required.
+    # Cached per stream format (sample rate, bitrate, channel mode, ...) and frame count (the duration bucket).
+    raw = bytearray(header_raw)
+    raw[1] |= 0x1  # no CRC
+    raw[2] &= ~0x2 & 0xFF  # no padding
+    header = parse_frame_header(bytes(raw))
+    frame = bytes(raw) + bytes(header.frame_size - 4)
+    return frame * frame_count
+
+
+def silence_frame_count(header: FrameHeader, silence_ms: int) -> int:
+    return math.ceil(silence_ms * header.sample_rate / 1000 / header.samples)
+
+
+FrameScan = namedtuple("FrameScan", [
+    "first_header",  # first audio frame, the stream format silence has to match
+    "info_frame",  # [offset, header] of a Xing/Info/VBRI frame or None
+    "frame_count",
+    "samples",
+    "start_of_audio",  # offset of the first audio frame
+    "end_of_audio"  # offset right after the last frame, trailing tags start here
+])
+
+
+def scan_frames(data: bytes) -> FrameScan:
+    start, end = audio_range(data)
+
+    first_header = None
+    info_frame = None
+    frame_count = 0
+    samples = 0
+    start_of_audio = start
+    end_of_audio = start
+
+    for offset, header in iter_frames(data, start, end):
+        if frame_count == 0 and info_frame is None and is_info_frame(data, offset, header):
+            info_frame = [offset, header]
+            end_of_audio = offset + header.frame_size
+            continue
+
+        if first_header is None:
+            first_header = header
+            start_of_audio = offset
+        frame_count += 1
+        samples += header.samples
+        end_of_audio = offset + header.frame_size
+
+    if first_header is None:
+        raise Mp3FormatError("No MPEG audio frames found")
+
+    return FrameScan(first_header, info_frame, frame_count, samples, start_of_audio, end_of_audio)
+
+
+def scan_duration_ms(scan: FrameScan) -> int:
+    return int(scan.samples * 1000 / scan.first_header.sample_rate)
+
+
+def frames_duration_ms(data: bytes) -> int:
+    try:
+        return scan_duration_ms(scan_frames(data))
+    except Mp3FormatError:
+        return 0
+
+
+def append_silence(data: bytes, silence_ms: int, scan: FrameScan = None) -> list:
+    # Appends silent frames matching the stream format, returns [mp3 bytes, duration in milliseconds]
+    scan = scan or scan_frames(data)
+    header = scan.first_header
+
+    silence_count = silence_frame_count(header, silence_ms)
+
+    output = bytearray(data[:scan.end_of_audio])
+    output += silent_frames(header.raw, silence_count)
+
+    if scan.info_frame is not None:
+        info_offset, info_header = scan.info_frame
+        if not update_info_frame(output, info_offset, info_header, scan.frame_count + silence_count,
+                                 len(output) - info_offset):
+            # A VBRI frame's counts and seek table would be stale, players do without one
+            del output[info_offset:info_offset + info_header.frame_size]
+
+    samples = scan.samples + silence_count * header.samples
+    return [bytes(output), int(samples * 1000 / header.sample_rate)]
+
+
+def build_toc(seek_samples: list, seek_offsets: list, total_samples: int, total_bytes: int) -> list:
+    # Xing seek table: for every percent of the duration, the byte position of the frame playing then in 1/256ths
+    toc = []
+    for percent in range(100):
+        target = total_samples * percent / 100
+        index = max(0, bisect.bisect_right(seek_samples, target) - 1)
+        toc.append(min(255, int(seek_offsets[index] * 256 / max(1, total_bytes))))
+    return toc
+
+
+def update_info_frame(data: bytearray, offset: int, header: FrameHeader, frame_count: int, byte_count: int) -> bool:
+    # Rewrites a Xing/Info frame for the frames that now follow it, byte_count includes the frame itself.
+    # Returns False for frames it can't update (VBRI).
+    tag_offset = offset + xing_offset(header)
+    if data[tag_offset:tag_offset + 4] not in (b"Xing", b"Info"):
+        return False
+
+    flags = struct.unpack(">I", data[tag_offset + 4:tag_offset + 8])[0]
+    field_offset = tag_offset + 8
+
+    if flags & XING_FLAG_FRAMES:
+        struct.pack_into(">I", data, field_offset, frame_count)
+        field_offset += 4
+
+    if flags & XING_FLAG_BYTES:
+        struct.pack_into(">I", data, field_offset, byte_count)
+        field_offset += 4
+
+    if flags & XING_FLAG_TOC:
+        # Rebuilt from the new frame positions, like Mp3Appender does for a whole book
+        seek_samples = []
+        seek_offsets = []
+        samples = 0
+        for frame_offset, frame_header in iter_frames(data, offset + header.frame_size, offset + byte_count):
+            seek_samples.append(samples)
+            seek_offsets.append(frame_offset - offset)
+            samples += frame_header.samples
+        if seek_samples:
+            data[field_offset:field_offset + 100] = bytes(build_toc(seek_samples, seek_offsets, samples, byte_count))
+        field_offset += 100
+
+    if flags & XING_FLAG_QUALITY:
+        field_offset += 4
+
+    # The LAME/Lavc extension's encoder padding, music length and CRCs describe the audio before the silence,
+    # it is dropped like Mp3Appender leaves it out
+    end = offset + header.frame_size
+    data[field_offset:end] = bytes(end - field_offset)
+    return True
+
+
+def frame_activity(data: bytes, offset: int, header: FrameHeader) -> int:
+    # Bits of main data a layer III frame uses (part2_3_length of every granule/channel), pauses use very few
+    if header.layer != LAYER_3:
+        return header.frame_size
+
+    side_info_start = offset + 4 + (2 if header.protected else 0)
+    side_info_size = xing_offset(header) - 4 - (2 if header.protected else 0)
+    is_mono = header.channel_mode == CHANNEL_MODE_MONO
+    channels = 1 if is_mono else 2
+
+    if header.version == MPEG_1:
+        position = 9 + (5 if is_mono else 3) + 4 * channels
+        granules = 2
+        granule_bits = 59
+    else:
+        position = 8 + (1 if is_mono else 2)
+        granules = 1
+        granule_bits = 63
+
+    total_bits = side_info_size * 8
+    bits = int.from_bytes(data[side_info_start:side_info_start + side_info_size], "big")
+
+    used = 0
+    for _ in range(granules * channels):
+        used += (bits >> (total_bits - position - 12)) & 0xFFF
+        position += granule_bits
+
+    return used
+
+
+def audio_frames(data: bytes) -> list:
+    scan = scan_frames(data)
+    return [
+        [offset, header]
+        for offset, header in iter_frames(data, scan.start_of_audio, scan.end_of_audio)
+    ]
+
+
+def join_audio(parts: list) -> bytes:
+    # Frames of several responses back to back, without their tags and Xing/Info frames
+    output = bytearray()
+    for part in parts:
+        scan = scan_frames(part)
+        output += part[scan.start_of_audio:scan.end_of_audio]
+    return bytes(output)
+
+
+def quiet_runs(activities: list) -> list:
+    # [first, end) frame ranges of consecutive quiet frames, a frame is quiet when it uses a fraction of the bits
+    # of a typical frame of the response. Digital silence (no bits at all) is always quiet.
+    threshold = sorted(activities)[len(activities) // 2] * QUIET_FRACTION
+    runs = []
+    first = None
+    for index, activity in enumerate(activities + [threshold + 1]):
+        if activity <= threshold:
+            first = index if first is None else first
+        elif first is not None:
+            runs.append([first, index])
+            first = None
+    return runs
+
+
+def split_audio(data: bytes, weights: list, search_ms: int = 600, min_pause_ms: int = 250) -> list:
+    # Splits a packed response back into its paragraphs. Each cut goes into the middle of a pause of at least
+    # min_pause_ms within search_ms of the position the weights put it at. Without such a pause the cut can't be
+    # checked and the split fails rather than leak the words of one paragraph into its neighbour.
+    if len(weights) == 1:
+        return [data]
+
+    frames = audio_frames(data)
+    if len(frames) < len(weights):
+        raise Mp3FormatError(f"{len(frames)} frames can't be split into {len(weights)} parts")
+
+    header = frames[0][1]
+    frames_per_ms = header.sample_rate / 1000 / header.samples
+    search_frames = max(1, int(search_ms * frames_per_ms))
+    pause_frames = max(1, math.ceil(min_pause_ms * frames_per_ms))
+    pauses = [
+        run for run in quiet_runs([frame_activity(data, offset, frame_header) for offset, frame_header in frames])
+        if run[1] - run[0] >= pause_frames
+    ]
+    total_weight = sum(weights) or len(weights)
+
+    cuts = [0]
+    cumulative_weight = 0
+    for part_index, weight in enumerate(weights[:-1]):
+        cumulative_weight += weight or 1
+        target = round(len(frames) * cumulative_weight / total_weight)
+
+        # Every part keeps at least one frame. A cut keeps half the minimum pause on both sides, as close to the
+        # target as the pause allows, and the longest pause near the target wins.
+        lowest = cuts[-1] + 1
+        highest = len(frames) - (len(weights) - part_index - 1)
+        candidates = []
+        for first, end in pauses:
+            cut = min(max(target, first + pause_frames // 2), end - pause_frames // 2)
+            if lowest <= cut <= highest and abs(cut - target) <= search_frames:
+                candidates.append([cut, end - first])
+
+        if not candidates:
+            raise Mp3FormatError(f"No pause of {min_pause_ms} ms within {search_ms} ms of cut {part_index + 1}")
+
+        cuts.append(max(candidates, key=lambda candidate: (candidate[1], -abs(candidate[0] - target)))[0])
+
+    cuts.append(len(frames))
+
+    parts = []
+    for start, end in zip(cuts, cuts[1:]):
+        last_offset, last_header = frames[end - 1]
+        parts.append(bytes(data[frames[start][0]:last_offset + last_header.frame_size]))
+
+    return parts
@@ -0,0 +1,184 @@
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from mutagen.mp3 import MP3
+from pydub import AudioSegment
+
+from app.manifest import get_checksum, get_file_checksum, write_bytes_atomic
+from app.metrics import REGISTRY, STAGE_SECONDS, run_with_metrics
+from app.mp3_concat import Mp3Appender
+from app.mp3_frames import Mp3FormatError, append_silence, join_audio, scan_duration_ms, scan_frames, split_audio
+from app.tracing import TRACER
+
+
+def get_silence_ms(duration: int) -> int:
+    silence_ms = 200
+    if duration > 5000: silence_ms = 300
+    if duration > 10000: silence_ms = 500
+    if duration > 15000: silence_ms = 700
+    return silence_ms
+
+
+def add_paragraph_silence(audio_bytes: bytes, is_mp3: bool) -> list:
+    # MP3 responses get pre-encoded silent frames appended, no decode/re-encode round trip through ffmpeg
+    if is_mp3:
+        try:
+            scan = scan_frames(audio_bytes)
+            return append_silence(audio_bytes, get_silence_ms(scan_duration_ms(scan)), scan)
+        except Mp3FormatError as e:
+            print(f"⚠️ Frame level silence failed, falling back to pydub: {e}")
+
+    audio = MP3(io.BytesIO(audio_bytes))
+    duration = int(audio.info.length * 1000)
+
+    final_mp3 = add_silence_with_pydub(audio_bytes, get_silence_ms(duration))
+
+    final_audio = MP3(io.BytesIO(final_mp3))
+    return [final_mp3, int(final_audio.info.length * 1000)]
+
+
+@STAGE_SECONDS.timed("add_silence_with_pydub")
+@TRACER.traced("add_silence_with_pydub", "audio")
+def add_silence_with_pydub(mp3_data: bytes, silence_duration_ms: int) -> bytes:
+    original_audio = AudioSegment.from_file(io.BytesIO(mp3_data), format="mp3")
+    silence = AudioSegment.silent(duration=silence_duration_ms)
+    combined = original_audio + silence
+    out_buf = BytesIO()
+    combined.export(out_buf, format="mp3", bitrate="320k")
+    return out_buf.getvalue()
+
+
+def finish_paragraph_audio(audio_bytes: bytes, output_path: Path, is_mp3: bool) -> list:
+    # Silence, atomic write and checksum of one paragraph, returns [duration ms, bytes, checksum]
+    with TRACER.span("add_paragraph_silence", "audio", bytes=len(audio_bytes)):
+        final_mp3, final_duration = add_paragraph_silence(audio_bytes, is_mp3)
+    with TRACER.span("write_paragraph", "io", bytes=len(final_mp3)):
+        write_bytes_atomic(output_path, final_mp3)
+    return [final_duration, len(final_mp3), get_checksum(final_mp3)]
+
+
+def finish_paragraph_file(segment_paths: list, output_path: Path, is_mp3: bool) -> list:
+    # Streamed responses: the segments are appended frame by frame into the paragraph file, nothing but the
+    # read buffer is held in memory however long the paragraph is
+    if not is_mp3:
+        audio = AudioSegment.from_file(segment_paths[0])
+        for segment_path in segment_paths[1:]:
+            audio += AudioSegment.from_file(segment_path)
+        audio += AudioSegment.silent(duration=get_silence_ms(len(audio)))
+        temp_path = output_path.with_name(f"{output_path.name}.part")
+        audio.export(temp_path, format="mp3", bitrate="320k")
+        os.replace(temp_path, output_path)
+        return [int(MP3(output_path).info.length * 1000), output_path.stat().st_size, get_file_checksum(output_path)]
+
+    appender = Mp3Appender(output_path)
+    try:
+        duration = sum(appender.append(segment_path)[2] for segment_path in segment_paths)
+        duration += appender.append_silence(get_silence_ms(duration))
+    except BaseException:
+        appender.abort()
+        raise
+
+    result = appender.close()
+    return [result["duration_ms"], result["bytes"], get_file_checksum(output_path)]
+
+
+@STAGE_SECONDS.timed("postprocess_group")
+@TRACER.traced("postprocess_group", "audio")
+def postprocess_group(segments: list, weights: list, output_paths: list, is_mp3: bool, search_ms: int = 600,
+                      min_pause_ms: int = 250) -> list:
+    # Responses of one chunk group to paragraph files: segments of a split paragraph are joined, a packed
+    # response is cut back into its paragraphs at checked pauses. Streamed segments are files, the caller's to remove.
+    if isinstance(segments[0], Path):
+        if len(weights) == 1:
+            return [finish_paragraph_file(segments, output_paths[0], is_mp3)]
+        # Packed responses are made of short paragraphs, small enough to split in memory
+        segments = [segment.read_bytes() for segment in segments]
+
+    audio_bytes = join_audio(segments) if len(segments) > 1 else segments[0]
+    parts = split_audio(audio_bytes, weights, search_ms, min_pause_ms) if len(weights) > 1 else [audio_bytes]
+    return [finish_paragraph_audio(part, path, is_mp3) for part, path in zip(parts, output_paths)]
+
+
+def init_worker(tracing: bool):
+    # A spawned worker starts from a fresh interpreter, the tracing switch is all of the parent's state it needs
+    TRACER.enabled = tracing
+
+
+def run_in_worker(function, args: list) -> list:
+    # Runs in a worker process: [result, metric samples, trace spans] of the call
+    TRACER.drain()
+    result, samples = run_with_metrics(function, args)
+    return [result, samples, TRACER.drain()]
+
+
+class PostProcessor:
+    # CPU bound post-processing in worker processes, away from the network threads and the GIL. Submitting
+    # blocks while max_queued tasks are waiting, which pushes back on synthesis.
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(max(1, max_queued))
+        self.executor = None
+
+    def start(self):
+        # Spawned, not forked: the API starts the pipeline from a running server whose threads may hold locks a
+        # fork would copy
+        if self.workers > 0 and self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=init_worker, initargs=(TRACER.enabled,))
+            self.executor.submit(int).result()
+
+    def submit(self, function, args: list, on_done) -> Future:
+        self.slots.acquire()
+
+        future = Future()
+        if self.executor is None:
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            try:
+                worker_future = self.executor.submit(run_in_worker, function, args)
+            except BaseException:
+                self.slots.release()
+                raise
+
+            book = TRACER.current_book()
+
+            def unwrap(finished: Future):
+                # Metrics and spans recorded in the worker process are merged into this process's
+                try:
+                    result, samples, spans = finished.result()
+                    REGISTRY.merge(samples)
+                    TRACER.merge(spans, book)
+                    future.set_result(result)
+                except Exception as e:
+                    future.set_exception(e)
+
+            worker_future.add_done_callback(unwrap)
+
+        def done(finished: Future):
+            self.slots.release()
+            on_done(finished)
+
+        future.add_done_callback(done)
+        return future
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+def create_post_processor(config: dict, max_concurrency: int) -> PostProcessor:
+    pipeline_config = config.get("pipeline", {})
+    return PostProcessor(
+        pipeline_config.get("postprocess_workers", 2),
+        pipeline_config.get("max_queued_postprocess", max(4, max_concurrency))
+    )
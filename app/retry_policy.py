@@ -0,0 +1,50 @@
+import random
+
+import requests
+
+# A retry goes back into the book's synthesis queue after a jittered backoff instead of sleeping on a worker
+# thread, and is sent to a different host than the ones that failed it when there is one.
+
+DEFAULT_BASE_SECONDS = 5.0
+DEFAULT_MAX_SECONDS = 120.0
+
+# Timeouts, conflicts, rate limits and server errors; any other 4xx is the request's fault and fails the same
+# way on every host
+RETRYABLE_STATUS = {408, 409, 425, 429}
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in RETRYABLE_STATUS
+    # Dropped connections, timeouts, empty or corrupt audio
+    return True
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int, base_seconds: float = DEFAULT_BASE_SECONDS,
+                 max_seconds: float = DEFAULT_MAX_SECONDS, final_sweep: bool = True):
+        self.max_attempts = max(1, max_attempts)
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self.final_sweep = final_sweep
+        self.random = random.Random()
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        return attempt < self.max_attempts and is_retryable(error)
+
+    def delay(self, attempt: int) -> float:
+        # Equal jitter: half of the exponential backoff is fixed, the other half random, so retries of a burst
+        # of failures spread out instead of hitting the hosts again at the same moment
+        backoff = min(self.max_seconds, self.base_seconds * 2 ** (attempt - 1))
+        return backoff / 2 + self.random.uniform(0, backoff / 2)
+
+
+def create_retry_policy(config: dict) -> RetryPolicy:
+    retry_config = config.get("retry", {})
+    return RetryPolicy(
+        config.get("max_retries", 5),
+        retry_config.get("base_seconds", DEFAULT_BASE_SECONDS),
+        retry_config.get("max_seconds", DEFAULT_MAX_SECONDS),
+        retry_config.get("final_sweep", True)
+    )
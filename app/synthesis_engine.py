@@ -0,0 +1,228 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ResponseBufferLimit:
+    # Caps how many response bodies can be held in memory at once across all workers
+    def __init__(self, max_buffered: int):
+        self.slots = threading.BoundedSemaphore(max(1, max_buffered))
+        self.local = threading.local()
+
+    def hold(self):
+        if getattr(self.local, "held", False):
+            return
+        self.slots.acquire()
+        self.local.held = True
+
+    def release_held(self):
+        if getattr(self.local, "held", False):
+            self.local.held = False
+            self.slots.release()
+
+
+class RetryLater:
+    # Returned by a worker: instead of completing, the job goes back to the front of its queue after delay
+    # seconds, without holding a slot while it waits
+    def __init__(self, delay: float):
+        self.delay = max(0.0, delay)
+
+
+class SynthesisQueue:
+    # One book's synthesis jobs inside the scheduler. Jobs can keep arriving while the book is still being
+    # extracted, the queue only finishes once it is closed and drained.
+    def __init__(self, name: str, jobs: list, worker, on_complete=None, priority: int = 0, weight: float = 1.0,
+                 cost=None, closed: bool = True):
+        self.name = name
+        self.jobs = list(jobs)
+        self.worker = worker
+        self.on_complete = on_complete
+        self.priority = priority
+        self.weight = max(0.01, weight)
+        self.cost = cost or (lambda job: 1)
+
+        self.pending = deque(enumerate(self.jobs))
+        self.results = [None] * len(self.jobs)
+        self.in_flight = 0
+        self.delayed = 0
+        self.completed = 0
+        self.virtual_time = 0.0
+        self.paused = False
+        self.cancelled = False
+        self.closed = closed
+        self.finished = threading.Event()
+
+    def wait(self) -> list:
+        self.finished.wait()
+        return self.results
+
+
+class SynthesisScheduler:
+    # One sliding window shared by every queued book: `limit()` jobs are kept in flight across all books and
+    # a free slot goes to the highest priority book, then to the one that got the least service for its
+    # weight (stride scheduling on job cost, e.g. characters)
+    def __init__(self, max_concurrency: int, limit=None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = limit
+        self.queues = []
+        self.in_flight = 0
+        self.loop = None
+        self.executor = None
+        self.thread = None
+        self.started = threading.Event()
+
+    def current_limit(self) -> int:
+        return max(1, min(self.max_concurrency, self.limit() if self.limit is not None else self.max_concurrency))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="synthesis-scheduler", daemon=True)
+        self.thread.start()
+        self.started.wait()
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="tts")
+        self.loop.call_soon(self.started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.executor.shutdown(wait=True)
+            self.loop.close()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def submit(self, name: str, jobs: list, worker, on_complete=None, priority: int = 0, weight: float = 1.0,
+               cost=None) -> SynthesisQueue:
+        queue = SynthesisQueue(name, jobs, worker, on_complete, priority, weight, cost)
+        self.loop.call_soon_threadsafe(self.add_queue, queue)
+        return queue
+
+    def open_queue(self, name: str, worker, on_complete=None, priority: int = 0, weight: float = 1.0,
+                   cost=None) -> SynthesisQueue:
+        queue = SynthesisQueue(name, [], worker, on_complete, priority, weight, cost, closed=False)
+        self.loop.call_soon_threadsafe(self.add_queue, queue)
+        return queue
+
+    def add_jobs(self, queue: SynthesisQueue, jobs: list):
+        def append():
+            if queue.cancelled:
+                return
+            if not queue.pending and queue.in_flight == 0:
+                # Idle while waiting for the extractor, it doesn't bank service for the time it had no jobs
+                queue.virtual_time = max(queue.virtual_time, self.current_virtual_time(queue))
+            for job in jobs:
+                queue.pending.append((len(queue.jobs), job))
+                queue.jobs.append(job)
+                queue.results.append(None)
+            self.fill_slots()
+
+        self.loop.call_soon_threadsafe(append)
+
+    def close_queue(self, queue: SynthesisQueue):
+        def close():
+            queue.closed = True
+            self.finish_if_done(queue)
+
+        self.loop.call_soon_threadsafe(close)
+
+    def update(self, queue: SynthesisQueue, priority: int = None, weight: float = None, paused: bool = None,
+               cancelled: bool = None):
+        def apply():
+            if priority is not None:
+                queue.priority = priority
+            if weight is not None:
+                queue.weight = max(0.01, weight)
+            if paused is not None:
+                queue.paused = paused
+            if cancelled:
+                queue.cancelled = True
+                queue.closed = True
+                queue.pending.clear()
+                self.finish_if_done(queue)
+            self.fill_slots()
+
+        self.loop.call_soon_threadsafe(apply)
+
+    def current_virtual_time(self, exclude: SynthesisQueue = None) -> float:
+        active = [other.virtual_time for other in self.queues if other is not exclude and (other.pending or other.in_flight)]
+        return min(active) if active else 0.0
+
+    def add_queue(self, queue: SynthesisQueue):
+        # A book joining late starts at the current virtual time, it gets its share from now on, not a backlog
+        queue.virtual_time = self.current_virtual_time()
+        self.queues.append(queue)
+        self.finish_if_done(queue)
+        self.fill_slots()
+
+    def next_job(self) -> list:
+        candidates = [queue for queue in self.queues if queue.pending and not queue.paused]
+        if not candidates:
+            return [None, None]
+
+        top_priority = max(queue.priority for queue in candidates)
+        queue = min(
+            (queue for queue in candidates if queue.priority == top_priority),
+            key=lambda queue: queue.virtual_time
+        )
+        index, job = queue.pending.popleft()
+        queue.virtual_time += queue.cost(job) / queue.weight
+        return [queue, (index, job)]
+
+    def fill_slots(self):
+        while self.in_flight < self.current_limit():
+            queue, next_job = self.next_job()
+            if queue is None:
+                return
+
+            index, job = next_job
+            queue.in_flight += 1
+            self.in_flight += 1
+            future = self.loop.run_in_executor(self.executor, queue.worker, job)
+            future.add_done_callback(lambda done, queue=queue, index=index: self.on_done(queue, index, done))
+
+    def on_done(self, queue: SynthesisQueue, index: int, future):
+        queue.in_flight -= 1
+        self.in_flight -= 1
+
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"❌ Synthesis job {index} of {queue.name} failed: {e}")
+            result = None
+
+        if isinstance(result, RetryLater):
+            queue.delayed += 1
+            self.loop.call_later(result.delay, self.requeue, queue, index)
+            self.fill_slots()
+            return
+
+        queue.completed += 1
+        queue.results[index] = result
+
+        if queue.on_complete is not None:
+            try:
+                queue.on_complete(queue.jobs[index], queue.results[index])
+            except Exception as e:
+                print(f"⚠️ Completion callback of {queue.name} failed: {e}")
+
+        self.finish_if_done(queue)
+        self.fill_slots()
+
+    def requeue(self, queue: SynthesisQueue, index: int):
+        queue.delayed -= 1
+        if not queue.cancelled:
+            # Ahead of the jobs that never ran, the book's packager is waiting for it
+            queue.pending.appendleft((index, queue.jobs[index]))
+        self.finish_if_done(queue)
+        self.fill_slots()
+
+    def finish_if_done(self, queue: SynthesisQueue):
+        if queue.closed and not queue.pending and queue.in_flight == 0 and queue.delayed == 0 \
+                and not queue.finished.is_set():
+            self.queues.remove(queue)
+            queue.finished.set()
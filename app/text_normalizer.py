@@ -0,0 +1,233 @@
+import hashlib
+import json
+import re
+import sys
+import time
+from functools import lru_cache
+
+# Bump when the normalization rules change, cached paragraph models built with an older version are stale
+NORMALIZER_VERSION = 1
+
+WORD_NUMBER_DASH = re.compile(r'\b([A-Za-z]+)-(\d+)\b')
+ELLIPSIS = re.compile(r'\s*\.(\s*\.)+\s*')
+
+
+def is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def boundary_at(text: str, index: int) -> bool:
+    # Whether \b can hold between text[index - 1] and text[index]
+    if index <= 0 or index >= len(text):
+        return True
+    return is_word_char(text[index - 1]) != is_word_char(text[index])
+
+
+def ends_overlap(first: str, second: str, first_cut: bool = True, second_cut: bool = True) -> bool:
+    # Whether an occurrence of first can end inside an occurrence of second. The cuts are the points where
+    # one starts/ends inside the other, which need a word boundary when that string is a key.
+    for size in range(1, min(len(first), len(second))):
+        if first[-size:] != second[:size]:
+            continue
+        if first_cut and not boundary_at(first, len(first) - size):
+            continue
+        if second_cut and not boundary_at(second, size):
+            continue
+        return True
+    return False
+
+
+def conflicts_with(key: str, fused_key: str, fused_value: str) -> bool:
+    # key comes later in the replacement order than fused_key. It can't share the alternation when a match of
+    # it could start before and overlap a match of fused_key (sequentially fused_key wins, in one pass the
+    # leftmost match does), or when it could match text produced by fused_value.
+    return (
+        ends_overlap(key, fused_key)
+        or key in fused_value
+        or fused_value in key
+        or ends_overlap(key, fused_value, first_cut=False)
+        or ends_overlap(fused_value, key, second_cut=False)
+    )
+
+
+def changes_word_edges(key: str, value: str) -> bool:
+    # A value whose first/last character differs in \w-ness from the key's moves the \b of neighbouring matches
+    if not value:
+        return True
+    return is_word_char(key[0]) != is_word_char(value[0]) or is_word_char(key[-1]) != is_word_char(value[-1])
+
+
+def expand_value(key: str, value: str) -> str:
+    # re.sub treats the value as a template (\\, \g<0>, ...), expand it once against the key itself
+    return re.match(re.escape(key), key).expand(value)
+
+
+def build_replacement_stages(replacements: dict) -> list:
+    # Keys are applied longest first, one re.sub per key. Consecutive keys are fused into one alternation as
+    # long as that gives the same result, a conflicting key (or one after a value that moves word boundaries)
+    # starts a new stage.
+    stages = []
+    keys = []
+    values = {}
+    blocked = False
+
+    for key, value in sorted(replacements.items(), key=lambda kv: len(kv[0]), reverse=True):
+        if not key:
+            continue
+
+        value = expand_value(key, value)
+        conflicts = blocked or any(conflicts_with(key, fused_key, values[fused_key]) for fused_key in keys)
+
+        if conflicts and keys:
+            stages.append(compile_stage(keys, values))
+            keys = []
+            values = {}
+
+        keys.append(key)
+        values[key] = value
+        blocked = changes_word_edges(key, value)
+
+    if keys:
+        stages.append(compile_stage(keys, values))
+
+    return stages
+
+
+def compile_stage(keys: list, values: dict) -> list:
+    pattern = re.compile(r'\b(?:{})\b'.format("|".join(re.escape(key) for key in keys)))
+    return [pattern, values]
+
+
+class TextNormalizer:
+    # clean_text/apply_replacements compiled once per replacement dictionary
+    def __init__(self, replacements: dict):
+        self.replacements = dict(replacements)
+        self.stages = build_replacement_stages(self.replacements)
+        self.version = get_normalizer_version(self.replacements)
+
+    def apply_replacements(self, text: str) -> str:
+        for pattern, values in self.stages:
+            text = pattern.sub(lambda match: values[match.group(0)], text)
+        return text
+
+    def clean(self, text: str, for_display: bool = False) -> str:
+        # strip + collapse newlines + collapse whitespace in one split/join
+        text = " ".join(text.split())
+
+        if not for_display:
+            text = WORD_NUMBER_DASH.sub(r'\1 \2', text)
+            text = self.apply_replacements(text)
+            # Any run of periods becomes "... ", unless it starts the text, then it's dropped
+            text = ELLIPSIS.sub(lambda match: "" if match.start() == 0 else "... ", text)
+
+        return text
+
+    def clean_batch(self, texts: list, for_display: bool = False) -> list:
+        # Books repeat a lot of lines (scene breaks, headings), each distinct one is normalized once
+        cleaned = {}
+        results = []
+        for text in texts:
+            result = cleaned.get(text)
+            if result is None:
+                result = self.clean(text, for_display)
+                cleaned[text] = result
+            results.append(result)
+        return results
+
+
+def get_normalizer_version(replacements: dict) -> str:
+    key_source = json.dumps({"version": NORMALIZER_VERSION, "replacements": replacements}, sort_keys=True,
+                            ensure_ascii=False)
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()[:16]
+
+
+@lru_cache(maxsize=8)
+def get_cached_normalizer(replacements_json: str) -> TextNormalizer:
+    return TextNormalizer(json.loads(replacements_json))
+
+
+def get_normalizer(config: dict) -> TextNormalizer:
+    use_edge_tts = config.get("use_edge_tts_service", False)
+    replacements = config.get("replacements_edge_tts" if use_edge_tts else "replacements", {})
+    return get_cached_normalizer(json.dumps(replacements, ensure_ascii=False))
+
+
+# Reference implementation, the normalizer output has to match it exactly ==================================
+
+def apply_replacements_sequential(text: str, replacements: dict) -> str:
+    for key, value in sorted(replacements.items(), key=lambda kv: len(kv[0]), reverse=True):
+        pattern = r'\b{}\b'.format(re.escape(key))
+        text = re.sub(pattern, value, text)
+    return text
+
+
+def clean_text_sequential(text: str, replacements: dict, for_display: bool = False) -> str:
+    text = text.strip()
+    text = re.sub(r'\n+', '\n', text)
+    text = re.sub(r'\s+', ' ', text)
+
+    if not for_display:
+        text = re.sub(r'\b([A-Za-z]+)-(\d+)\b', r'\1 \2', text)
+        if replacements:
+            text = apply_replacements_sequential(text, replacements)
+        text = re.sub(r'\s*\.(\s*\.)+\s*', '... ', text)
+        text = re.sub(r'^\.\.\.\s', "", text)
+
+    return text
+
+
+def verify_normalizer(normalizer: TextNormalizer, texts: list) -> dict:
+    mismatches = []
+    timings = {}
+
+    for for_display in [False, True]:
+        start = time.perf_counter()
+        expected = [clean_text_sequential(text, normalizer.replacements, for_display) for text in texts]
+        reference_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = normalizer.clean_batch(texts, for_display)
+        normalizer_seconds = time.perf_counter() - start
+
+        mode = "display" if for_display else "tts"
+        timings[mode] = [reference_seconds, normalizer_seconds]
+        mismatches += [
+            [mode, text, expected_text, actual_text]
+            for text, expected_text, actual_text in zip(texts, expected, actual)
+            if expected_text != actual_text
+        ]
+
+    return {"texts": len(texts), "stages": len(normalizer.stages), "timings": timings, "mismatches": mismatches}
+
+
+def read_epub_lines(epub_path) -> list:
+    from bs4 import BeautifulSoup
+    from ebooklib import epub
+
+    lines = []
+    for item in epub.read_epub(str(epub_path)).get_items_of_type(9):
+        lines += BeautifulSoup(item.get_content(), 'html.parser').get_text().splitlines()
+    return lines
+
+
+if __name__ == "__main__":
+    # python -m app.text_normalizer book.epub [more.epub ...] - compares the normalizer with the sequential
+    # implementation on every line of the books
+    from app.utils import get_config
+
+    corpus = []
+    for epub_path in sys.argv[1:]:
+        corpus += read_epub_lines(epub_path)
+
+    report = verify_normalizer(get_normalizer(get_config()), corpus)
+
+    print(f"🔤 {report['texts']} lines, {report['stages']} replacement stages")
+    for mode, (reference_seconds, normalizer_seconds) in report["timings"].items():
+        print(f"   {mode}: sequential {reference_seconds:.3f}s, normalizer {normalizer_seconds:.3f}s "
+              f"({reference_seconds / max(normalizer_seconds, 1e-9):.1f}x)")
+
+    for mode, text, expected_text, actual_text in report["mismatches"][:20]:
+        print(f"❌ [{mode}] {text!r}\n   expected: {expected_text!r}\n   got:      {actual_text!r}")
+
+    print(f"{'❌' if report['mismatches'] else '✅'} {len(report['mismatches'])} mismatches")
+    sys.exit(1 if report["mismatches"] else 0)
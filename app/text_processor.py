@@ -3,93 +3,137 @@ import re
 import time
 import json
 import datetime
+import itertools
+import multiprocessing
 import requests
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from ebooklib.epub import EpubBook, EpubItem
 from pydub import AudioSegment
 from pathlib import Path
 from ebooklib import epub
 from bs4 import BeautifulSoup, NavigableString, Tag
+from lxml import etree
+import lxml.html
 from tqdm import tqdm
 
-from utils import get_config, create_epub
+from app.utils import get_config, get_config_path, create_epub
+from app.text_normalizer import get_cached_normalizer, get_normalizer
 
 EPUB_DOCUMENT = 9
 
-CONFIG_PATH = Path("/app/config.json")
-if not CONFIG_PATH.exists():
-    raise FileNotFoundError("Missing config.json file.")
-config = json.loads(CONFIG_PATH.read_text())
+# Set by init(), importing the module reads no config
+config = None
+USE_EDGE_TTS = False
+ADD_STRUCTURE = False
+NORMALIZER = None
+EXTRACTION_PARSER = "lxml"
+EXTRACTION_WORKERS = 1
+
+XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>')
+# Elements whose strings BeautifulSoup's get_text() leaves out
+TEXT_EXCLUDED_TAGS = ["script", "style", "template", "rt", "rp"]
+# BeautifulSoup turns every string of only these into a single space or newline, outside of these tags
+ASCII_SPACES = " \n\t\f\r"
+WHITESPACE_PRESERVING_TAGS = ["pre", "textarea"]
+
+# Shared extraction workers, see start_extraction_pool
+EXTRACTION_POOL = None
+
+def init(loaded_config: dict = None):
+    # Called by the generator's init() and by every extraction worker, later calls change nothing
+    global config, USE_EDGE_TTS, ADD_STRUCTURE, NORMALIZER, EXTRACTION_PARSER, EXTRACTION_WORKERS
+    if config is not None:
+        return
 
-USE_EDGE_TTS = config.get("use_edge_tts_service", False)
-ADD_STRUCTURE = config.get("add_structure", False)
+    if loaded_config is None:
+        config_path = get_config_path()
+        if not config_path.exists():
+            raise FileNotFoundError("Missing config.json file.")
+        loaded_config = json.loads(config_path.read_text())
+    config = loaded_config
 
-def extract_paragraphs_from_epub_simpler(epub_path: Path) -> list:
-    book = epub.read_epub(str(epub_path))
-    paragraphs = []
+    USE_EDGE_TTS = config.get("use_edge_tts_service", False)
+    ADD_STRUCTURE = config.get("add_structure", False)
+    NORMALIZER = get_normalizer(config)
+
+    extraction = config.get("epub_extraction", {})
+    EXTRACTION_PARSER = extraction.get("parser", "lxml")
+    EXTRACTION_WORKERS = extraction.get("workers", min(4, os.cpu_count() or 1))
+
+def extract_paragraphs_from_epub_simpler(epub_path: Path, book: EpubBook = None) -> list:
+    paragraphs = list(iter_paragraph_window(epub_path, book))
+
+    print("Chapters:", [paragraph[4] for paragraph in paragraphs if paragraph[2] == 1])
+
+    print(paragraphs)
+
+    return paragraphs
+
+
+def iter_paragraph_window(epub_path: Path, book: EpubBook = None):
+    ignore_upto = get_config().get("ignore_upto_paragraph", 0)
+    take = get_config().get("take", 0)
+
+    # Only the documents up to the end of the requested window are parsed
+    paragraphs_iter = iter_paragraphs_from_epub(epub_path, book)
+    try:
+        yield from itertools.islice(
+            paragraphs_iter,
+            max(0, ignore_upto),
+            ignore_upto + take if take > 0 else None
+        )
+    finally:
+        paragraphs_iter.close()
+
+
+def iter_paragraphs_from_epub(epub_path: Path, book: EpubBook = None):
+    # Yields the paragraphs in book order while later documents are still being parsed
+    book = book or epub.read_epub(str(epub_path))
+    documents = [item for item in book.get_items() if item.get_type() == EPUB_DOCUMENT]
     counter = 1
-    section_counter = 1
-    chapter_texts = []
 
-    for item in book.get_items():
+    for document_lines in iter_document_lines(documents):
+        chapter_text = ''
+        for paragraph_text, cleaned_text, display_text in document_lines:
+            para_id = f"pgrf-{counter:05d}"
 
-        if item.get_type() == EPUB_DOCUMENT:
+            if chapter_text == '':
+                chapter_text = paragraph_text
+                yield [
+                    para_id,  # id
+                    cleaned_text,  # kokoro text
+                    1,  # is chapter title
+                    '',  # mp3 file name paragraph
+                    chapter_text,  # display text
+                    0,  # duration milliseconds
+                    0,  # cumulative duration milliseconds,
+                    '',  # mp3 file name chapter
+                    ''  # mp3 file name single
+                ]
+            else:
+                yield [
+                    para_id,
+                    cleaned_text,
+                    1 if re.search(r'chapter\s+\d+', cleaned_text.lower()) is not None else 0,
+                    '',
+                    display_text,
+                    0,
+                    0,
+                    '',
+                    ''
+                ]
 
-            soup = BeautifulSoup(item.get_content(), 'html.parser')
-            full_text = soup.get_text().strip()
-            if len(full_text) == 0:
-                continue
+            counter += 1
 
-            chapter_text = ''
-            all_paragraphs = full_text.splitlines()
-            for paragraph_text in all_paragraphs:
-                cleaned_text = clean_text(paragraph_text)
-                if not is_valid_paragraph(cleaned_text):
-                    continue
+    if ADD_STRUCTURE == True:
 
-                para_id = f"pgrf-{counter:05d}"
-
-                if chapter_text == '':
-                    chapter_text = paragraph_text
-                    chapter_text_cleaned = cleaned_text
-                    chapter_texts.append(chapter_text)
-                    paragraphs.append([
-                        para_id,  # id
-                        chapter_text_cleaned,  # kokoro text
-                        1,  # is chapter title
-                        '',  # mp3 file name paragraph
-                        chapter_text,  # display text
-                        0,  # duration milliseconds
-                        0,  # cumulative duration milliseconds,
-                        '',  # mp3 file name chapter
-                        ''  # mp3 file name single
-                    ])
-
-                    counter += 1
-                else:
-                    paragraphs.append([
-                        para_id,
-                        cleaned_text,
-                        1 if re.search(r'chapter\s+\d+', cleaned_text.lower()) is not None else 0,
-                        '',
-                        clean_text(paragraph_text, True),
-                        0,
-                        0,
-                        '',
-                        ''
-                    ])
-
-                    counter += 1
-
-    if ADD_STRUCTURE == True: 
-
-        # Structure section start 
-        
-        chapter_texts.append("Structure")
+        # Structure section start
 
         para_id = f"pgrf-{counter:05d}"
-        paragraphs.append([
+        yield [
             para_id,
             "Structure",
             1,
@@ -99,15 +143,15 @@ def extract_paragraphs_from_epub_simpler(epub_path: Path) -> list:
             0,
             '',
             ''
-        ])
+        ]
 
         counter += 1
 
-        for item in book.get_items_of_type(EPUB_DOCUMENT):
+        for item in documents:
 
             para_id = f"pgrf-{counter:05d}"
             cleaned_text = clean_text(item.get_name())
-            paragraphs.append([
+            yield [
                 para_id,
                 cleaned_text,
                 0,
@@ -117,26 +161,103 @@ def extract_paragraphs_from_epub_simpler(epub_path: Path) -> list:
                 0,
                 '',
                 ''
-            ])
+            ]
 
             counter += 1
 
         # Structure section end
 
-    print("Chapters:", chapter_texts)
 
-    ignore_upto = get_config().get("ignore_upto_paragraph", 0)
-    take = get_config().get("take", 0)
+def iter_document_lines(documents: list):
+    # Documents are parsed in a process pool a few ahead of the consumer, in order. Closing the generator
+    # cancels whatever hasn't started yet.
+    if EXTRACTION_WORKERS <= 1 or len(documents) <= 1:
+        for item in documents:
+            yield parse_document_lines(item.get_content(), EXTRACTION_PARSER)
+        return
 
-    if ignore_upto > 0:
-        paragraphs = paragraphs[ignore_upto:]
+    executor = EXTRACTION_POOL or create_extraction_pool()
+    pending = deque()
+    items = iter(documents)
 
-    if take > 0:
-        paragraphs = paragraphs[:take]
+    try:
+        for item in itertools.islice(items, EXTRACTION_WORKERS * 2):
+            pending.append(executor.submit(parse_document_lines, item.get_content(), EXTRACTION_PARSER))
 
-    print(paragraphs)
+        while pending:
+            document_lines = pending.popleft().result()
 
-    return paragraphs
+            item = next(items, None)
+            if item is not None:
+                pending.append(executor.submit(parse_document_lines, item.get_content(), EXTRACTION_PARSER))
+
+            yield document_lines
+    finally:
+        if executor is EXTRACTION_POOL:
+            for future in pending:
+                future.cancel()
+        else:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_extraction_pool() -> ProcessPoolExecutor:
+    # Spawned like the post-processing workers, each one sets itself up from the config it is handed
+    return ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=init, initargs=(config,))
+
+
+def start_extraction_pool():
+    # One pool for every book of a run
+    global EXTRACTION_POOL
+    if EXTRACTION_WORKERS > 1 and EXTRACTION_POOL is None:
+        EXTRACTION_POOL = create_extraction_pool()
+        EXTRACTION_POOL.submit(int).result()
+
+
+def stop_extraction_pool():
+    global EXTRACTION_POOL
+    if EXTRACTION_POOL is not None:
+        EXTRACTION_POOL.shutdown(wait=True)
+        EXTRACTION_POOL = None
+
+
+def parse_document_lines(content: bytes, parser: str = "lxml") -> list:
+    # [raw line, tts text, display text] of every valid line of one document
+    lines = document_text(content, parser).strip().splitlines()
+    return [
+        [line, cleaned_text, clean_text(line, True)]
+        for line, cleaned_text in zip(lines, clean_texts(lines))
+        if is_valid_paragraph(cleaned_text)
+    ]
+
+
+def document_text(content: bytes, parser: str = "lxml") -> str:
+    # Same text as BeautifulSoup's html.parser get_text(), lxml only falls back for what it handles differently
+    if parser == "lxml" and b"<![CDATA[" not in content:
+        try:
+            markup = XML_DECLARATION.sub("", content.decode("utf-8"), count=1)
+            root = lxml.html.document_fromstring(markup)
+        except (UnicodeDecodeError, ValueError, etree.ParserError):
+            root = None
+
+        if root is not None:
+            etree.strip_elements(root, *TEXT_EXCLUDED_TAGS, with_tail=False)
+            collapse_blank_strings(root)
+            return "".join(root.itertext())
+
+    return BeautifulSoup(content, 'html.parser').get_text()
+
+
+def collapse_blank_strings(root):
+    preserved = set()
+    for element in root.iter(*WHITESPACE_PRESERVING_TAGS):
+        preserved.update(element.iter())
+
+    for element in root.iter():
+        if element.text and element not in preserved and not element.text.strip(ASCII_SPACES):
+            element.text = "\n" if "\n" in element.text else " "
+        if element.tail and element.getparent() not in preserved and not element.tail.strip(ASCII_SPACES):
+            element.tail = "\n" if "\n" in element.tail else " "
 
 def extract_paragraphs_from_epub(epub_path: Path) -> list:
     book = epub.read_epub(str(epub_path))
@@ -195,7 +316,7 @@ def extract_paragraphs_from_epub(epub_path: Path) -> list:
                     if is_valid_paragraph(cleaned_text):
                         paragraphs.append([
                             para_id,
-                            clean_text(italics_safe_text),
+                            cleaned_text,
                             1 if re.search(r'chapter\s+\d+', cleaned_text.lower()) is not None else 0,
                             '',
                             clean_text(italics_safe_text, True),
@@ -281,32 +402,17 @@ def is_valid_paragraph(text: str) -> bool:
 
 
 def clean_text(text: str, for_display: bool = False) -> str:
-    text = text.strip()
-    text = re.sub(r'\n+', '\n', text)  # Collapse multiple newlines into a single newline
-    text = re.sub(r'\s+', ' ', text)  # Collapse all multiple spaces into a single space
+    # Whitespace collapse, word-number dashes, replacements from config and "..." runs, see text_normalizer
+    return NORMALIZER.clean(text, for_display)
 
-    if not for_display:
-        text = fix_word_number_dash(text)  # Fix word-number dash issues
 
-        # Apply replacements from config if available
-        replacements = config.get("replacements", {}) if (USE_EDGE_TTS == False) else config.get(
-            "replacements_edge_tts", {})
-        if replacements:
-            text = apply_replacements(text, replacements)
-
-        text = re.sub(r'\s*\.(\s*\.)+\s*', '... ',
-                      text)  # Collapse groups of any combo of multiple periods to one "..."
-        text = re.sub(r'^\.\.\.\s', "", text)  # Remove leading "... " from text
-
-    return text
+def clean_texts(texts: list, for_display: bool = False) -> list:
+    return NORMALIZER.clean_batch(texts, for_display)
 
 
 def apply_replacements(text: str, replacements: dict) -> str:
-    # Go through each replacement, escaping keys to treat them as plain text
-    for key, value in sorted(replacements.items(), key=lambda kv: len(kv[0]), reverse=True):
-        pattern = r'\b{}\b'.format(re.escape(key))
-        text = re.sub(pattern, value, text)
-    return text
+    # Longest key first, whole words only, compiled once per replacement dictionary
+    return get_cached_normalizer(json.dumps(replacements, ensure_ascii=False)).apply_replacements(text)
 
 
 def apply_replacements_old(text: str, replacements: dict) -> str:
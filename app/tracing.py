@@ -0,0 +1,205 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from app.manifest import write_bytes_atomic
+
+# Opt-in spans of every pipeline stage and TTS attempt, written per book in Chrome trace-event JSON (open it in
+# Perfetto, chrome://tracing or speedscope). Off by default, span() then hands back one shared no-op object.
+
+TRACE_FILE = "trace.json"
+
+
+class Tracer:
+    # Finished spans go into one deque, appends are thread safe without a lock. Every span is tagged with the
+    # book of the thread that recorded it, each book writes out and drops its own spans once it is done.
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.events = deque()
+        self.thread_names = {}  # (pid, tid) -> name
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def span(self, name: str, category: str = "stage", **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def traced(self, name: str, category: str = "stage"):
+        # Decorator form of span(), checks enabled on every call so it can be switched on after import
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Span(self, name, category, {}):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def add_span(self, name: str, category: str, start: float, **args):
+        # A span that ends now and started at start, a time.monotonic() reading taken before the work
+        if self.enabled:
+            span = Span(self, name, category, args)
+            span.start = int(start * 1_000_000_000)
+            span.end()
+
+    def iter_spans(self, items, name: str, category: str = "stage"):
+        # A span for each item an iterator takes to produce, e.g. a batch of extracted paragraphs
+        if not self.enabled:
+            yield from items
+            return
+        iterator = iter(items)
+        while True:
+            with Span(self, name, category, {}):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def book(self, book: str):
+        # with TRACER.book(name): spans of this thread belong to the book
+        if not self.enabled:
+            return NULL_SPAN
+        return BookContext(self, book)
+
+    def current_book(self) -> str | None:
+        return getattr(self.local, "book", None)
+
+    def record(self, event: dict):
+        if getattr(self.local, "named_in", None) != event["pid"]:
+            # Once per thread and process, a forked worker inherits the parent's thread locals
+            self.thread_names[(event["pid"], event["tid"])] = threading.current_thread().name
+            self.local.named_in = event["pid"]
+        self.events.append(event)
+
+    def drain(self) -> list:
+        # Everything recorded so far, a worker process hands it to the parent: [events, thread names]
+        events = []
+        while True:
+            try:
+                events.append(self.events.popleft())
+            except IndexError:
+                break
+        return [events, list(self.thread_names.items())]
+
+    def merge(self, recorded: list, book: str = None):
+        events, thread_names = recorded
+        for event in events:
+            if book is not None:
+                event["args"].setdefault("book", book)
+            self.events.append(event)
+        self.thread_names.update(dict((tuple(key), name) for key, name in thread_names))
+
+    def take(self, book: str) -> list:
+        # Removes the spans of one book, the other books' spans stay and spans of no book are dropped
+        with self.lock:
+            taken = []
+            kept = []
+            for _ in range(len(self.events)):
+                event = self.events.popleft()
+                event_book = event["args"].get("book")
+                if event_book == book:
+                    taken.append(event)
+                elif event_book is not None:
+                    kept.append(event)
+            self.events.extend(kept)
+        return taken
+
+    def write(self, path: Path, book: str) -> int:
+        events = self.take(book)
+        main_pid = os.getpid()
+        metadata = []
+        for pid in sorted({event["pid"] for event in events}):
+            metadata.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                             "args": {"name": "kokoro" if pid == main_pid else f"postprocess worker {pid}"}})
+        for pid, tid in sorted({(event["pid"], event["tid"]) for event in events}):
+            metadata.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                             "args": {"name": self.thread_names.get((pid, tid), str(tid))}})
+
+        trace = {"traceEvents": metadata + events, "displayTimeUnit": "ms", "otherData": {"book": book}}
+        write_bytes_atomic(path, json.dumps(trace, ensure_ascii=False).encode("utf-8"))
+        return len(events)
+
+
+class Span:
+    __slots__ = ["tracer", "name", "category", "args", "start"]
+
+    def __init__(self, tracer: Tracer, name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def set(self, **args) -> "Span":
+        # Arguments only known once the work is done: host, status, bytes
+        self.args.update(args)
+        return self
+
+    def __enter__(self):
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        self.end()
+        return False
+
+    def end(self):
+        end = time.monotonic_ns()
+        book = self.tracer.current_book()
+        if book is not None:
+            self.args.setdefault("book", book)
+        # CLOCK_MONOTONIC is shared by the worker processes, their spans line up with the parent's
+        self.tracer.record({
+            "name": self.name,
+            "cat": self.category,
+            "ph": "X",
+            "ts": self.start / 1000,
+            "dur": (end - self.start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": self.args
+        })
+
+
+class NullSpan:
+    def set(self, **args) -> "NullSpan":
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class BookContext:
+    def __init__(self, tracer: Tracer, book: str):
+        self.tracer = tracer
+        self.book = book
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = self.tracer.current_book()
+        self.tracer.local.book = self.book
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.local.book = self.previous
+        return False
+
+
+def configure_tracing(config: dict, argv: list):
+    # "tracing": {"enabled": true} or --trace on the command line
+    TRACER.enabled = config.get("tracing", {}).get("enabled", False) or "--trace" in argv
+
+
+NULL_SPAN = NullSpan()
+TRACER = Tracer()
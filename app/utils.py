@@ -1,4 +1,5 @@
 import json
+import os
 import sys
 from pathlib import Path
 
@@ -18,9 +19,13 @@ def get_folder_name(path: Path) -> str:
 
     return path.name
 
+def get_config_path() -> Path:
+    # KOKORO_CONFIG points a run (e.g. the benchmark) to another config file
+    return Path(os.environ.get("KOKORO_CONFIG", "/app/config.json"))
+
 def get_config() -> json:
     # Load config
-    config_path = Path("/app/config.json")
+    config_path = get_config_path()
     if not config_path.exists():
         raise FileNotFoundError("Missing config.json file.")
     config = json.loads(config_path.read_text())
@@ -1,4 +1,9 @@
 #!/usr/bin/env bash
 
-echo "Restarting docker"
-docker compose down && docker compose up -d
\ No newline at end of file
+if [ -n "$1" ]; then
+  echo "Cancelling job $1"
+  curl -s -X POST "http://localhost:9000/jobs/$1/cancel"
+else
+  echo "Restarting docker"
+  docker compose down && docker compose up -d
+fi
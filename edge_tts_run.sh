@@ -1,4 +1,4 @@
 #!/usr/bin/env bash
 
 echo "Running command"
-docker compose exec generator python app/generate_audiobook.py --chapterize --use_edge_tts
\ No newline at end of file
+docker compose exec generator python -m app.generate_audiobook --chapterize --use_edge_tts
\ No newline at end of file
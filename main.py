@@ -1,17 +1,98 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import Body, FastAPI, Header, Request
+from app.controller.book_controller import init_books
 from app.controller.book_controller import list_books as book_controller_list_books
 from app.controller.book_controller import book_detail as book_controller_book_detail
 from app.controller.book_controller import get_content as book_controller_get_content
-app = FastAPI()
+from app.controller.book_controller import get_playlist as book_controller_get_playlist
+from app.controller.book_controller import get_paragraph_at as book_controller_get_paragraph_at
+from app.controller.book_controller import get_paragraph_range as book_controller_get_paragraph_range
+from app.controller.book_controller import get_stream_segment as book_controller_get_stream_segment
+from app.controller.job_controller import control_job as job_controller_control_job
+from app.controller.job_controller import create_job as job_controller_create_job
+from app.controller.job_controller import create_jobs_for_all as job_controller_create_jobs_for_all
+from app.controller.job_controller import get_job as job_controller_get_job
+from app.controller.job_controller import job_events as job_controller_job_events
+from app.controller.job_controller import list_jobs as job_controller_list_jobs
+from app.controller.job_controller import start_jobs, stop_jobs
+from app.controller.metrics_controller import get_metrics as metrics_controller_get_metrics
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_books()
+    start_jobs()
+    yield
+    stop_jobs()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/books/")
-def list_books():
-    return book_controller_list_books()
+def list_books(offset: int = 0, limit: int | None = None, fields: str | None = None,
+               if_none_match: str | None = Header(None)):
+    return book_controller_list_books(offset, limit, fields, if_none_match)
 
 @app.get("/books/{book_id:str}")
-def book_detail(book_id: str):
-    return book_controller_book_detail(book_id)
+def book_detail(book_id: str, fields: str | None = None, if_none_match: str | None = Header(None)):
+    return book_controller_book_detail(book_id, fields, if_none_match)
+
+@app.get("/books/{book_id:str}/paragraphs/at/{position_ms:int}")
+def get_paragraph_at(book_id: str, position_ms: int, before: int = 5, after: int = 5):
+    return book_controller_get_paragraph_at(book_id, position_ms, before, after)
+
+@app.get("/books/{book_id:str}/paragraphs")
+def get_paragraph_range(book_id: str, from_id: str | None = None, to_id: str | None = None, limit: int = 5):
+    return book_controller_get_paragraph_range(book_id, from_id, to_id, limit)
+
+@app.get("/books/{book_id:str}/playlist.m3u8")
+def get_playlist(book_id: str):
+    return book_controller_get_playlist(book_id)
+
+@app.get("/books/{book_id:str}/{file_name:str}")
+def get_stream_segment(book_id: str, file_name: str):
+    return book_controller_get_stream_segment(book_id, file_name)
 
 @app.get("/get-content/{file_path:path}")
-def get_content(file_path: str):
-    return book_controller_get_content(file_path)
\ No newline at end of file
+def get_content(file_path: str, request: Request):
+    return book_controller_get_content(file_path, dict(request.headers))
+
+@app.post("/jobs")
+def create_job(epub: str = Body(...), priority: int | None = Body(None), weight: float | None = Body(None),
+               chapterize: bool = Body(True)):
+    return job_controller_create_job(epub, priority, weight, chapterize)
+
+@app.post("/jobs/all")
+def create_jobs_for_all(chapterize: bool = Body(True, embed=True)):
+    return job_controller_create_jobs_for_all(chapterize)
+
+@app.get("/jobs")
+def list_jobs():
+    return job_controller_list_jobs()
+
+@app.get("/jobs/{job_id:str}")
+def get_job(job_id: str):
+    return job_controller_get_job(job_id)
+
+@app.get("/jobs/{job_id:str}/events")
+def job_events(job_id: str):
+    return job_controller_job_events(job_id)
+
+@app.post("/jobs/{job_id:str}/pause")
+def pause_job(job_id: str):
+    return job_controller_control_job(job_id, "pause")
+
+@app.post("/jobs/{job_id:str}/resume")
+def resume_job(job_id: str):
+    return job_controller_control_job(job_id, "resume")
+
+@app.post("/jobs/{job_id:str}/cancel")
+def cancel_job(job_id: str):
+    return job_controller_control_job(job_id, "cancel")
+
+@app.post("/jobs/{job_id:str}/priority")
+def reprioritize_job(job_id: str, priority: int | None = Body(None), weight: float | None = Body(None)):
+    return job_controller_control_job(job_id, "priority", priority, weight)
+
+@app.get("/metrics")
+def get_metrics():
+    return metrics_controller_get_metrics()
@@ -1,6 +1,7 @@
 #!/usr/bin/env bash
 
-echo "Running command"
-docker compose down
-docker compose up -d 
-docker compose exec generator python app/generate_audiobook.py --chapterize
\ No newline at end of file
+echo "Queueing every book"
+docker compose up -d
+# The service runs the conversions, progress: curl http://localhost:9000/jobs
+until curl -s -o /dev/null http://localhost:9000/jobs; do sleep 1; done
+curl -s -X POST http://localhost:9000/jobs/all -H "Content-Type: application/json" -d '{"chapterize": true}'
@@ -0,0 +1,31 @@
+from app.mock_tts_server import frame_header
+from app.mp3_concat import build_xing_frame
+from app.mp3_frames import build_toc, parse_frame_header, silent_frames
+
+# MPEG-2 layer III, 24 kHz mono like Kokoro: 576 samples, 24 ms per frame
+HEADER = frame_header(64)
+FRAME_MS = 24
+ID3_TAG = b"ID3\x03\x00\x00\x00\x00\x00\x0a" + bytes(10)
+
+
+def silent_mp3(frame_count: int) -> bytes:
+    return silent_frames(HEADER, frame_count)
+
+
+def voiced_mp3(frame_count: int, bits: int = 2000) -> bytes:
+    # Frames whose side info claims bits of main data, frame_activity() reads them as speech
+    frame = bytearray(silent_mp3(1))
+    side_info = int.from_bytes(frame[4:13], "big") | (bits & 0xFFF) << (9 * 8 - 9 - 12)
+    frame[4:13] = side_info.to_bytes(9, "big")
+    return bytes(frame) * frame_count
+
+
+def info_mp3(frame_count: int) -> bytes:
+    # An Info frame with frame count, byte count and TOC in front of the audio, like encoders write
+    audio = silent_mp3(frame_count)
+    header = parse_frame_header(HEADER)
+    size = len(build_xing_frame(header, 0, 0, [0] * 100, False))
+    samples = list(range(0, frame_count * header.samples, header.samples))
+    offsets = [size + index * header.frame_size for index in range(frame_count)]
+    toc = build_toc(samples, offsets, frame_count * header.samples, size + len(audio))
+    return build_xing_frame(header, frame_count, size + len(audio), toc, False) + audio
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from app.chunk_planner import plan_chunks, split_long_text
+
+WORDS = "the river ran past the old mill and under the bridge where nobody had walked for years".split()
+
+
+def make_text(seed: int, sentences: int) -> str:
+    rng = random.Random(seed)
+    return " ".join(
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 40))).capitalize() + rng.choice([".", "?", "!"])
+        for _ in range(sentences)
+    )
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_split_long_text_bounds(seed):
+    text = make_text(seed, 30)
+    pieces = split_long_text(text, 400, 600)
+
+    assert all(0 < len(piece) <= 600 for piece in pieces)
+    # Nothing is lost or reordered
+    assert " ".join(pieces).split() == text.split()
+
+
+def test_split_long_text_cuts_long_sentences_at_clauses_then_words():
+    clauses = ", ".join(" ".join(WORDS) for _ in range(10))
+    no_punctuation = " ".join(WORDS * 20)
+
+    for text in [clauses, no_punctuation]:
+        pieces = split_long_text(text, 400, 600)
+        assert len(pieces) > 1
+        assert all(len(piece) <= 600 for piece in pieces)
+        assert " ".join(pieces).split() == text.split()
+
+
+def test_split_long_text_keeps_short_text():
+    assert split_long_text("One sentence. Another one.", 400, 600) == ["One sentence. Another one."]
+
+
+def test_plan_chunks_packs_short_paragraphs_only():
+    def job(para_id: str, text: str, is_chapter: int = 0) -> tuple:
+        return [para_id, text, is_chapter], text
+
+    jobs = [
+        job("1", "Chapter One", 1), job("2", "Yes."), job("3", "No."), job("4", make_text(1, 30)), job("5", "Maybe.")
+    ]
+    groups = plan_chunks(jobs, 400, 600, 80, keep_alone=lambda job: job[1] == "Maybe.")
+
+    assert [[job[0][0] for job in group.jobs] for group in groups] == [["1"], ["2", "3"], ["4"], ["5"]]
+    assert len(groups[2].segments) > 1
@@ -0,0 +1,64 @@
+from app.manifest import BookManifest
+from tests.helpers import FRAME_MS, silent_mp3
+
+
+def make_paragraphs(texts: list) -> list:
+    return [[f"p{index}", text, 0, f"p{index}.mp3", text, 0, 0, None, None] for index, text in enumerate(texts)]
+
+
+def test_adopts_only_complete_files_of_new_rows(tmp_path):
+    paragraphs = make_paragraphs(["First.", "Second.", "Third.", "Fourth."])
+    (tmp_path / "p0.mp3").write_bytes(silent_mp3(50))
+    # Cut off inside the last frame, like a crash of a non-atomic writer leaves it
+    (tmp_path / "p1.mp3").write_bytes(silent_mp3(50)[:-10])
+    (tmp_path / "p2.mp3").write_bytes(b"")
+
+    manifest = BookManifest(tmp_path)
+    manifest.sync_paragraphs(paragraphs)
+    manifest.adopt_existing_files()
+
+    assert manifest.pending_para_ids() == {"p1", "p2", "p3"}
+    assert manifest.durations(["p0"]) == {"p0": 50 * FRAME_MS}
+    manifest.close()
+
+
+def test_changed_text_is_synthesized_again(tmp_path):
+    manifest = BookManifest(tmp_path)
+    manifest.sync_paragraphs(make_paragraphs(["First.", "Second."]))
+    for name in ["p0.mp3", "p1.mp3"]:
+        (tmp_path / name).write_bytes(silent_mp3(50))
+    manifest.adopt_existing_files()
+    assert manifest.pending_para_ids() == set()
+
+    manifest.sync_paragraphs(make_paragraphs(["First.", "Second, with a new replacement."]))
+    manifest.adopt_existing_files()
+
+    assert manifest.pending_para_ids() == {"p1"}
+    # The audio of the old text is gone, not adopted back
+    assert not (tmp_path / "p1.mp3").exists()
+    manifest.close()
+
+
+def test_attempted_rows_are_not_adopted(tmp_path):
+    manifest = BookManifest(tmp_path)
+    manifest.sync_paragraphs(make_paragraphs(["First."]))
+    manifest.mark_attempt(["p0"])
+    # Whatever an interrupted attempt left behind
+    (tmp_path / "p0.mp3").write_bytes(silent_mp3(50))
+
+    manifest.adopt_existing_files()
+
+    assert manifest.pending_para_ids() == {"p0"}
+    manifest.close()
+
+
+def test_done_rows_with_a_changed_file_are_pending(tmp_path):
+    manifest = BookManifest(tmp_path)
+    manifest.sync_paragraphs(make_paragraphs(["First."]))
+    (tmp_path / "p0.mp3").write_bytes(silent_mp3(50))
+    manifest.adopt_existing_files()
+
+    (tmp_path / "p0.mp3").write_bytes(silent_mp3(40))
+
+    assert manifest.pending_para_ids() == {"p0"}
+    manifest.close()
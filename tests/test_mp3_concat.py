@@ -0,0 +1,56 @@
+import io
+
+from mutagen.mp3 import MP3
+
+from app.mp3_concat import Mp3Appender, concat_mp3s
+from app.mp3_frames import scan_duration_ms, scan_frames
+from tests.helpers import FRAME_MS, ID3_TAG, info_mp3, silent_mp3
+
+
+def test_appender_duration(tmp_path):
+    first = tmp_path / "first.mp3"
+    second = tmp_path / "second.mp3"
+    first.write_bytes(ID3_TAG + silent_mp3(50))
+    second.write_bytes(info_mp3(80))
+
+    appender = Mp3Appender(tmp_path / "book.mp3")
+    assert appender.append(first)[1:] == [0, 50 * FRAME_MS]
+    # The Info frame of the second file is not audio
+    assert appender.append(second)[1:] == [50 * FRAME_MS, 80 * FRAME_MS]
+    silence_ms = appender.append_silence(300)
+    result = appender.close()
+
+    assert silence_ms == 13 * FRAME_MS
+    assert result["duration_ms"] == (50 + 80 + 13) * FRAME_MS
+    assert result["frames"] == 50 + 80 + 13
+
+    output = (tmp_path / "book.mp3").read_bytes()
+    assert scan_duration_ms(scan_frames(output)) == result["duration_ms"]
+    assert abs(MP3(io.BytesIO(output)).info.length * 1000 - result["duration_ms"]) < FRAME_MS
+    assert not (tmp_path / "book.mp3.tmp").exists()
+
+
+def test_concat_mp3s_reports_offsets(tmp_path):
+    paths = []
+    for index, frame_count in enumerate([10, 20, 30]):
+        path = tmp_path / f"{index}.mp3"
+        path.write_bytes(silent_mp3(frame_count))
+        paths.append(path)
+
+    offsets = []
+    result = concat_mp3s(paths, tmp_path / "book.mp3", lambda index, path, byte_offset, ms_offset, duration_ms:
+                         offsets.append([ms_offset, duration_ms]))
+
+    assert offsets == [[0, 10 * FRAME_MS], [10 * FRAME_MS, 20 * FRAME_MS], [30 * FRAME_MS, 30 * FRAME_MS]]
+    assert result["duration_ms"] == 60 * FRAME_MS
+
+
+def test_appender_abort_leaves_nothing(tmp_path):
+    source = tmp_path / "source.mp3"
+    source.write_bytes(silent_mp3(10))
+
+    appender = Mp3Appender(tmp_path / "book.mp3")
+    appender.append(source)
+    appender.abort()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["source.mp3"]
@@ -0,0 +1,75 @@
+import io
+import struct
+
+import pytest
+from mutagen.mp3 import MP3
+
+from app.mp3_frames import Mp3FormatError, append_silence, scan_duration_ms, scan_frames, split_audio, xing_offset
+from tests.helpers import FRAME_MS, ID3_TAG, info_mp3, silent_mp3, voiced_mp3
+
+
+def read_info_counts(data: bytes) -> list:
+    offset, header = scan_frames(data).info_frame
+    tag_offset = offset + xing_offset(header)
+    return list(struct.unpack(">II", data[tag_offset + 8:tag_offset + 16]))
+
+
+def test_append_silence_adds_whole_frames():
+    output, duration = append_silence(silent_mp3(100), 500)
+
+    # 500 ms is rounded up to 21 frames
+    assert duration == (100 + 21) * FRAME_MS
+    assert scan_duration_ms(scan_frames(output)) == duration
+
+
+def test_append_silence_keeps_id3_tag():
+    output, duration = append_silence(ID3_TAG + silent_mp3(50), 200)
+
+    assert output.startswith(ID3_TAG)
+    assert scan_duration_ms(scan_frames(output)) == duration
+
+
+def test_append_silence_updates_info_frame():
+    data = info_mp3(100)
+    output, duration = append_silence(data, 500)
+
+    info_offset = scan_frames(output).info_frame[0]
+    assert read_info_counts(output) == [121, len(output) - info_offset]
+    # Players take the duration from the Info frame
+    assert abs(MP3(io.BytesIO(output)).info.length * 1000 - duration) < FRAME_MS
+
+
+def test_append_silence_round_trip():
+    # Silence appended to audio that already had silence appended, the Info frame stays consistent
+    output, _ = append_silence(info_mp3(100), 500)
+    output, duration = append_silence(output, 300)
+
+    assert duration == (100 + 21 + 13) * FRAME_MS
+    assert read_info_counts(output)[0] == 134
+    assert scan_duration_ms(scan_frames(output)) == duration
+
+
+def test_split_audio_cuts_in_the_pause():
+    data = voiced_mp3(40) + silent_mp3(20) + voiced_mp3(40)
+    first, second = split_audio(data, [1, 1], 600, 250)
+
+    assert first + second == data
+    # The cut keeps half the minimum pause on each side
+    assert first.startswith(voiced_mp3(40)) and second.endswith(voiced_mp3(40))
+    assert len(first) > len(voiced_mp3(40)) + 5 * len(silent_mp3(1))
+    assert len(second) > len(voiced_mp3(40)) + 5 * len(silent_mp3(1))
+
+
+def test_split_audio_rejects_short_pauses():
+    with pytest.raises(Mp3FormatError):
+        split_audio(voiced_mp3(40) + silent_mp3(5) + voiced_mp3(40), [1, 1], 600, 250)
+
+    with pytest.raises(Mp3FormatError):
+        split_audio(voiced_mp3(80), [1, 1], 600, 250)
+
+
+def test_split_audio_rejects_pauses_far_from_the_weights():
+    # The only pause is at a quarter of the audio, the weights put the cut in the middle
+    data = voiced_mp3(20) + silent_mp3(20) + voiced_mp3(100)
+    with pytest.raises(Mp3FormatError):
+        split_audio(data, [1, 1], 600, 250)
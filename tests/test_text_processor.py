@@ -0,0 +1,5 @@
+from app.text_processor import fix_word_number_dash
+
+
+def test_fix_word_number_dash():
+    assert fix_word_number_dash("Arthur-1 arthur 1 arthur - 1") == "Arthur 1 arthur 1 arthur - 1"